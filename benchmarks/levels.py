@@ -0,0 +1,85 @@
+import os
+import random
+import shutil
+
+# Tileset gids, same tilesheet as level_1
+LIGHT_GID, SHADOW_GID, WALL_GID = 1, 2, 4
+
+TEMPLATE_DIR = 'graphics/levels/level_1'
+
+
+def level_name(width, height, density, infinite=False):
+    return f'bench_{width}x{height}_d{int(density * 100)}' + ('_inf' if infinite else '')
+
+
+def generate_walls(width, height, density, seed=0):
+    # Solid border, a floor every 8 rows so entities have something to stand on,
+    # and random walls sprinkled in at the given density
+    rng = random.Random(seed)
+    walls = bytearray(width * height)
+    for y in range(height):
+        for x in range(width):
+            if x in (0, width - 1) or y in (0, height - 1) or (y % 8 == 7 and rng.random() < 0.9) or rng.random() < density:
+                walls[y * width + x] = 1
+    return walls
+
+
+def open_cells(walls, width, height, count, seed=0):
+    # Free cells standing on a wall, used for spawns and entity placement
+    rng = random.Random(seed + 1)
+    cells = [(x, y) for y in range(1, height - 1) for x in range(1, width - 1)
+             if not walls[y * width + x] and walls[(y + 1) * width + x]]
+    rng.shuffle(cells)
+    return cells[:count]
+
+
+def csv_layer(layer_id, name, width, height, gids):
+    rows = [','.join(str(gids[y * width + x]) for x in range(width)) for y in range(height)]
+    return (f' <layer id="{layer_id}" name="{name}" width="{width}" height="{height}">\n'
+            f'  <data encoding="csv">\n' + ',\n'.join(rows) + '\n</data>\n </layer>\n')
+
+
+def chunked_layer(layer_id, name, width, height, gids, chunk_size=16):
+    # Same layer in Tiled's infinite map format, empty chunks are left out like Tiled does
+    chunks = []
+    for y0 in range(0, height, chunk_size):
+        for x0 in range(0, width, chunk_size):
+            rows = [[gids[y * width + x] if x < width and y < height else 0 for x in range(x0, x0 + chunk_size)]
+                    for y in range(y0, y0 + chunk_size)]
+            if any(any(row) for row in rows):
+                chunks.append(f'   <chunk x="{x0}" y="{y0}" width="{chunk_size}" height="{chunk_size}">\n'
+                              + ',\n'.join(','.join(map(str, row)) for row in rows) + '\n</chunk>\n')
+    return (f' <layer id="{layer_id}" name="{name}" width="{width}" height="{height}">\n'
+            f'  <data encoding="csv">\n' + ''.join(chunks) + '  </data>\n </layer>\n')
+
+
+def write_level(levels_dir, width, height, density, seed=0, infinite=False):
+    """
+    Write a synthetic level in the same layout as level_1 and return its name
+    and the tile cells free for spawning entities. With infinite=True the map
+    is written in Tiled's chunked infinite format.
+    """
+    name = level_name(width, height, density, infinite)
+    directory = os.path.join(levels_dir, name)
+    os.makedirs(directory, exist_ok=True)
+    for filename in ('tilesheet.tsx', 'tilesheet.png'):
+        shutil.copy(os.path.join(TEMPLATE_DIR, filename), directory)
+
+    walls = generate_walls(width, height, density, seed)
+    spawn_cells = open_cells(walls, width, height, 2 + 4096, seed)
+    light = bytearray(width * height)
+    shadow = bytearray(width * height)
+    light[spawn_cells[0][1] * width + spawn_cells[0][0]] = LIGHT_GID
+    shadow[spawn_cells[1][1] * width + spawn_cells[1][0]] = SHADOW_GID
+
+    with open(os.path.join(directory, name + '.tmx'), 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(f'<map version="1.10" tiledversion="1.11.0" orientation="orthogonal" renderorder="right-down" '
+                f'width="{width}" height="{height}" tilewidth="16" tileheight="16" infinite="{int(infinite)}" nextlayerid="5" nextobjectid="1">\n')
+        f.write(' <tileset firstgid="1" source="tilesheet.tsx"/>\n')
+        layer = chunked_layer if infinite else csv_layer
+        f.write(layer(2, 'walls', width, height, bytes(WALL_GID if wall else 0 for wall in walls)))
+        f.write(layer(3, 'shadow', width, height, shadow))
+        f.write(layer(4, 'light', width, height, light))
+        f.write('</map>\n')
+    return name, spawn_cells[2:]
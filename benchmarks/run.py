@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pygame
+from main import Game
+from scripts import levelcache, utils
+from scripts.entities import PhysicsEntity
+from scripts.navigation import WALKER
+from scripts.tilemap import Tilemap
+from benchmarks.levels import write_level
+
+# Usage, from the repository root:
+#   python -m benchmarks.run --sizes 50 500 2000 --density 0.2 --entities 0 100 500 --out bench.json
+# Every case reports per-call timings in microseconds so runs on different commits can be diffed.
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    def pick(q):
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+    return {
+        'n': len(samples),
+        'mean_us': sum(samples) / len(samples),
+        'min_us': samples[0],
+        'p50_us': pick(0.5),
+        'p90_us': pick(0.9),
+        'p99_us': pick(0.99),
+        'max_us': samples[-1],
+    }
+
+
+def sample(fn, samples, batch=1):
+    # Time `samples` batches of `batch` calls each, return microseconds per call
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        for _ in range(batch):
+            fn()
+        timings.append((time.perf_counter() - start) * 1e6 / batch)
+    return timings
+
+
+def probe_points(cells, tile_size, count, seed=0):
+    rng = random.Random(seed)
+    return [(x * tile_size + rng.random() * tile_size, y * tile_size + rng.random() * tile_size) for x, y in rng.choices(cells, k=count)]
+
+
+def spawn_enemies(game, cells, count):
+    # Enemy art doesn't exist yet, stand in with the light player's frames
+    for action in ('idle', 'run'):
+        game.assets['enemy/' + action] = game.assets['light/idle']
+    game.assets['exclamation'] = game.assets['light']
+    size = game.tilemap.tile_size
+    for x, y in cells[:count]:
+        game.spawn_enemy((x * size, y * size))
+
+
+def bench_level(game, levels_dir, size, density, entity_counts, samples):
+    results = []
+    name, cells = write_level(levels_dir, size, size, density)
+    case = {'size': f'{size}x{size}', 'density': density}
+
+    def record(name, timings, **extra):
+        results.append({'case': name, **case, **extra, **percentiles(timings)})
+        print(f"{name:<24} {case['size']:>10} {extra.get('entities', ''):>6} p50 {results[-1]['p50_us']:10.1f} us  p99 {results[-1]['p99_us']:10.1f} us", file=sys.stderr)
+
+    # Cold loads parse the TMX, warm loads hit the compiled level cache
+    load_samples = max(3, samples // 20)
+    def cold_load():
+        for filename in os.listdir(levelcache.CACHE_DIR) if os.path.isdir(levelcache.CACHE_DIR) else []:
+            os.remove(os.path.join(levelcache.CACHE_DIR, filename))
+        Tilemap(game).load(name, levels_dir)
+    record('tilemap.load.cold', sample(cold_load, load_samples))
+    record('tilemap.load.warm', sample(lambda: Tilemap(game).load(name, levels_dir), load_samples))
+
+    # Streamed loads only page in the chunks around the spawns, from the compiled level or an infinite TMX
+    infinite_name, _ = write_level(levels_dir, size, size, density, infinite=True)
+    def stream_load(level):
+        tilemap = Tilemap(game)
+        tilemap.load(level, levels_dir, stream=True)
+        tilemap.close()
+    record('tilemap.load.stream', sample(lambda: stream_load(name), load_samples))
+    record('tilemap.load.infinite', sample(lambda: stream_load(infinite_name), load_samples))
+
+    game.levels[name] = {'completed': False, 'tilemap': name, 'background': 'background_1'}
+    game.load_level(name, levels_dir)
+    tilemap = game.tilemap
+    points = probe_points(cells, tilemap.tile_size, 1024)
+    point = iter(points * (samples * 64 // len(points) + 1))
+    record('physics_rects_around', sample(lambda: tilemap.physics_rects_around(next(point), (8, 15)), samples, 64))
+    point = iter(points * (samples * 64 // len(points) + 1))
+    record('tiles_arounds', sample(lambda: tilemap.tiles_arounds(next(point)), samples, 64))
+    point = iter(points * (samples // len(points) + 1))
+    record('tilemap.render', sample(lambda: tilemap.render(game.display, offset=tuple(int(v) for v in next(point))), samples))
+
+    # Navigation: the platform graph is built once per level, a flow field per span the player lands on
+    nav = game.nav
+    record('navgraph.build', sample(nav.build, load_samples))
+    spans = list(range(0, len(nav.spans), max(1, len(nav.spans) // 256)))
+    span = iter(spans * (samples // len(spans) + 1))
+    record('navgraph.flow_field', sample(lambda: nav.search(next(span), WALKER), samples))
+
+    entity = PhysicsEntity(game, 'light', points[0], (6, 16))
+    def entity_update():
+        entity.update(tilemap, (1, 0))
+        if entity.velocity[1] >= 15:  # Fell out of the level, put it back
+            entity.pos = list(points[0])
+            entity.velocity = [0, 0]
+    record('physicsentity.update', sample(entity_update, samples, 64))
+
+    # Bullet hell: four shots a tick from the open cells in random directions, so hundreds stay in flight
+    rng = random.Random(0)
+    projectiles = game.projectiles
+    def projectile_tick():
+        for _ in range(4):
+            x, y = rng.choice(cells)
+            angle = rng.random() * 2 * math.pi
+            projectiles.spawn('red_shuriken', ((x + 0.5) * tilemap.tile_size, (y + 0.5) * tilemap.tile_size), (math.cos(angle), math.sin(angle)))
+        projectiles.update()
+    sample(projectile_tick, 240)  # Fill up to the steady state first
+    record('projectiles.update', sample(projectile_tick, samples), live=len(projectiles))
+
+    for batched in (False, True):
+        game.batched_enemies = batched
+        for count in entity_counts:
+            game.load_level(name, levels_dir)
+            spawn_enemies(game, cells, count)
+            def frame():
+                game.step(((1, 0), (-1, 0)))
+                game.render()
+            timings = sample(frame, samples)
+            record('frame.headless.batched' if batched else 'frame.headless', timings, entities=count, enemies_left=len(game.enemies))
+    game.batched_enemies = False
+    return results
+
+
+def bench_startup(samples):
+    # Time to first frame of level_1 from a fresh Game, with assets loaded serially on first use
+    # or decoded up front on the thread pool like Game.main does. The level cache (levelcache.CACHE_DIR,
+    # pointed at a temporary directory by the caller) is filled by one untimed load first, so every
+    # sample starts from the same warm compiled level
+    results = []
+    Tilemap(Game(headless=True)).load('level_1')
+    for parallel in (False, True):
+        def first_frame():
+            utils._atlas = None
+            utils._decoded.clear()
+            utils._taken.clear()
+            game = Game(headless=True)
+            if parallel:
+                asyncio.run(game.load_assets(game.level_assets('level_1')))
+            game.load_level('level_1')
+            game.render()
+        timings = sample(first_frame, samples)
+        results.append({'case': 'startup.first_frame.parallel' if parallel else 'startup.first_frame', **percentiles(timings)})
+        print(f"{results[-1]['case']:<24} {'':>10} {'':>6} p50 {results[-1]['p50_us']:10.1f} us  p99 {results[-1]['p99_us']:10.1f} us", file=sys.stderr)
+    return results
+
+
+def bench_entity_memory(game, levels_dir, counts, ticks=30):
+    # Memory per enemy and allocation churn per tick, traced with tracemalloc, with the enemies spread
+    # over a 500x500 level, with and without shared EntityArrays. Reported in bytes and blocks rather
+    # than timings. The EntityArrays themselves are preallocated by load_level and not counted
+    results = []
+    name, cells = write_level(levels_dir, 500, 500, 0.1)
+    game.levels[name] = {'completed': False, 'tilemap': name, 'background': 'background_1'}
+    for shared, count in [(shared, count) for shared in (False, True) for count in counts]:
+        game.shared_arrays = shared
+        game.load_level(name, levels_dir)
+        spawn_enemies(game, [], 0)
+        size = game.tilemap.tile_size
+        for _ in range(2):  # Only the second pass counts, the first warms up caches and interned values
+            for enemy in game.enemies:
+                enemy.release()
+            game.enemies.clear()
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            for i in range(count):  # Past the free cells, enemies double up on them
+                x, y = cells[i % len(cells)]
+                game.spawn_enemy((x * size + i // len(cells) % 8, y * size))
+            per_entity = (tracemalloc.get_traced_memory()[0] - before) / count
+            tracemalloc.stop()
+
+        for _ in range(5):
+            game.step()
+        tracemalloc.start()
+        churn = 0
+        blocks = sys.getallocatedblocks()
+        for _ in range(ticks):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            game.step()
+            churn += tracemalloc.get_traced_memory()[1] - current
+        blocks = sys.getallocatedblocks() - blocks
+        tracemalloc.stop()
+        results.append({'case': 'entity.memory', 'entities': count, 'shared_arrays': shared, 'bytes_per_entity': per_entity,
+                        'peak_alloc_bytes_per_tick': churn / ticks, 'net_blocks_per_tick': blocks / ticks})
+        print(f"{'entity.memory':<24} {'shared' if shared else '':>10} {count:>6} {per_entity:8.0f} B/entity  {churn / ticks:10.0f} B allocated at peak per tick", file=sys.stderr)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tilemap and entity hot paths on synthetic levels')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 250, 1000, 2000], help='square level sizes in tiles')
+    parser.add_argument('--density', type=float, nargs='+', default=[0.1], help='fraction of random wall cells')
+    parser.add_argument('--entities', type=int, nargs='+', default=[0, 100, 500], help='enemy counts for full-frame cases')
+    parser.add_argument('--samples', type=int, default=200, help='timing samples per case')
+    parser.add_argument('--out', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Before anything loads a level, so no benchmark writes into the repository's cache
+        levelcache.CACHE_DIR = os.path.join(tmp, 'cache')
+        results = bench_startup(max(3, args.samples // 20))
+        game = Game(headless=True)
+        results.extend(bench_entity_memory(game, os.path.join(tmp, 'levels'), [count for count in args.entities if count]))
+        game.shared_arrays = False
+        for size in args.sizes:
+            for density in args.density:
+                results.extend(bench_level(game, os.path.join(tmp, 'levels'), size, density, args.entities, args.samples))
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'samples': args.samples,
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+
+
+if __name__ == '__main__':
+    main()
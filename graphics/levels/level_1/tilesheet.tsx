@@ -1,4 +1,14 @@
 <?xml version="1.0" encoding="UTF-8"?>
 <tileset version="1.10" tiledversion="1.11.0" name="tilesheet" tilewidth="16" tileheight="16" tilecount="10" columns="10">
  <image source="tilesheet.png" width="160" height="16"/>
+ <tile id="2">
+  <properties>
+   <property name="door" type="bool" value="true"/>
+  </properties>
+ </tile>
+ <tile id="3">
+  <properties>
+   <property name="solid" type="bool" value="true"/>
+  </properties>
+ </tile>
 </tileset>
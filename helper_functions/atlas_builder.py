@@ -0,0 +1,80 @@
+from PIL import Image
+import json
+import os
+
+# Packs every runtime sprite under graphics/ into a few atlas images plus a manifest
+# that scripts/utils.py reads to hand out subsurfaces instead of opening one PNG per frame.
+# Re-run after adding or editing art.
+
+# Directory containing the PNG files
+base_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'graphics')
+
+# Directory the atlases and manifest are written to
+output_directory = os.path.join(base_directory, 'atlas')
+
+# Directories to exclude, level tilesheets are only used by Tiled
+exclude_dirs = ['atlas', 'levels']
+
+# Maximum size of one atlas page and the gap kept between sprites
+atlas_size = 2048
+padding = 1
+
+
+def collect_sprites():
+    files = []
+    for root, dirnames, filenames in os.walk(base_directory):
+        dirnames[:] = [d for d in dirnames if d not in exclude_dirs]
+        for filename in filenames:
+            if filename.endswith('.png'):
+                files.append(os.path.relpath(os.path.join(root, filename), base_directory).replace(os.sep, '/'))
+    return sorted(files)
+
+
+def pack(images):
+    # Simple shelf packer: tallest sprites first, left to right, new shelf when a row is full,
+    # new page when a page is full
+    pages = [[]]
+    placements = {}
+    x = y = shelf_height = 0
+    for name in sorted(images, key=lambda n: (-images[n].height, n)):
+        width, height = images[name].size
+        if x + width > atlas_size:
+            x, y, shelf_height = 0, y + shelf_height + padding, 0
+        if y + height > atlas_size:
+            pages.append([])
+            x = y = shelf_height = 0
+        placements[name] = (len(pages) - 1, x, y, width, height)
+        pages[-1].append(name)
+        x += width + padding
+        shelf_height = max(shelf_height, height)
+    return pages, placements
+
+
+def build():
+    images = {name: Image.open(os.path.join(base_directory, name)).convert('RGBA') for name in collect_sprites()}
+    pages, placements = pack(images)
+
+    os.makedirs(output_directory, exist_ok=True)
+    manifest = {'atlases': [], 'sprites': {}}
+    for page_index, names in enumerate(pages):
+        # Crop each page to the area actually used
+        page_width = max(placements[n][1] + placements[n][3] for n in names)
+        page_height = max(placements[n][2] + placements[n][4] for n in names)
+        page = Image.new('RGBA', (page_width, page_height))
+        for name in names:
+            page.paste(images[name], placements[name][1:3])
+        page_name = f'atlas_{page_index}.png'
+        page.save(os.path.join(output_directory, page_name))
+        manifest['atlases'].append(page_name)
+
+    for name, (page_index, x, y, width, height) in placements.items():
+        manifest['sprites'][name] = {'atlas': page_index, 'rect': [x, y, width, height]}
+
+    with open(os.path.join(output_directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    print(f'Packed {len(placements)} sprites into {len(pages)} atlas page(s) in {output_directory}')
+
+
+if __name__ == '__main__':
+    build()
@@ -1,38 +1,68 @@
 from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import hashlib
+import json
 import os
 
+# Splits a tilesheet back into one PNG per 16x16 tile, named by tile index. A split.json next to the
+# tiles records the sheet's hash, so re-running on an unchanged sheet does nothing. The sheet is decoded
+# once, then its rows are handed to a process pool that encodes and writes the tiles, one row per task.
+
 # Directory containing the tilesheet file
-directory = '../graphics/spritesheet_images'
+directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'graphics', 'spritesheet_images')
 
 # Path to the tilesheet file
 tilesheet_path = os.path.join(directory, '0.png')
 
-# Directory to save the individual tiles
-output_directory = '.'
-
-# Create the output directory if it doesn't exist
-os.makedirs(output_directory, exist_ok=True)
-
-# Open the tilesheet image
-tilesheet = Image.open(tilesheet_path)
+# Directory to save the individual tiles, outside graphics/ so the sheet builders don't pick them up
+output_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'split')
 
 # Set the size of each tile
 tile_width, tile_height = 16, 16
 
-# Get the size of the tilesheet
-tilesheet_width, tilesheet_height = tilesheet.size
 
-# Calculate the number of tiles in each dimension
-tiles_x = tilesheet_width // tile_width
-tiles_y = tilesheet_height // tile_height
+def split_row(job):
+    # Runs in a worker process: save every tile of one decoded row of the sheet, return how many were written
+    row, out_dir, first_index = job
+    written = 0
+    for x in range(row.width // tile_width):
+        tile = row.crop((x * tile_width, 0, (x + 1) * tile_width, tile_height))
+        tile.save(os.path.join(out_dir, f'{first_index + x}.png'))
+        written += 1
+    return written
+
+
+def split(sheet_path=tilesheet_path, out_dir=output_directory, force=False, workers=None):
+    with open(sheet_path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    record_path = os.path.join(out_dir, 'split.json')
+    if not force and os.path.exists(record_path):
+        with open(record_path) as f:
+            if json.load(f).get('hash') == digest:
+                print(f'{out_dir} is up to date')
+                return
+
+    # Create the output directory if it doesn't exist
+    os.makedirs(out_dir, exist_ok=True)
+    with Image.open(sheet_path) as tilesheet:
+        tilesheet.load()  # Decode the sheet once, the workers get its rows already decoded
+        tiles_x, tiles_y = tilesheet.width // tile_width, tilesheet.height // tile_height
+        rows = (tilesheet.crop((0, y * tile_height, tiles_x * tile_width, (y + 1) * tile_height)) for y in range(tiles_y))
+        jobs = ((row, out_dir, y * tiles_x) for y, row in enumerate(rows))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            count = sum(pool.map(split_row, jobs))
+
+    with open(record_path, 'w') as f:
+        json.dump({'hash': digest, 'tiles': count, 'columns': tiles_x}, f, indent=1)
+    print(f'Successfully saved {count} tiles to {out_dir}')
 
-# Extract and save each tile
-tile_index = 0
-for y in range(tiles_y):
-    for x in range(tiles_x):
-        tile = tilesheet.crop((x * tile_width, y * tile_height, (x + 1) * tile_width, (y + 1) * tile_height))
-        tile_path = os.path.join(output_directory, f'{tile_index}.png')
-        tile.save(tile_path)
-        tile_index += 1
 
-print(f'Successfully saved {tile_index} tiles to {output_directory}')
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split a tilesheet into one PNG per tile')
+    parser.add_argument('sheet', nargs='?', default=tilesheet_path)
+    parser.add_argument('--out', default=output_directory, help='directory the tiles are written to')
+    parser.add_argument('--force', action='store_true', help='split even if the sheet is unchanged')
+    parser.add_argument('--workers', type=int, help='worker processes, defaults to the CPU count')
+    args = parser.parse_args()
+    split(args.sheet, args.out, force=args.force, workers=args.workers)
@@ -1,60 +1,158 @@
 from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import hashlib
+import json
 import os
+import re
+
+# Packs every 16x16 tile of the game's sprites into graphics/tilesheet.png for Tiled, in sorted file
+# order (the order scripts/tilemap.py's TILESET_TYPES expects). Alongside the sheet it writes
+#   tilesheet.json: tile size, columns, and for every source file its content hash and tile indices
+#   tilesheet.tsx:  a Tiled tileset for the sheet, keeping the tile properties of the previous one
+# Sources whose hash is unchanged since the last run are copied from the previous sheet instead of
+# being decoded again, changed ones are sliced on a process pool. With --dedupe identical tiles share one
+# index; that's off by default because the game still maps tiles by position (TILESET_TYPES), and a shared
+# index would shift every later tile, until the game reads tilesheet.json.
 
 # Directory containing the PNG files
-base_directory = '../graphics'
+base_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'graphics')
 
-# Directories to exclude
-exclude_dirs = ['idle', 'jump', 'run', 'sky', 'cloud', 'particles', 'projectiles']
+# Directories to exclude: animation frames, generated atlases and level tilesheets
+exclude_dirs = ['idle', 'jump', 'run', 'sky', 'cloud', 'particles', 'projectiles', 'backgrounds', 'atlas', 'levels']
 
-# Path to the tilesheet file
+# Outputs
 tilesheet_path = os.path.join(base_directory, 'tilesheet.png')
+manifest_path = os.path.join(base_directory, 'tilesheet.json')
+tsx_path = os.path.join(base_directory, 'tilesheet.tsx')
 
-# Remove the existing tilesheet file if it exists
-if os.path.exists(tilesheet_path):
-    os.remove(tilesheet_path)
+# Set the size of each tile
+tile_width, tile_height = 16, 16
+tiles_per_row = 10  # Adjust based on your preference
 
-# List all PNG files in the directory and subdirectories, excluding specified directories
-files = []
-for root, dirnames, filenames in os.walk(base_directory):
-    # Remove directories to exclude
-    dirnames[:] = [d for d in dirnames if d not in exclude_dirs]
 
-    for filename in filenames:
-        if filename.endswith('.png') and filename != 'tilesheet.png':
-            files.append(os.path.join(root, filename))
+def collect_sources():
+    # List all PNG files in the directory and subdirectories, excluding specified directories
+    files = []
+    for root, dirnames, filenames in os.walk(base_directory):
+        dirnames[:] = [d for d in dirnames if d not in exclude_dirs]
+        for filename in filenames:
+            if filename.endswith('.png') and filename != 'tilesheet.png':
+                files.append(os.path.relpath(os.path.join(root, filename), base_directory).replace(os.sep, '/'))
+    # Sort the files to ensure consistent order
+    return sorted(files)
 
-# Sort the files to ensure consistent order
-files.sort()
 
-# Open all images and store them in a list
-images = [Image.open(file) for file in files]
+def file_hash(name):
+    with open(os.path.join(base_directory, name), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
 
-# Set the size of each tile
-tile_width, tile_height = 16, 16
 
-# Calculate the total number of tiles across all images
-num_tiles = sum((image.width // tile_width) * (image.height // tile_height) for image in images)
+def slice_tiles(image):
+    # Raw RGBA bytes of every tile, row by row
+    image = image.convert('RGBA')
+    return [image.crop((x, y, x + tile_width, y + tile_height)).tobytes()
+            for y in range(0, image.height - tile_height + 1, tile_height)
+            for x in range(0, image.width - tile_width + 1, tile_width)]
 
-# Determine the size of the tilesheet
-tiles_per_row = 10  # Adjust based on your preference
-tilesheet_width = tile_width * tiles_per_row
-tilesheet_height = tile_height * ((num_tiles + tiles_per_row - 1) // tiles_per_row)
-
-# Create a blank image for the tilesheet
-tilesheet = Image.new('RGBA', (tilesheet_width, tilesheet_height))
-
-# Paste each 16x16 section into the tilesheet
-tile_index = 0
-for image in images:
-    image_width, image_height = image.size
-    for y in range(0, image_height, tile_height):
-        for x in range(0, image_width, tile_width):
-            tile = image.crop((x, y, x + tile_width, y + tile_height))
-            ts_x = (tile_index % tiles_per_row) * tile_width
-            ts_y = (tile_index // tiles_per_row) * tile_height
-            tilesheet.paste(tile, (ts_x, ts_y))
-            tile_index += 1
-
-# Save the tilesheet
-tilesheet.save(tilesheet_path)
+
+def slice_source(name):
+    # Runs in a worker process
+    with Image.open(os.path.join(base_directory, name)) as image:
+        return slice_tiles(image)
+
+
+def tile_position(index):
+    return (index % tiles_per_row) * tile_width, (index // tiles_per_row) * tile_height
+
+
+def tile_box(index):
+    x, y = tile_position(index)
+    return x, y, x + tile_width, y + tile_height
+
+
+def load_previous(dedupe):
+    # Manifest and sheet of the last run, when both are still there and were built with the same settings
+    if not (os.path.exists(manifest_path) and os.path.exists(tilesheet_path)):
+        return {}, None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if (manifest.get('tile_size') != [tile_width, tile_height] or manifest.get('columns') != tiles_per_row
+            or manifest.get('dedupe', True) != dedupe):
+        return {}, None
+    return manifest['sources'], Image.open(tilesheet_path).convert('RGBA')
+
+
+def write_tsx(tilecount, rows):
+    # Keep the <tile> elements (properties such as solid or door) of the previous tileset
+    tiles = ''
+    if os.path.exists(tsx_path):
+        with open(tsx_path) as f:
+            tiles = ''.join(re.findall(r' <tile\b.*?</tile>\n', f.read(), re.S))
+    with open(tsx_path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(f'<tileset version="1.10" tiledversion="1.11.0" name="tilesheet" tilewidth="{tile_width}" tileheight="{tile_height}" '
+                f'tilecount="{tilecount}" columns="{tiles_per_row}">\n')
+        f.write(f' <image source="tilesheet.png" width="{tile_width * tiles_per_row}" height="{tile_height * rows}"/>\n')
+        f.write(tiles)
+        f.write('</tileset>\n')
+
+
+def build(dedupe=False, force=False, workers=None):
+    sources = collect_sources()
+    hashes = {name: file_hash(name) for name in sources}
+    previous, previous_sheet = ({}, None) if force else load_previous(dedupe)
+
+    unchanged = [name for name in sources if name in previous and previous[name]['hash'] == hashes[name]]
+    changed = [name for name in sources if name not in unchanged]
+    if not changed and list(previous) == sources and os.path.exists(tsx_path):
+        print(f'{tilesheet_path} is up to date ({len(sources)} sources)')
+        return
+
+    # Unchanged sources are cut back out of the previous sheet, changed ones are decoded in parallel
+    source_tiles = {}
+    for name in unchanged:
+        source_tiles[name] = [previous_sheet.crop(tile_box(i)).tobytes() for i in previous[name]['tiles']]
+    if changed:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for name, tiles in zip(changed, pool.map(slice_source, changed, chunksize=16)):
+                source_tiles[name] = tiles
+
+    # Number the tiles in source order, identical tiles share the index of the first one
+    unique = []
+    indices = {}
+    manifest = {'tile_size': [tile_width, tile_height], 'columns': tiles_per_row, 'dedupe': dedupe, 'sources': {}}
+    for name in sources:
+        tile_indices = []
+        for tile in source_tiles[name]:
+            if not dedupe or tile not in indices:
+                indices[tile] = len(unique)
+                unique.append(tile)
+            tile_indices.append(indices[tile] if dedupe else len(unique) - 1)
+        manifest['sources'][name] = {'hash': hashes[name], 'tiles': tile_indices}
+    manifest['tilecount'] = len(unique)
+
+    # Determine the size of the tilesheet and paste every tile into it
+    rows = max(1, (len(unique) + tiles_per_row - 1) // tiles_per_row)
+    tilesheet = Image.new('RGBA', (tile_width * tiles_per_row, tile_height * rows))
+    for index, tile in enumerate(unique):
+        tilesheet.paste(Image.frombytes('RGBA', (tile_width, tile_height), tile), tile_position(index))
+
+    # Write to temporary files first so an interrupted run never leaves a sheet and manifest that disagree
+    tilesheet.save(tilesheet_path + '.tmp', format='PNG')
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tilesheet_path + '.tmp', tilesheet_path)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    write_tsx(rows * tiles_per_row, rows)
+
+    print(f'Packed {len(unique)} tiles from {len(sources)} sources ({len(changed)} re-sliced) into {tilesheet_path}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build graphics/tilesheet.png, its manifest and Tiled tileset')
+    parser.add_argument('--force', action='store_true', help='re-slice every source even if unchanged')
+    parser.add_argument('--dedupe', action='store_true', help='give identical tiles one shared index (shifts the indices TILESET_TYPES expects)')
+    parser.add_argument('--workers', type=int, help='worker processes, defaults to the CPU count')
+    args = parser.parse_args()
+    build(dedupe=args.dedupe, force=args.force, workers=args.workers)
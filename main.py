@@ -1,39 +1,86 @@
+import os
 import pygame
 import sys
+import time
+import argparse
 import math
 import random
 import collections
 import asyncio
-from scripts.entities import PhysicsEntity, Player, Enemy, Boss
+import numpy as np
+from scripts.entities import PhysicsEntity, Player, Enemy, Boss, EntityArrays
 from scripts.utils import *
-from scripts.tilemap import Tilemap
-from scripts.particle import Particle, SkullParticle
-import asyncio
+from scripts.tilemap import Tilemap, TILESET_TYPES
+from scripts.particle import ParticleSystem
+from scripts.profiler import FrameProfiler
+from scripts.spatial import SpatialHash
+from scripts.crowd import EnemyCrowd
+from scripts.presenter import Presenter
+from scripts.lighting import Lighting, Light
+from scripts.navigation import NavGraph
+from scripts.projectiles import ProjectileSystem
+from scripts.replay import InputRecorder, Replay, state_checksum, MODE_STREAM, MODE_BATCHED_ENEMIES, MODE_SHARED_ARRAYS
+
+FPS = 60
+FIXED_DT = 1 / FPS  # The simulation always advances in steps of this many seconds
+MAX_FRAME_TIME = 0.25  # Cap on real time fed to the simulation per frame so a hitch can't spiral
+DISPLAY_SIZE = (240, 200)  # Resolution everything is drawn at before it's scaled up to the window
 
 class Game:
-    def __init__(self):
+    def __init__(self, headless=False, render_every=1, profile=None, batched_enemies=False, stream=False, seed=None, record=None, shared_arrays=False):
+        # Headless runs on SDL's dummy video driver: no window, but surfaces and convert() still work
+        self.headless = headless
+        self.render_every = render_every  # Headless only: render every N steps, 0 never renders
+        self.batched_enemies = batched_enemies  # Run enemy AI through an EnemyCrowd instead of per instance
+        self.stream = stream  # Page level chunks in around the players instead of loading whole levels
+        self.shared_arrays = shared_arrays  # Keep entity positions and velocities as rows of one EntityArrays
+        self.entity_arrays = None
+        self.lighting_enabled = True  # F4 toggles
+        self.seed = seed  # Seed of the simulation's random generators, None picks a new one per level
+        self.record_path = record  # Write every tick's inputs to this replay log
+        self.recorder = None
+        self.deterministic = record is not None  # Avoid anything that makes a tick depend on wall clock or thread timing
+        self.events = ()  # (down, key) key events fed to the current tick
+        if headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
         pygame.init()
         pygame.display.set_caption("Penumbra path")
         self.screen_width, self.screen_height = 720, 600
         self.screen = pygame.display.set_mode((self.screen_width, self.screen_height))
-        self.display_width, self.display_height = 240, 200
-        self.display = pygame.Surface((self.display_width, self.display_height), pygame.SRCALPHA)
+        self.display_width, self.display_height = DISPLAY_SIZE
+        # The display is always fully drawn, so it's opaque and in the window's pixel format
+        self.display = pygame.Surface((self.display_width, self.display_height), 0, self.screen)
+        self.presenter = Presenter(self.screen, self.display)
         self.clock = pygame.time.Clock()
+        # Per-phase frame timings, F3 toggles the overlay. With a profile path they're recorded
+        # from the start and dumped there (JSON, or CSV for a .csv path) on exit
+        self.profile_path = profile
+        self.profiler = FrameProfiler(enabled=profile is not None)
 
         self.current_level = None
+        self.tilemap = None
+        self.tick = 0  # Fixed steps simulated since the level was loaded
+        self.scroll = [0, 0]  # Camera offset in display pixels
 
         self.levels = {
             'level_1': {'completed': False, 'tilemap': 'level_1', 'background': 'background_1'}
         }
 
-        self.assets = {
-            'walls' : load_images('spritesheet_images/walls'),
-            'background_1' : load_image("backgrounds/0.png"),
-            'shadow' : load_image('animations_spritesheet/shadow/0.png'),
-            'shadow/idle': Animation(load_images('animations_spritesheet/shadow/idle'), img_dur=10),
-            'light' : load_image('animations_spritesheet/light/0.png'),
-            'light/idle': Animation(load_images('animations_spritesheet/light/idle'), img_dur=10),
-        }
+        # Assets are loaded the first time something looks them up, or ahead of time by load_assets
+        self.assets = LazyAssets({
+            'walls' : images_asset('spritesheet_images/walls'),
+            'door' : images_asset('spritesheet_images/door'),
+            'background_1' : image_asset("backgrounds/0.png"),
+            'shadow' : image_asset('animations_spritesheet/shadow/0.png'),
+            'shadow/idle': animation_asset('animations_spritesheet/shadow/idle', img_dur=10),
+            'light' : image_asset('animations_spritesheet/light/0.png'),
+            'light/idle': animation_asset('animations_spritesheet/light/idle', img_dur=10),
+            # No run/jump art yet, both reuse the idle frames
+            'shadow/run': lambda: self.assets['shadow/idle'],
+            'shadow/jump': lambda: self.assets['shadow/idle'],
+            'light/run': lambda: self.assets['light/idle'],
+            'light/jump': lambda: self.assets['light/idle'],
+        })
 
         self.audio = {
 
@@ -43,40 +90,297 @@ class Game:
 
         }
 
-    def load_level(self, level_name):
+    def level_assets(self, level_name):
+        # Asset keys a level needs before its first frame: background, tiles and both players
+        keys = [self.levels[level_name]['background']] + [tile_type for tile_type, variant in TILESET_TYPES]
+        keys += [key for key in self.assets.loaders if key.split('/')[0] in ('light', 'shadow')]
+        return list(dict.fromkeys(keys))
+
+    async def load_assets(self, keys):
+        # Decode keys in parallel while a loading screen is drawn, returns once all of them are ready
+        progress = [0, 1]
+
+        def on_progress(done, total):
+            progress[:] = done, total
+
+        screen = None if self.headless else asyncio.create_task(self.loading_screen(progress))
+        await self.assets.load_async(keys, on_progress)
+        if screen is not None:
+            screen.cancel()
+
+    async def loading_screen(self, progress):
+        while True:
+            pygame.event.pump()  # Keep the window responsive
+            self.display.fill((0, 0, 0))
+            width = self.display_width // 2
+            bar = pygame.Rect((self.display_width - width) // 2, self.display_height // 2 - 2, width, 4)
+            pygame.draw.rect(self.display, (60, 60, 60), bar)
+            bar.width = width * progress[0] // max(1, progress[1])
+            pygame.draw.rect(self.display, (255, 255, 255), bar)
+            self.present()
+            await asyncio.sleep(1 / FPS)
+
+    def load_level(self, level_name, levels_dir='./graphics/levels'):
+        if self.tilemap is not None:
+            self.tilemap.close()  # Stops the previous level's streaming worker
         self.tilemap = Tilemap(self, tile_size=16)
-        self.tilemap.load(self.levels[level_name]['tilemap'])
+        self.tilemap.stream_sync = self.deterministic
+        self.tilemap.load(self.levels[level_name]['tilemap'], levels_dir, stream=self.stream)
+
+        self.entity_arrays = EntityArrays() if self.shared_arrays else None
+        self.player1 = Player(self, 'light', self.tilemap.get_player_spawn('light'), (6, 16), arrays=self.entity_arrays)
+
+        self.player2 = Player(self, 'shadow', self.tilemap.get_player_spawn('shadow'), (6, 16), arrays=self.entity_arrays)
+
+        self.player = self.player1  # Enemies chase the light player
+        self.enemies = []
+        self.removed_enemies = set()  # Enemies killed this tick, dropped from self.enemies after the update loop
+        self.entity_hash = SpatialHash(cell_size=32)
+        self.nav = NavGraph(self.tilemap)
+        self.nav.build()  # Chunks streaming in and out later only update it around them
+        self.crowd = EnemyCrowd(self) if self.batched_enemies else None
+        self.projectiles = ProjectileSystem(self)
+        self.particles = ParticleSystem(self)
+        self.lighting = Lighting(self.tilemap)
+        self.lights = [Light(radius=96)]  # Carried by the light player
+        self.tick = 0
+        self.current_level = level_name
+        self.current_background = self.assets[self.levels[level_name]['background']]
+
+        # Everything random in the simulation draws from the global generators, reseeded for every level
+        self.level_seed = self.seed if self.seed is not None else random.getrandbits(63)
+        random.seed(self.level_seed)
+        np.random.seed(self.level_seed % 2 ** 32)
+        if self.record_path:
+            if self.recorder is not None:
+                self.recorder.close()
+            self.recorder = InputRecorder(self.record_path, level_name, self.level_seed, self.replay_modes())
 
-        self.player1 = Player(self, 'light', (self.tilemap.player_position[0] * self.tilemap.tile_size, self.tilemap.player_position[1] * self.tilemap.tile_size), (6, 16))
+    def step(self, inputs=((0, 0), (0, 0)), events=()):
+        # Advance the world by one fixed tick, inputs holds the movement tuple of each player and
+        # events the (down, key) key presses and releases that arrived since the last tick
+        self.events = events
+        self.flush_removals()
+        self.player1.update(self.tilemap, movement=inputs[0])
+        self.player2.update(self.tilemap, movement=inputs[1])
+        self.tilemap.stream_around((self.player1.pos, self.player2.pos))
+        self.entity_hash.rebuild(self.enemies, (self.player1, self.player2))
+        if self.crowd:
+            self.crowd.update()
+        streaming = self.tilemap.streamer is not None
+        for enemy in self.enemies:
+            if enemy not in self.removed_enemies:
+                # Enemies on chunks that aren't loaded are frozen until a player comes back
+                if streaming and not self.tilemap.is_resident(enemy.pos):
+                    continue
+                enemy.update(self.tilemap)
+        self.projectiles.update()
+        self.flush_removals()
+        self.particles.update()
+        self.tick += 1
+        if self.recorder is not None:
+            self.recorder.record(inputs, events)
+            if self.tick % self.recorder.checksum_every == 0:
+                self.recorder.checksum(self.tick, state_checksum(self))
 
-        self.player2 = Player(self, 'shadow', (self.tilemap.player_position[0] * self.tilemap.tile_size, self.tilemap.player_position[1] * self.tilemap.tile_size), (6, 16))
+    def play_sound(self, name):
+        # Sounds that haven't been added to self.audio yet are skipped
+        sound = self.audio.get(name)
+        if sound is not None:
+            sound.play()
 
+    def spawn_enemy(self, pos, size=(8, 15)):
+        if self.crowd:
+            return self.crowd.spawn(pos, size)
+        enemy = Enemy(self, pos, size, arrays=self.entity_arrays)
+        self.enemies.append(enemy)
+        return enemy
+
+    def remove_enemy(self, enemy):
+        # Removal is deferred so enemies can die while the enemy list is being iterated
+        self.removed_enemies.add(enemy)
+
+    def flush_removals(self):
+        if self.removed_enemies:
+            if self.crowd:
+                # In list order, not set order, so crowd slots come out the same in a replay
+                for enemy in self.enemies:
+                    if enemy in self.removed_enemies:
+                        self.crowd.remove(enemy)
+            for enemy in self.removed_enemies:
+                enemy.release()
+            self.enemies = [enemy for enemy in self.enemies if enemy not in self.removed_enemies]
+            self.removed_enemies.clear()
+
+    def read_inputs(self):
+        keys = pygame.key.get_pressed()
+        return ((keys[pygame.K_RIGHT] - keys[pygame.K_LEFT], 0),
+                (keys[pygame.K_d] - keys[pygame.K_a], 0))
+
+    def render(self, alpha=1.0):
+        # alpha is how far real time has moved past the last step (0-1), entities are drawn
+        # between their previous and current position so motion stays smooth on uneven frames.
+        # The camera follows the light player's drawn position, so the player stays centered and
+        # the level scrolls just as smoothly
+        player = self.player1
+        player_x = player.prev_pos[0] + (player.pos[0] - player.prev_pos[0]) * alpha
+        player_y = player.prev_pos[1] + (player.pos[1] - player.prev_pos[1]) * alpha
+        self.scroll[0] = int(player_x - self.display_width / 2)
+        self.scroll[1] = int(player_y - self.display_height / 2)
+
+        self.display.blit(self.current_background, (0, 0))
+        self.tilemap.render(self.display, offset=self.scroll)
+        self.profiler.mark('tilemap')
+        for entity in [self.player1, self.player2] + self.enemies:
+            entity.render(self.display, offset=(self.scroll[0] + (entity.pos[0] - entity.prev_pos[0]) * (1 - alpha),
+                                                self.scroll[1] + (entity.pos[1] - entity.prev_pos[1]) * (1 - alpha)))
+        self.projectiles.render(self.display, offset=self.scroll)
+        self.profiler.mark('entities')
+        self.particles.render(self.display, offset=self.scroll)
+        self.profiler.mark('particles')
+        if self.lighting_enabled:
+            self.lights[0].pos = (int(player_x + player.size[0] / 2), int(player_y + player.size[1] / 2))
+            self.lighting.render(self.display, self.lights, offset=self.scroll)
+            self.profiler.mark('lighting')
+        if self.profiler.overlay:
+            self.profiler.render_overlay(self.display)
+            self.profiler.mark('overlay')
+
+    def present(self):
+        # Scale the display to the screen size, only the parts that changed since the last frame
+        rects = self.presenter.scale_display()
+        self.profiler.mark('upscale')
+
+        # Update the display
+        self.presenter.update(rects)
+        self.profiler.mark('present')
+
+    def run_headless(self, steps, inputs=None):
+        # Step as fast as the CPU allows, inputs is an optional callable tick -> per player movement
+        start = time.perf_counter()
+        for _ in range(steps):
+            self.profiler.start_frame()
+            self.step(inputs(self.tick) if inputs else ((0, 0), (0, 0)))
+            self.profiler.mark('update')
+            if self.render_every and self.tick % self.render_every == 0:
+                self.render()
+            self.profiler.end_frame()
+        elapsed = time.perf_counter() - start
+        return steps / elapsed if elapsed else float('inf')
+
+    def replay_modes(self):
+        # Options that change the simulation, stored in replay logs
+        return ((MODE_STREAM if self.stream else 0) | (MODE_BATCHED_ENEMIES if self.batched_enemies else 0)
+                | (MODE_SHARED_ARRAYS if self.shared_arrays else 0))
+
+    def replay(self, path, render=False):
+        """
+        Run a recorded session through the simulation as fast as the CPU allows.
+
+        :param render: Render and present every tick, otherwise only the simulation runs.
+        :return: Ticks per second, and the ticks whose state checksum didn't match the recording.
+        """
+        log = Replay(path)
+        self.seed = log.seed
+        self.deterministic = True
+        # Run with the options the session was recorded with, other ones simulate differently
+        self.stream = bool(log.modes & MODE_STREAM)
+        self.batched_enemies = bool(log.modes & MODE_BATCHED_ENEMIES)
+        self.shared_arrays = bool(log.modes & MODE_SHARED_ARRAYS)
+        self.load_level(log.level)
+        mismatches = []
+        start = time.perf_counter()
+        for inputs, events in log.ticks:
+            self.profiler.start_frame()
+            self.step(inputs, events)
+            self.profiler.mark('update')
+            expected = log.checksums.get(self.tick)
+            if expected is not None and expected != state_checksum(self):
+                mismatches.append(self.tick)
+            if render:
+                pygame.event.pump()  # Keep the window responsive
+                self.render()
+                self.present()
+            self.profiler.end_frame()
+        elapsed = time.perf_counter() - start
+        return (len(log.ticks) / elapsed if elapsed else float('inf')), mismatches
 
     def main(self):
-        self.current_level = "level_1"
+        # Start as soon as the first level's assets are in, everything else keeps decoding in the background
+        asyncio.run(self.load_assets(self.level_assets("level_1")))
+        self.assets.prefetch()
         self.load_level("level_1")
-        self.current_background = self.assets[self.levels[self.current_level]['background']]
+        accumulator = 0.0
+        key_events = []  # Key events not yet fed to a tick
         while True:
+            self.profiler.start_frame()
             mouse_pos = pygame.mouse.get_pos()
             for event in pygame.event.get():
+                if event.type in (pygame.KEYDOWN, pygame.KEYUP):
+                    key_events.append((event.type == pygame.KEYDOWN, event.key))
                 if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
+                    self.quit()
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_ESCAPE:
-                        pygame.quit()
-                        sys.exit()
+                        self.quit()
+                    elif event.key == pygame.K_F3:
+                        self.profiler.toggle_overlay()
+                    elif event.key == pygame.K_F4:
+                        self.lighting_enabled = not self.lighting_enabled
+            self.profiler.mark('events')
+
+            # Simulate in fixed steps, however long the last frame took
+            accumulator += min(self.clock.tick(FPS) / 1000, MAX_FRAME_TIME)  # Limit to 60 FPS
+            self.profiler.mark('idle')
+            inputs = self.read_inputs()
+            while accumulator >= FIXED_DT:
+                self.step(inputs, tuple(key_events))
+                key_events.clear()  # Only the first tick of the frame sees them
+                accumulator -= FIXED_DT
+            self.profiler.mark('update')
 
-            # Scale the display to the screen size
-            scaled_display = pygame.transform.scale(self.display, (self.screen_width, self.screen_height))
-            self.screen.blit(scaled_display, (0, 0))
-            self.display.blit(self.current_background, (0, 0))
+            self.render(accumulator / FIXED_DT)
+            self.present()
+            self.profiler.end_frame()
 
-            # Update the display
-            pygame.display.update()
-            self.clock.tick(60)  # Limit to 60 FPS
+    def quit(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.profile_path:
+            self.profiler.dump(self.profile_path)
+        pygame.quit()
+        sys.exit()
 
 
 if __name__ == "__main__":
-   game = Game()
-   game.main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--headless', action='store_true', help='run the simulation without a window, as fast as possible')
+    parser.add_argument('--steps', type=int, default=3600, help='headless: number of fixed steps to simulate')
+    parser.add_argument('--render-every', type=int, default=0, help='headless: render every N steps, 0 never renders')
+    parser.add_argument('--level', default='level_1')
+    parser.add_argument('--stream', action='store_true', help='stream level chunks around the players instead of loading the whole level')
+    parser.add_argument('--record', metavar='PATH', help='record every tick\'s inputs to a replay log at PATH')
+    parser.add_argument('--replay', metavar='PATH', help='run a replay log uncapped, headless unless --render is given, and verify its checksums')
+    parser.add_argument('--render', action='store_true', help='replay: render and present every tick')
+    parser.add_argument('--seed', type=int, help='seed of the simulation\'s random generators')
+    parser.add_argument('--profile', metavar='PATH', help='record per-phase frame timings and write them to PATH (.json or .csv) on exit')
+    args = parser.parse_args()
+
+    if args.replay:
+        game = Game(headless=not args.render, profile=args.profile)
+        rate, mismatches = game.replay(args.replay, render=args.render)
+        print(f'{game.tick} ticks at {rate:.0f} ticks/s, ' + (f'checksum mismatch at ticks {mismatches}' if mismatches else 'all checksums match'))
+        if args.profile:
+            game.profiler.dump(args.profile)
+        sys.exit(1 if mismatches else 0)
+    elif args.headless:
+        game = Game(headless=True, render_every=args.render_every, profile=args.profile, stream=args.stream, seed=args.seed, record=args.record)
+        game.load_level(args.level)
+        print(f'{args.steps} steps at {game.run_headless(args.steps):.0f} steps/s')
+        if game.recorder is not None:
+            game.recorder.close()
+        if args.profile:
+            game.profiler.dump(args.profile)
+    else:
+        game = Game(profile=args.profile, stream=args.stream, seed=args.seed, record=args.record)
+        game.main()
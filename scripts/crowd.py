@@ -0,0 +1,177 @@
+import numpy as np
+from scripts.entities import Enemy
+
+# Per-enemy state kept by EnemyCrowd: name -> (dtype, shape per enemy)
+CROWD_COLUMNS = {
+    'pos': (np.float64, (2,)),  # Gathered from the enemies at the start of every update
+    'knockback': (np.float64, (2,)),
+    'movement': (np.float64, (2,)),  # AI output for the current tick
+    'patrol_left': (np.float64, ()),
+    'patrol_right': (np.float64, ()),
+    'patrol_direction': (np.int8, ()),
+    'tracking_player': (np.bool_, ()),
+    'exclamation_shown': (np.bool_, ()),
+    'exclamation_counter': (np.int32, ()),
+    'trigger_exclamation': (np.bool_, ()),
+}
+
+
+def _column(name, cast):
+    # Property forwarding an Enemy attribute to its row in the crowd's arrays
+    def get(self):
+        return cast(getattr(self.crowd, name)[self.slot])
+
+    def set(self, value):
+        getattr(self.crowd, name)[self.slot] = value
+
+    return property(get, set)
+
+
+# Enemy whose AI state lives in an EnemyCrowd. It keeps the Enemy interface for rendering and
+# scripting, but the patrol/track state machine and knockback decay are advanced by the crowd.
+class CrowdEnemy(Enemy):
+    patrol_left = _column('patrol_left', float)
+    patrol_right = _column('patrol_right', float)
+    patrol_direction = _column('patrol_direction', int)
+    tracking_player = _column('tracking_player', bool)
+    exclamation_shown = _column('exclamation_shown', bool)
+    exclamation_counter = _column('exclamation_counter', int)
+    trigger_exclamation = _column('trigger_exclamation', bool)
+
+    __slots__ = ('crowd', 'slot')
+
+    def __init__(self, crowd, slot, pos, size, health=30, arrays=None):
+        self.crowd = crowd
+        self.slot = slot
+        super().__init__(crowd.game, pos, size, health=health, arrays=arrays)
+
+    @property
+    def knockback(self):
+        return tuple(self.crowd.knockback[self.slot].tolist())
+
+    @knockback.setter
+    def knockback(self, value):
+        self.crowd.knockback[self.slot] = tuple(value)
+
+    def knockback_settled(self):
+        return self.crowd.settled[self.slot]
+
+    def update(self, tilemap, movement=(0, 0)):
+        # Check for dying from falling too fast
+        if self.velocity[1] >= 15:
+            self.game.remove_enemy(self)
+            return
+
+        # The crowd already ran the AI and knockback for this tick
+        self.move(tilemap, self.crowd.moves[self.slot], self.crowd.drops[self.slot])
+
+
+# Struct-of-arrays enemy manager: one row per enemy, all AI advanced with a handful of array operations
+class EnemyCrowd:
+    def __init__(self, game, capacity=256):
+        self.game = game
+        self.count = 0
+        self.enemies = []  # Slot -> CrowdEnemy
+        self.moves = []  # Slot -> [x, y] movement chosen by the last update
+        self.drops = []  # Slot -> whether that movement is meant to walk off a ledge
+        self.settled = []  # Slot -> whether the enemy's knockback has died out
+        self.capacity = 0
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        for name, (dtype, shape) in CROWD_COLUMNS.items():
+            column = np.zeros((capacity,) + shape, dtype)
+            if self.capacity:
+                column[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def spawn(self, pos, size=(8, 15), health=30):
+        if self.count == self.capacity:
+            self.allocate(self.capacity * 2)
+        enemy = CrowdEnemy(self, self.count, pos, size, health=health, arrays=self.game.entity_arrays)
+        self.enemies.append(enemy)
+        self.count += 1
+        self.game.enemies.append(enemy)
+        return enemy
+
+    def remove(self, enemy):
+        # Swap the last row into the freed slot to keep the arrays packed
+        slot, last = enemy.slot, self.count - 1
+        if slot != last:
+            for name in CROWD_COLUMNS:
+                column = getattr(self, name)
+                column[slot] = column[last]
+            moved = self.enemies[last]
+            moved.slot = slot
+            self.enemies[slot] = moved
+        self.enemies.pop()
+        self.count -= 1
+
+    def update(self):
+        n = self.count
+        if not n:
+            return
+        self.pos[:n] = [enemy.pos for enemy in self.enemies]
+        x = self.pos[:n, 0]
+        player_pos = self.game.player.pos
+        movement = self.movement[:n]
+        movement[:] = 0
+        tracking = self.tracking_player[:n]
+        shown = self.exclamation_shown[:n]
+        counter = self.exclamation_counter[:n]
+        trigger = self.trigger_exclamation[:n]
+        direction = self.patrol_direction[:n]
+
+        # Move towards the player only if within 8 tiles horizontally (128 pixels) and 4 tiles vertically (64 pixels)
+        dx = player_pos[0] - x
+        in_range = (np.abs(dx) <= 128) & (np.abs(player_pos[1] - self.pos[:n, 1]) <= 64)
+        # Trackers head for the next link of the player's flow field, or the player itself on the same span
+        goal = np.full(n, float(player_pos[0]))
+        drops = np.zeros(n, np.bool_)
+        nav = self.game.nav
+        tracked = np.flatnonzero(in_range)
+        field = nav.flow_field(self.game.player) if len(tracked) else None
+        if field is not None:
+            enemies = self.enemies
+            spans = np.array([nav.span_under(enemies[i].pos, enemies[i].size) for i in tracked.tolist()], np.int64)
+            link_x = np.where(spans >= 0, field.goal_x[spans], np.nan)
+            routed = ~np.isnan(link_x)
+            widths = np.array([enemies[i].size[0] for i in tracked[routed].tolist()], np.float64)
+            goal[tracked[routed]] = link_x[routed] - widths / 2
+            drops[tracked] = np.where(spans >= 0, field.drop[spans], False)
+        movement[:, 0] = np.where(in_range, np.sign(goal - x) * 0.5, 0)
+        start = in_range & ~tracking & (counter == 0) & trigger
+        shown[start] = True  # Show exclamation point when starting to track
+        counter[start] = 30  # Show for 30 frames
+        trigger[start] = False
+        tracking[:] = in_range
+
+        # Patrol logic for everyone out of range
+        patrol = ~in_range
+        shown[patrol] = False
+        trigger[patrol] = True
+        counter[patrol] = 0
+        right = patrol & (direction == 1)
+        left = patrol & (direction == -1)
+        movement[right & (x < self.patrol_right[:n]), 0] = 0.5
+        direction[right & (x >= self.patrol_right[:n])] = -1
+        movement[left & (x > self.patrol_left[:n]), 0] = -0.5
+        direction[left & (x <= self.patrol_left[:n])] = 1
+
+        # Update exclamation point counters
+        counting = counter > 0
+        counter[counting] -= 1
+        shown[~counting] = False
+
+        # Apply knockback to movement and dampen it
+        knockback = self.knockback[:n]
+        active = np.hypot(knockback[:, 0], knockback[:, 1]) > 0
+        movement[active] += knockback[active]
+        knockback[active] *= 0.9
+        knockback[active & (np.hypot(knockback[:, 0], knockback[:, 1]) < 0.1)] = 0
+
+        # Hand the results to the per-enemy physics as plain Python values, one conversion per tick
+        self.moves = movement.tolist()
+        self.drops = drops.tolist()
+        self.settled = (~knockback.any(axis=1)).tolist()
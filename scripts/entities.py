@@ -1,67 +1,132 @@
+import numpy as np
 import pygame
 import random
-import asyncio
 from scripts.tilemap import Tilemap
-from scripts.particle import SkullParticle  # Import SkullParticle
 
-
-# Base class for all entities that have physics properties
+# Bits of PhysicsEntity.collision, set for the sides that hit a solid tile in the last update
+COLLIDE_UP, COLLIDE_DOWN, COLLIDE_LEFT, COLLIDE_RIGHT = 1, 2, 4, 8
+COLLISION_SIDES = (('up', COLLIDE_UP), ('down', COLLIDE_DOWN), ('left', COLLIDE_LEFT), ('right', COLLIDE_RIGHT))
+
+
+# Optional struct-of-arrays home for entity state. An entity created with one keeps pos, prev_pos and
+# velocity as row views into these arrays, so other systems can read or write every entity's state
+# with one array operation. Capacity is fixed because growing would leave the views pointing at the
+# old arrays.
+class EntityArrays:
+    def __init__(self, capacity=16384):
+        self.capacity = capacity
+        self.pos = np.zeros((capacity, 2), np.float64)
+        self.prev_pos = np.zeros((capacity, 2), np.float64)
+        self.velocity = np.zeros((capacity, 2), np.float64)
+        self.used = np.zeros(capacity, np.bool_)
+        self.free = list(range(capacity - 1, -1, -1))  # Popped from the end, so low slots go first
+
+    def allocate(self):
+        if not self.free:
+            raise MemoryError(f'EntityArrays full ({self.capacity} entities)')
+        slot = self.free.pop()
+        self.used[slot] = True
+        return slot
+
+    def release(self, slot):
+        self.used[slot] = False
+        self.free.append(slot)
+
+
+# Base class for all entities that have physics properties. Entities use __slots__ and keep no
+# per-instance dicts or per-tick temporaries, there can be tens of thousands of them.
 class PhysicsEntity:
-    def __init__(self, game, e_type, pos, size, health=100):
+    __slots__ = ('game', 'type', 'pos', 'prev_pos', 'size', 'velocity', 'collision', 'health', 'max_health',
+                 'action', 'anim_offset', 'flip', 'knockback_x', 'knockback_y', 'animation', 'anim_frame',
+                 'arrays', 'array_slot')
+
+    def __init__(self, game, e_type, pos, size, health=100, arrays=None):
         self.game = game  # Reference to the game instance
         self.type = e_type  # Type of the entity (e.g., player, enemy)
-        self.pos = list(pos)  # Position of the entity
+        self.arrays = arrays  # EntityArrays holding pos, prev_pos and velocity, None for plain lists
+        if arrays is None:
+            self.array_slot = -1
+            self.pos = list(pos)  # Position of the entity
+            self.prev_pos = list(pos)  # Position before the last update, for render interpolation
+            self.velocity = [0, 0]  # Velocity of the entity
+        else:
+            self.array_slot = arrays.allocate()
+            self.pos = arrays.pos[self.array_slot]
+            self.prev_pos = arrays.prev_pos[self.array_slot]
+            self.velocity = arrays.velocity[self.array_slot]
+            self.pos[:] = pos
+            self.prev_pos[:] = pos
+            self.velocity[:] = 0
         self.size = size  # Size of the entity (width, height)
-        self.velocity = [0, 0]  # Velocity of the entity
-        self.collisions = {'up': False, 'down': False, 'left': False, 'right': False}  # Collision flags
+        self.collision = 0  # COLLIDE_* bits
         self.health = health  # Current health of the entity
         self.max_health = health  # Maximum health of the entity
         self.action = ''  # Current action/animation of the entity
         self.anim_offset = (0, 0)  # Offset for the animation
         self.flip = False  # Flag for flipping the sprite horizontally
-        self.knockback = pygame.Vector2(0, 0)  # Initialize knockback vector
+        self.knockback = (0, 0)  # Initialize knockback vector
         self.set_action('idle')  # Set the initial action to 'idle'
 
+    @property
+    def collisions(self):
+        # Collision flags as a dict, for code written against the old attribute
+        return {side: bool(self.collision & bit) for side, bit in COLLISION_SIDES}
+
+    @property
+    def knockback(self):
+        return (self.knockback_x, self.knockback_y)
+
+    @knockback.setter
+    def knockback(self, value):
+        self.knockback_x, self.knockback_y = float(value[0]), float(value[1])
+
+    def release(self):
+        # Hand the entity's rows back to its EntityArrays, once it's gone from the game
+        if self.arrays is not None and self.array_slot >= 0:
+            self.arrays.release(self.array_slot)
+            self.array_slot = -1
+
     def rect(self):
         return pygame.Rect(self.pos[0], self.pos[1], self.size[0], self.size[1])
 
     def set_action(self, action):
+        # Animations are shared with every entity of the type, the entity only keeps its own frame counter
         if action != self.action:
             self.action = action
-            self.animation = self.game.assets[self.type + '/' + self.action].copy()
+            self.animation = self.game.assets[self.type + '/' + self.action]
+            self.anim_frame = 0
 
     def update(self, tilemap, movement=(0, 0)):
-        self.collisions = {'up': False, 'down': False, 'left': False, 'right': False}  # Reset collision flags
-        frame_movement = [movement[0] + self.velocity[0], movement[1] + self.velocity[1]]  # Calculate frame movement
-
-        if self.velocity[0] != 0:
-            self.velocity[0] *= 0.9  # Dampen horizontal velocity over time
-
-        # Update horizontal position and check for collisions
-        self.pos[0] += frame_movement[0]
-        entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.pos, self.size):
-            if entity_rect.colliderect(rect):
-                if frame_movement[0] > 0:
-                    entity_rect.right = rect.left
-                    self.collisions['right'] = True
-                if frame_movement[0] < 0:
-                    entity_rect.left = rect.right
-                    self.collisions['left'] = True
-                self.pos[0] = entity_rect.x
-
-        # Update vertical position and check for collisions
-        self.pos[1] += frame_movement[1]
-        entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.pos, self.size):
-            if entity_rect.colliderect(rect):
-                if frame_movement[1] > 0:
-                    entity_rect.bottom = rect.top
-                    self.collisions['down'] = True
-                if frame_movement[1] < 0:
-                    entity_rect.top = rect.bottom
-                    self.collisions['up'] = True
-                self.pos[1] = entity_rect.y
+        pos, size, velocity = self.pos, self.size, self.velocity
+        collision = 0  # Reset collision flags
+        self.prev_pos[0], self.prev_pos[1] = pos[0], pos[1]
+        move_x, move_y = movement[0] + velocity[0], movement[1] + velocity[1]  # Calculate frame movement
+
+        if velocity[0] != 0:
+            velocity[0] *= 0.9  # Dampen horizontal velocity over time
+
+        # Update horizontal position, sweeping through the tiles so fast moves can't skip a wall
+        hit = tilemap.sweep(pos[0], pos[1], size[0], size[1], move_x, 0)
+        if hit is None:
+            pos[0] += move_x
+        elif move_x > 0:
+            pos[0] = hit.tile[0] * tilemap.tile_size - size[0]
+            collision |= COLLIDE_RIGHT
+        else:
+            pos[0] = (hit.tile[0] + 1) * tilemap.tile_size
+            collision |= COLLIDE_LEFT
+
+        # Update vertical position the same way
+        hit = tilemap.sweep(pos[0], pos[1], size[0], size[1], 0, move_y)
+        if hit is None:
+            pos[1] += move_y
+        elif move_y > 0:
+            pos[1] = hit.tile[1] * tilemap.tile_size - size[1]
+            collision |= COLLIDE_DOWN
+        else:
+            pos[1] = (hit.tile[1] + 1) * tilemap.tile_size
+            collision |= COLLIDE_UP
+        self.collision = collision
 
         # Update flip flag based on movement direction
         if movement[0] > 0:
@@ -74,20 +139,73 @@ class PhysicsEntity:
             self.velocity[1] = min(15, self.velocity[1] + 0.1)
 
         # Reset vertical velocity on collision with ground or ceiling
-        if self.collisions['down'] or self.collisions['up']:
+        if collision & (COLLIDE_DOWN | COLLIDE_UP):
             self.velocity[1] = 0
 
-        self.animation.update()  # Update animation
+        self.anim_frame = self.animation.next_frame(self.anim_frame)  # Update animation
 
     def render(self, surf, offset=(0, 0)):
-        surf.blit(pygame.transform.flip(self.animation.img(), self.flip, False),
+        surf.blit(self.animation.frame_img(self.anim_frame, flip=self.flip),
                   (self.pos[0] - offset[0] + self.anim_offset[0],
                    self.pos[1] - offset[1] + self.anim_offset[1]))
 
+    def apply_knockback(self, knockback):
+        self.knockback = knockback  # Apply knockback
+
+    def knockback_settled(self):
+        return self.knockback_x * self.knockback_x + self.knockback_y * self.knockback_y < 0.01
+
+    def decay_knockback(self, movement):
+        # Add the knockback to the movement and dampen it, returns the new movement
+        kx, ky = self.knockback_x, self.knockback_y
+        if kx == 0 and ky == 0:
+            return movement
+        movement = (movement[0] + kx, movement[1] + ky)
+        kx *= 0.9  # Dampen knockback over time
+        ky *= 0.9
+        if kx * kx + ky * ky < 0.01:
+            kx = ky = 0.0  # Stop knockback if it's very small
+        self.knockback_x, self.knockback_y = kx, ky
+        return movement
+
+    def handle_contacts(self):
+        # Damage the player on contact and push apart from overlapping enemies. Candidates come
+        # from the game's spatial hash instead of a scan over every enemy
+        game = self.game
+        pos, size = self.pos, self.size
+        separate = self.knockback_settled()
+        for other in game.entity_hash.query(pos[0], pos[1], size[0], size[1]):
+            if other is self or other in game.removed_enemies:
+                continue
+            # Same overlap test as Rect.colliderect on the entities' integer rects, without building them
+            x, y, ox, oy = int(pos[0]), int(pos[1]), int(other.pos[0]), int(other.pos[1])
+            if not (x < ox + other.size[0] and ox < x + size[0] and y < oy + other.size[1] and oy < y + size[1]):
+                continue
+            if other is game.player:
+                if self.pos[0] < other.pos[0]:
+                    knockback = [3, -1]
+                else:
+                    knockback = [-3, -1]  # Set knockback vector
+                other.take_damage(5, knockback)  # Apply damage and knockback to the player
+            elif separate and not isinstance(other, Player):
+                if pos[0] < other.pos[0]:
+                    pos[0] = other.pos[0] - size[0]
+                elif pos[0] > other.pos[0]:
+                    pos[0] = other.pos[0] + size[0]
+
+    def draw_health_bar(self, surf, offset=(0, 0)):
+        # Thin bar above the entity, red background with the remaining health in green
+        x = self.pos[0] - offset[0]
+        y = self.pos[1] - offset[1] - 4
+        pygame.draw.rect(surf, (120, 0, 0), (x, y, self.size[0], 2))
+        pygame.draw.rect(surf, (0, 200, 0), (x, y, self.size[0] * self.health / self.max_health, 2))
+
 # Class for the player character, inherits from PhysicsEntity
 class Player(PhysicsEntity):
-    def __init__(self, game, e_type, pos, size):
-        super().__init__(game, e_type, pos, size)
+    __slots__ = ('air_time', 'dead')
+
+    def __init__(self, game, e_type, pos, size, arrays=None):
+        super().__init__(game, e_type, pos, size, arrays=arrays)
         self.air_time = 0  # Time the player has been in the air
         self.dead = False
 
@@ -98,7 +216,7 @@ class Player(PhysicsEntity):
         super().update(tilemap, movement=movement)  # Update position and handle collisions
 
         self.air_time += 1
-        if self.collisions['down']:
+        if self.collision & COLLIDE_DOWN:
             self.air_time = 0
 
         # Set appropriate action based on state
@@ -122,7 +240,7 @@ class Player(PhysicsEntity):
             self.health = 0  # Ensure health doesn't go below 0
             self.die()  # Player dies when health is zero
             return
-        self.game.audio['damage'].play() 
+        self.game.play_sound('damage') 
 
 
     def die(self):
@@ -131,17 +249,20 @@ class Player(PhysicsEntity):
 
     # Override the render method and add custom offset for player sprite
     def render(self, surf, offset=(0, 0)):
-        surf.blit(pygame.transform.flip(self.animation.img(), self.flip, False),
+        surf.blit(self.animation.frame_img(self.anim_frame, flip=self.flip),
                   (self.pos[0] - offset[0] + self.anim_offset[0] - 5,
                    self.pos[1] - offset[1] + self.anim_offset[1]))
 
 
 # Class for enemy characters, inherits from PhysicsEntity
 class Enemy(PhysicsEntity):
-    def __init__(self, game, pos, size, health=30):
-        super().__init__(game, 'enemy', pos, size, health=health)
+    __slots__ = ('dodge_cooldown', 'attack_cooldown', 'jump_cooldown', 'patrol_left', 'patrol_right',
+                 'patrol_direction', 'tracking_player', 'exclamation_shown', 'exclamation_counter',
+                 'trigger_exclamation')
+
+    def __init__(self, game, pos, size, health=30, arrays=None):
+        super().__init__(game, 'enemy', pos, size, health=health, arrays=arrays)
         self.set_action('idle')  # Set initial action to 'idle'
-        self.knockback = pygame.Vector2(0, 0)  # Initialize knockback vector
         self.dodge_cooldown = 0  # Cooldown for dodging
         self.attack_cooldown = 0  # Cooldown for attacking
         self.jump_cooldown = 0  # Cooldown for jumping
@@ -160,24 +281,27 @@ class Enemy(PhysicsEntity):
         self.health -= damage
         if self.health <= 0:
             self.health = 0
-            self.game.audio['death'].play()  # Play enemy death sound
-            self.game.enemies.remove(self)
-            self.game.particles.append(SkullParticle(self.game, (self.pos[0] + self.size[0] / 2, self.pos[1])))  # Add skull particle
+            self.game.play_sound('death')  # Play enemy death sound
+            self.game.remove_enemy(self)
+            self.game.particles.spawn('skull', (self.pos[0] + self.size[0] / 2, self.pos[1]))  # Add skull particle
             return
-        self.game.audio['damage'].play()
+        self.game.play_sound('damage')
 
     def update(self, tilemap, movement=(0, 0)):
         # Check for dying from falling too fast
         if self.velocity[1] >= 15:
-            self.game.enemies.remove(self)
+            self.game.remove_enemy(self)
             return
 
         # Move towards the player only if within 8 tiles horizontally (128 pixels) and 4 tiles vertically (64 pixels)
         player_pos = self.game.player.pos
+        drop = False
         if abs(player_pos[0] - self.pos[0]) <= 128 and abs(player_pos[1] - self.pos[1]) <= 64:
-            if player_pos[0] > self.pos[0]:
+            # Follow the navigation graph, which leads off ledges when the player is on a platform below
+            goal_x, drop = self.game.nav.steer(self.pos, self.size, self.game.player)
+            if goal_x > self.pos[0]:
                 movement = (0.5, 0)  # Move right
-            elif player_pos[0] < self.pos[0]:
+            elif goal_x < self.pos[0]:
                 movement = (-0.5, 0)  # Move left
             if not self.tracking_player and self.exclamation_counter == 0 and self.trigger_exclamation:
                 self.exclamation_shown = True  # Show exclamation point when starting to track
@@ -208,38 +332,21 @@ class Enemy(PhysicsEntity):
             self.exclamation_shown = False
 
         # Apply knockback to movement
-        if self.knockback.length() > 0:
-            movement = (movement[0] + self.knockback.x, movement[1] + self.knockback.y)
-            self.knockback *= 0.9  # Dampen knockback over time
-            if self.knockback.length() < 0.1:
-                self.knockback = pygame.Vector2(0, 0)  # Stop knockback if it's very small
-
-        next_pos = [self.pos[0] + movement[0] * 16, self.pos[1] + self.size[1]]
-        on_ground = False
-        for rect in tilemap.physics_rects_around(next_pos, self.size):
-            if pygame.Rect(next_pos[0], next_pos[1], self.size[0], 1).colliderect(rect):
-                on_ground = True
-                break
+        movement = self.decay_knockback(movement)
+
+        self.move(tilemap, movement, drop)
+
+    def move(self, tilemap, movement, drop=False):
+        # Ledge avoidance, contacts and physics for the movement chosen by the AI. drop is set when
+        # the AI means to walk off the ledge
+        on_ground = self.game.nav.supported(self.pos[0] + movement[0] * 16, self.pos[1] + self.size[1], self.size[0])
 
         # Prevent movement in the direction of the ledge
-        if not on_ground and self.knockback == (0, 0):
+        if not on_ground and not drop and self.knockback_settled():
             movement = (0, movement[1]) if movement[0] != 0 else movement
 
-        # Check for collision with the player
-        if self.rect().colliderect(self.game.player.rect()):
-            if self.pos[0] < self.game.player.pos[0]:
-                knockback = [3, -1]
-            else:
-                knockback = [-3, -1]  # Set knockback vector
-            self.game.player.take_damage(5, knockback)  # Apply damage and knockback to the player
-
-        # Check for collision with other enemies
-        for enemy in self.game.enemies:
-            if enemy != self and self.rect().colliderect(enemy.rect()) and self.knockback.length() < 0.1:
-                if self.pos[0] < enemy.pos[0]:
-                    self.pos[0] = enemy.pos[0] - self.size[0]
-                elif self.pos[0] > enemy.pos[0]:
-                    self.pos[0] = enemy.pos[0] + self.size[0]
+        # Check for collision with the player and other enemies
+        self.handle_contacts()
 
         super().update(tilemap, movement=movement)  # Update position and handle collisions
 
@@ -251,7 +358,7 @@ class Enemy(PhysicsEntity):
             self.set_action('idle')
 
     def render(self, surf, offset=(0, 0)):
-        surf.blit(pygame.transform.flip(self.animation.img(), self.flip, False),
+        surf.blit(self.animation.frame_img(self.anim_frame, flip=self.flip),
                   (self.pos[0] - offset[0] + self.anim_offset[0] - 5,
                    self.pos[1] - offset[1] + self.anim_offset[1]))
         self.draw_health_bar(surf, offset)  # Draw health bar
@@ -265,16 +372,19 @@ class Enemy(PhysicsEntity):
 
 # Class for boss characters, inherits from PhysicsEntity
 class Boss(PhysicsEntity):
-    def __init__(self, game, pos, size, health=100):
-        super().__init__(game, 'boss', pos, size, health)
+    __slots__ = ('special_attack_cooldown', 'patrol_left', 'patrol_right', 'patrol_direction', 'tracking_player',
+                 'exclamation_shown', 'exclamation_counter', 'trigger_exclamation')
+
+    def __init__(self, game, pos, size, health=100, arrays=None):
+        super().__init__(game, 'boss', pos, size, health, arrays=arrays)
         self.special_attack_cooldown = 0  # Cooldown for special attack
-        self.knockback = pygame.Vector2(0, 0)  # Initialize knockback vector
         self.patrol_left = self.pos[0] - 32  # Set patrol left boundary (2 tiles left)
         self.patrol_right = self.pos[0] + 32  # Set patrol right boundary (2 tiles right)
         self.patrol_direction = 1  # Start by moving right
         self.tracking_player = False  # Flag to indicate if the enemy is tracking the player
         self.exclamation_shown = False  # Flag to show exclamation point
         self.exclamation_counter = 0  # Counter for exclamation point duration
+        self.trigger_exclamation = True  # Flag to trigger exclamation point
 
     def apply_knockback(self, knockback):
         self.knockback = knockback  # Apply knockback
@@ -283,24 +393,27 @@ class Boss(PhysicsEntity):
         self.health -= damage
         if self.health <= 0:
             self.health = 0
-            self.game.audio['death'].play()
-            self.game.enemies.remove(self)
-            self.game.particles.append(SkullParticle(self.game, (self.pos[0] + self.size[0] / 2, self.pos[1])))  # Add skull particle
+            self.game.play_sound('death')
+            self.game.remove_enemy(self)
+            self.game.particles.spawn('skull', (self.pos[0] + self.size[0] / 2, self.pos[1]))  # Add skull particle
             return
-        self.game.audio['damage'].play()
+        self.game.play_sound('damage')
 
     def update(self, tilemap, movement=(0, 0)):
         # Check for dying from falling too fast
         if self.velocity[1] >= 15:
-            self.game.enemies.remove(self)
+            self.game.remove_enemy(self)
             return
 
         # Move towards the player only if within 8 tiles horizontally (128 pixels) and 4 tiles vertically (64 pixels)
         player_pos = self.game.player.pos
+        drop = False
         if abs(player_pos[0] - self.pos[0]) <= 128 and abs(player_pos[1] - self.pos[1]) <= 64:
-            if player_pos[0] > self.pos[0]:
+            # Follow the navigation graph, which leads off ledges when the player is on a platform below
+            goal_x, drop = self.game.nav.steer(self.pos, self.size, self.game.player)
+            if goal_x > self.pos[0]:
                 movement = (0.5, 0)  # Move right
-            elif player_pos[0] < self.pos[0]:
+            elif goal_x < self.pos[0]:
                 movement = (-0.5, 0)  # Move left
             if not self.tracking_player and self.exclamation_counter == 0 and self.trigger_exclamation:
                 self.exclamation_shown = True  # Show exclamation point when starting to track
@@ -331,11 +444,7 @@ class Boss(PhysicsEntity):
             self.exclamation_shown = False
 
         # Apply knockback to movement
-        if self.knockback.length() > 0:
-            movement = (movement[0] + self.knockback.x, movement[1] + self.knockback.y)
-            self.knockback *= 0.9  # Dampen knockback over time
-            if self.knockback.length() < 0.1:
-                self.knockback = pygame.Vector2(0, 0)  # Stop knockback if it's very small
+        movement = self.decay_knockback(movement)
 
         # Special attack logic
         if self.special_attack_cooldown == 0 and self.tracking_player:
@@ -344,32 +453,14 @@ class Boss(PhysicsEntity):
         elif self.special_attack_cooldown > 0:
             self.special_attack_cooldown -= 1
 
-        next_pos = [self.pos[0] + movement[0] * 16, self.pos[1] + self.size[1]]
-        on_ground = False
-        for rect in tilemap.physics_rects_around(next_pos, self.size):
-            if pygame.Rect(next_pos[0], next_pos[1], self.size[0], 1).colliderect(rect):
-                on_ground = True
-                break
+        on_ground = self.game.nav.supported(self.pos[0] + movement[0] * 16, self.pos[1] + self.size[1], self.size[0])
 
         # Prevent movement in the direction of the ledge
-        if not on_ground and self.knockback == (0, 0):
+        if not on_ground and not drop and self.knockback_settled():
             movement = (0, movement[1]) if movement[0] != 0 else movement
 
-        # Check for collision with the player
-        if self.rect().colliderect(self.game.player.rect()):
-            if self.pos[0] < self.game.player.pos[0]:
-                knockback = [3, -1]
-            else:
-                knockback = [-3, -1]  # Set knockback vector
-            self.game.player.take_damage(5, knockback)  # Apply damage and knockback to the player
-
-        # Check for collision with other enemies
-        for enemy in self.game.enemies:
-            if enemy != self and self.rect().colliderect(enemy.rect()) and self.knockback.length() < 0.1:
-                if self.pos[0] < enemy.pos[0]:
-                    self.pos[0] = enemy.pos[0] - self.size[0]
-                elif self.pos[0] > enemy.pos[0]:
-                    self.pos[0] = enemy.pos[0] + self.size[0]
+        # Check for collision with the player and other enemies
+        self.handle_contacts()
 
         super().update(tilemap, movement=movement)  # Update position and handle collisions
 
@@ -382,19 +473,18 @@ class Boss(PhysicsEntity):
             self.set_action('idle')
 
     def special_attack(self):
-        # Define special attack behavior, such as shooting projectiles
+        # Throw a red shuriken at the player, from the game's projectile pool
         player_pos = self.game.player.pos
-        direction = pygame.Vector2(player_pos[0] - self.pos[0], player_pos[1] - self.pos[1]).normalize()
+        direction = (player_pos[0] - self.pos[0], player_pos[1] - self.pos[1])
         projectile_pos = (self.pos[0] + self.size[0] // 2, self.pos[1] + self.size[1] // 2)
-        new_projectile = RedShuriken(self.game, projectile_pos, direction)
-        self.game.projectiles.append(new_projectile)
+        self.game.projectiles.spawn('red_shuriken', projectile_pos, direction)
 
     def render(self, surf, offset=(0, 0)):
         # draw hitbox
         # hitbox = self.rect().move(-offset[0], -offset[1])
         # pygame.draw.rect(surf, (0, 255, 0), hitbox, 1)
 
-        surf.blit(pygame.transform.flip(self.animation.img(), self.flip, False),
+        surf.blit(self.animation.frame_img(self.anim_frame, flip=self.flip),
                   (self.pos[0] - offset[0] + self.anim_offset[0] - 9,
                    self.pos[1] - offset[1] + self.anim_offset[1]))
         self.draw_health_bar(surf, offset)  # Draw health bar
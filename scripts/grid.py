@@ -0,0 +1,87 @@
+from array import array
+
+CHUNK_SIZE = 16  # Tiles per chunk edge, must be a power of two
+
+
+# Sparse tile storage: the map is split into CHUNK_SIZE x CHUNK_SIZE chunks and every
+# allocated chunk holds one compact array of tile ids per layer. Tile id 0 means empty,
+# any other id indexes into self.kinds which holds the (type, variant) pair of the tile.
+class ChunkedGrid:
+    def __init__(self, layers=1, chunk_size=CHUNK_SIZE):
+        if chunk_size & (chunk_size - 1):
+            raise ValueError('chunk_size must be a power of two')
+        self.layers = layers
+        self.chunk_size = chunk_size
+        self.shift = chunk_size.bit_length() - 1
+        self.mask = chunk_size - 1
+        self.chunk_area = chunk_size * chunk_size
+        self.chunks = {}  # (chunk_x, chunk_y) -> array('H') of layers * chunk_area tile ids
+        self.counts = {}  # (chunk_x, chunk_y) -> number of non-empty entries in the chunk
+        self.kinds = [None]  # Tile id -> (type, variant), id 0 is reserved for empty
+        self.kind_ids = {}  # (type, variant) -> tile id
+
+    def kind_id(self, tile_type, variant):
+        # Intern a (type, variant) pair and return its compact id
+        kind = (tile_type, variant)
+        if kind not in self.kind_ids:
+            self.kind_ids[kind] = len(self.kinds)
+            self.kinds.append(kind)
+        return self.kind_ids[kind]
+
+    def add_kind(self, tile_type, variant):
+        # A new id for a pair even if it's interned already, for tiles drawn alike that differ in something
+        # the grid doesn't know about. kind_ids keeps the pair's first id
+        self.kinds.append((tile_type, variant))
+        self.kind_ids.setdefault((tile_type, variant), len(self.kinds) - 1)
+        return len(self.kinds) - 1
+
+    def index(self, x, y, layer=0):
+        return (layer * self.chunk_size + (y & self.mask)) * self.chunk_size + (x & self.mask)
+
+    def get(self, x, y, layer=0):
+        chunk = self.chunks.get((x >> self.shift, y >> self.shift))
+        if chunk is None:
+            return 0
+        return chunk[self.index(x, y, layer)]
+
+    def set(self, x, y, layer, tile_id):
+        key = (x >> self.shift, y >> self.shift)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            if not tile_id:
+                return
+            chunk = array('H', bytes(2 * self.layers * self.chunk_area))
+            self.chunks[key] = chunk
+            self.counts[key] = 0
+        i = self.index(x, y, layer)
+        self.counts[key] += bool(tile_id) - bool(chunk[i])
+        chunk[i] = tile_id
+        if not self.counts[key]:  # Drop chunks that no longer hold any tile
+            del self.chunks[key]
+            del self.counts[key]
+
+    def cell(self, x, y):
+        # Return the (layer, tile id) pairs stored at a cell, ordered by layer
+        chunk = self.chunks.get((x >> self.shift, y >> self.shift))
+        if chunk is None:
+            return []
+        i = self.index(x, y)
+        step = self.chunk_area
+        return [(layer, chunk[i + layer * step]) for layer in range(self.layers) if chunk[i + layer * step]]
+
+    def iter_cells(self):
+        # Yield (x, y) for every cell holding at least one tile
+        size = self.chunk_size
+        for (cx, cy), chunk in self.chunks.items():
+            for i in range(self.chunk_area):
+                if any(chunk[i + layer * self.chunk_area] for layer in range(self.layers)):
+                    yield cx * size + i % size, cy * size + i // size
+
+    def iter_tiles(self):
+        # Yield (x, y, layer, tile id) for every stored tile
+        size = self.chunk_size
+        for (cx, cy), chunk in list(self.chunks.items()):
+            for i, tile_id in enumerate(chunk):
+                if tile_id:
+                    layer, local = divmod(i, self.chunk_area)
+                    yield cx * size + local % size, cy * size + local // size, layer, tile_id
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+from array import array
+
+CACHE_DIR = 'cache/levels'
+CACHE_VERSION = 5  # Bump whenever the compiled layout or what Tilemap stores in it changes
+MAGIC = b'PPLC'
+HEADER = struct.Struct('<4sII')  # magic, version, metadata length
+
+
+# A compiled level is a small binary file:
+#   header | JSON metadata (kinds, size, spawns, objects, section table) | padding | sections
+# Sections are raw arrays named in meta['sections'] as name -> [offset after the metadata, length in bytes],
+# e.g. every chunk's tile ids and collision flags. They're memory-mapped on load so nothing has to be
+# parsed, decoded or recomputed.
+class CompiledLevel:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # A truncated or corrupt file is treated like a stale one, so load() rebuilds it
+        try:
+            magic, version, meta_len = HEADER.unpack_from(self.mm, 0)
+            if magic != MAGIC or version != CACHE_VERSION:
+                raise ValueError
+            self.meta = json.loads(self.mm[HEADER.size:HEADER.size + meta_len])
+            self.data_offset = align(HEADER.size + meta_len)
+            end = max((offset + size for offset, size in self.meta['sections'].values()), default=0)
+            if self.data_offset + end > len(self.mm):
+                raise ValueError
+        except (ValueError, KeyError, TypeError, AttributeError, struct.error):
+            self.mm.close()
+            raise ValueError(f'{path} is not a compiled level of version {CACHE_VERSION}') from None
+
+    def section(self, name, start=0, length=None):
+        # Copy bytes [start, start + length) of a section out of the mapping
+        offset, size = self.meta['sections'][name]
+        if length is None:
+            length = size - start
+        offset += self.data_offset + start
+        return self.mm[offset:offset + length]
+
+    def array(self, name, typecode, start=0, count=None):
+        # Section items [start, start + count) as an array of the given typecode
+        items = array(typecode)
+        size = items.itemsize
+        items.frombytes(self.section(name, start * size, None if count is None else count * size))
+        return items
+
+    def close(self):
+        self.mm.close()
+
+
+def align(offset):
+    # Keep the sections 8-byte aligned
+    return (offset + 7) & ~7
+
+
+def source_hash(tmx_path, extra=''):
+    # Hash the TMX plus every external TSX it references, so editing either recompiles the level
+    digest = hashlib.sha1(f'{CACHE_VERSION};{extra}'.encode())
+    with open(tmx_path, 'rb') as f:
+        data = f.read()
+    digest.update(data)
+    for source in re.findall(rb'<tileset[^>]*source="([^"]+)"', data):
+        with open(os.path.join(os.path.dirname(tmx_path), source.decode()), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def cache_path(level, digest):
+    return os.path.join(CACHE_DIR, f'{level}-{digest[:16]}.bin')
+
+
+def load(level, digest):
+    path = cache_path(level, digest)
+    if not os.path.exists(path):
+        return None
+    try:
+        return CompiledLevel(path)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def save(level, digest, meta, sections):
+    # sections: name -> bytes-like, written after the metadata in order
+    path = cache_path(level, digest)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    table = {}
+    offset = 0
+    for name, data in sections.items():
+        size = memoryview(data).nbytes
+        table[name] = [offset, size]
+        offset = align(offset + size)
+    meta_bytes = json.dumps(dict(meta, sections=table)).encode()
+    padding = align(HEADER.size + len(meta_bytes)) - HEADER.size - len(meta_bytes)
+
+    # Write to a temporary file first so a crash never leaves a half written cache behind
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, CACHE_VERSION, len(meta_bytes)))
+        f.write(meta_bytes)
+        f.write(bytes(padding))
+        for data in sections.values():
+            size = memoryview(data).nbytes
+            f.write(data)
+            f.write(bytes(align(size) - size))
+    os.replace(tmp_path, path)
+
+    # Drop caches compiled from older versions of the same level
+    for name in os.listdir(CACHE_DIR):
+        if name.startswith(level + '-') and name.endswith('.bin') and os.path.join(CACHE_DIR, name) != path:
+            os.remove(os.path.join(CACHE_DIR, name))
@@ -0,0 +1,158 @@
+import numpy as np
+import pygame
+
+AMBIENT = (45, 40, 60)  # Light level of everything no light source reaches
+RAY_EPSILON = 1e-4  # Angle offset of the extra rays cast past every segment endpoint
+
+
+class Light:
+    def __init__(self, pos=(0, 0), radius=96, color=(255, 230, 190)):
+        self.pos = pos  # World pixel position, updated by whoever owns the light
+        self.radius = radius
+        self.color = color
+        self.key = None  # What the cached surface was computed for
+        self.polygon = []  # Visibility polygon in world pixels
+        self.surface = None  # Light texture clipped to the visibility polygon, 2 * radius across
+
+
+# Lights the display with visibility polygons cast against the solid tiles. Occluder edges are built
+# per tilemap chunk from the exposed sides of solid tiles, with collinear sides merged, and only
+# rebuilt when the chunk's collision version changes. A light is recast only when it moved or a
+# chunk it reaches changed; otherwise its cached surface is reused.
+class Lighting:
+    def __init__(self, tilemap, ambient=AMBIENT):
+        self.tilemap = tilemap
+        self.ambient = ambient
+        self.segments = {}  # Chunk key -> (collision version, array of (x1, y1, x2, y2) segments)
+        self.gradients = {}  # (radius, color) -> radial falloff texture
+        self.mask = None
+        self.mask_key = None
+
+    def chunk_segments(self, key):
+        version = self.tilemap.collision_versions.get(key, 0)
+        cached = self.segments.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, self.build_segments(key))
+            self.segments[key] = cached
+        return cached[1]
+
+    def build_segments(self, key):
+        # Sides of solid tiles that face an open tile, merged into the longest straight runs
+        tilemap = self.tilemap
+        solid = tilemap.solid_rects
+        size, ts = tilemap.grid.chunk_size, tilemap.tile_size
+        x0, y0 = key[0] * size, key[1] * size
+        segments = []
+        for y in range(y0, y0 + size):
+            for side, dy in ((y, -1), (y + 1, 1)):  # Top, then bottom sides of the row
+                start = None
+                for x in range(x0, x0 + size + 1):
+                    exposed = x < x0 + size and (x, y) in solid and (x, y + dy) not in solid
+                    if exposed and start is None:
+                        start = x
+                    elif not exposed and start is not None:
+                        segments.append((start * ts, side * ts, x * ts, side * ts))
+                        start = None
+        for x in range(x0, x0 + size):
+            for side, dx in ((x, -1), (x + 1, 1)):  # Left, then right sides of the column
+                start = None
+                for y in range(y0, y0 + size + 1):
+                    exposed = y < y0 + size and (x, y) in solid and (x + dx, y) not in solid
+                    if exposed and start is None:
+                        start = y
+                    elif not exposed and start is not None:
+                        segments.append((side * ts, start * ts, side * ts, y * ts))
+                        start = None
+        return np.array(segments, np.float64).reshape(-1, 4)
+
+    def light_key(self, light):
+        # Everything the light's polygon depends on: its pixel, reach and the collision of the chunks it reaches
+        chunk_px = self.tilemap.grid.chunk_size * self.tilemap.tile_size
+        x, y = int(light.pos[0]), int(light.pos[1])
+        versions = self.tilemap.collision_versions
+        chunks = tuple((cx, cy, versions.get((cx, cy), 0))
+                       for cx in range((x - light.radius) // chunk_px, (x + light.radius) // chunk_px + 1)
+                       for cy in range((y - light.radius) // chunk_px, (y + light.radius) // chunk_px + 1))
+        return (x, y, light.radius, light.color, chunks)
+
+    def visibility(self, x, y, radius, chunks):
+        """
+        Visibility polygon of a point, limited to the square of the given radius around it.
+
+        :param chunks: Chunk keys (with versions) that can hold occluders within reach.
+        :return: Polygon points in world pixels, sorted by angle.
+        """
+        left, top, right, bottom = x - radius, y - radius, x + radius, y + radius
+        bounds = np.array(((left, top, right, top), (right, top, right, bottom),
+                           (right, bottom, left, bottom), (left, bottom, left, top)), np.float64)
+        segs = np.concatenate([bounds] + [self.chunk_segments((cx, cy)) for cx, cy, version in chunks])
+        # Drop occluders entirely outside the square
+        inside = ((np.maximum(segs[:, 0], segs[:, 2]) >= left) & (np.minimum(segs[:, 0], segs[:, 2]) <= right)
+                  & (np.maximum(segs[:, 1], segs[:, 3]) >= top) & (np.minimum(segs[:, 1], segs[:, 3]) <= bottom))
+        segs = segs[inside]
+
+        # One ray at every endpoint, plus one just either side of it to see past corners
+        ends = np.concatenate((segs[:, :2], segs[:, 2:]))
+        angles = np.unique(np.arctan2(ends[:, 1] - y, ends[:, 0] - x))
+        angles = np.concatenate((angles - RAY_EPSILON, angles, angles + RAY_EPSILON))
+        angles.sort()
+        dx, dy = np.cos(angles)[:, None], np.sin(angles)[:, None]
+
+        # Ray (x, y) + r * d against segment a + s * e, for every ray and segment at once
+        ax, ay = segs[:, 0] - x, segs[:, 1] - y
+        ex, ey = segs[:, 2] - segs[:, 0], segs[:, 3] - segs[:, 1]
+        denom = dx * ey - dy * ex
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = (ax * ey - ay * ex) / denom
+            s = (ax * dy - ay * dx) / denom
+        r[(denom == 0) | (r < 0) | (s < -1e-9) | (s > 1 + 1e-9)] = np.inf
+        r = r.min(axis=1)
+        r = np.minimum(r, radius * 2)  # The bounding square always stops a ray, this only guards against float misses
+        return np.stack((x + dx[:, 0] * r, y + dy[:, 0] * r), axis=1).tolist()
+
+    def gradient(self, radius, color):
+        key = (radius, color)
+        if key not in self.gradients:
+            # Quadratic falloff from the color at the center to black at the radius
+            size = radius * 2
+            coords = np.arange(size) - radius + 0.5
+            distance = np.hypot(coords[:, None], coords[None, :]) / radius
+            falloff = np.clip(1 - distance, 0, 1) ** 2
+            surf = pygame.Surface((size, size))
+            pygame.surfarray.blit_array(surf, (falloff[:, :, None] * np.array(color)).astype(np.uint8))
+            self.gradients[key] = surf
+        return self.gradients[key]
+
+    def update_light(self, light):
+        key = self.light_key(light)
+        if key == light.key:
+            return False
+        light.key = key
+        x, y, radius, color, chunks = key
+        light.polygon = self.visibility(x, y, radius, chunks)
+        # Light texture with everything outside the polygon cut away
+        surf = light.surface
+        if surf is None or surf.get_width() != radius * 2:
+            surf = pygame.Surface((radius * 2, radius * 2))
+        surf.fill((0, 0, 0))
+        if len(light.polygon) >= 3:
+            pygame.draw.polygon(surf, (255, 255, 255), [(px - x + radius, py - y + radius) for px, py in light.polygon])
+        surf.blit(self.gradient(radius, color), (0, 0), special_flags=pygame.BLEND_RGB_MULT)
+        light.surface = surf
+        return True
+
+    def render(self, surf, lights, offset=(0, 0)):
+        # Multiply the display by the light mask, rebuilding the mask only when a light or the camera moved
+        changed = False
+        for light in lights:
+            changed |= self.update_light(light)
+        mask_key = (int(offset[0]), int(offset[1]), surf.get_size(), tuple(light.key for light in lights))
+        if changed or mask_key != self.mask_key:
+            if self.mask is None or self.mask.get_size() != surf.get_size():
+                self.mask = pygame.Surface(surf.get_size())
+            self.mask.fill(self.ambient)
+            for light in lights:
+                self.mask.blit(light.surface, (light.key[0] - light.radius - int(offset[0]), light.key[1] - light.radius - int(offset[1])),
+                               special_flags=pygame.BLEND_RGB_ADD)
+            self.mask_key = mask_key
+        surf.blit(self.mask, (0, 0), special_flags=pygame.BLEND_RGB_MULT)
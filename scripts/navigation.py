@@ -0,0 +1,416 @@
+import heapq
+import math
+from collections import OrderedDict
+import numpy as np
+from scripts.tilemap import LADDER
+
+# Link kinds between platforms
+DROP, CLIMB = 1, 2
+WALKER = DROP  # Links enemies can follow: they walk off ledges but can't climb
+MAX_DROP = 12  # Deepest fall, in tiles, the graph links
+MAX_COST = 96  # Flow fields stop searching this many tiles of travel from the target
+FIELD_CACHE = 16  # Flow fields kept per NavGraph, least recently used goes first
+
+
+# Paths toward one target platform for every platform in the graph, as arrays indexed by span id
+class FlowField:
+    def __init__(self, target, next_span, goal_x, drop, cost):
+        self.target = target  # Span id the field leads to
+        self.next_span = next_span  # Span reached by the next link, -1 on the target span or without a route
+        self.goal_x = goal_x  # Pixel x of the center of the cell to head for next, NaN on the target span or without a route
+        self.drop = drop  # Whether heading for goal_x means walking off the platform
+        self.cost = cost  # Tiles to go, inf without a route
+
+
+# Platform graph of the tilemap for ground-bound AI. Walkable spans are maximal horizontal runs of
+# open cells standing on a solid or one-way cell; links join a span to the span below either end
+# (drops) and spans joined by a ladder column (climbs). Paths come from flow fields: one Dijkstra
+# from the target's span gives every span its next link, so any number of enemies chasing the same
+# player share one search, redone only when the player lands on another span. When cells change the
+# graph is only redone around the chunks whose collision version moved, so streaming never rebuilds it.
+class NavGraph:
+    def __init__(self, tilemap, max_drop=MAX_DROP, max_cost=MAX_COST):
+        self.tilemap = tilemap
+        self.max_drop = max_drop
+        self.max_cost = max_cost
+        self.epoch = None  # Tilemap collision epoch the graph was built from
+        self.versions = {}  # Tilemap collision versions the graph was built from
+        self.spans = []  # Span id -> (row, first column, last column), None for ids freed by updates
+        self.free = []  # Freed span ids, reused by new spans
+        self.span_of = {}  # (x, y) standing cell -> span id
+        self.links = []  # Span id -> [(span id, kind, exit column, cost)]
+        self.incoming = []  # Span id -> [(span id, kind, exit column, cost)] of the links leading to it
+        self.fields = OrderedDict()  # (target span, kinds) -> FlowField
+        self.targets = {}  # Target entity -> (cell, span) at its last query
+
+    def refresh(self):
+        # Catch up when solid or one-way cells changed (edits, chunks streaming in or out). Only the first
+        # use builds the whole graph, later changes update it around the chunks that changed
+        tilemap = self.tilemap
+        if self.epoch == tilemap.collision_epoch:
+            return
+        if self.epoch is None:
+            self.build()
+            return
+        versions = tilemap.collision_versions
+        changed = [key for key, version in versions.items() if self.versions.get(key) != version]
+        self.epoch = tilemap.collision_epoch
+        self.versions = dict(versions)
+        if changed:
+            self.update(changed)
+
+    def build(self):
+        tilemap = self.tilemap
+        solid, one_way = tilemap.solid_rects, tilemap.one_way_cells
+        self.epoch = tilemap.collision_epoch
+        self.versions = dict(tilemap.collision_versions)
+        self.free = []
+        self.fields.clear()
+        self.targets.clear()
+
+        # Open cells with something to stand on, grouped by row
+        rows = {}
+        for cells in (solid, one_way):
+            for x, y in cells:
+                if (x, y - 1) not in solid:
+                    rows.setdefault(y - 1, []).append(x)
+
+        spans = []
+        span_of = {}
+        for y, xs in rows.items():
+            xs.sort()
+            start = prev = xs[0]
+            for x in xs[1:] + [None]:
+                if x != prev + 1:
+                    for cx in range(start, prev + 1):
+                        span_of[(cx, y)] = len(spans)
+                    spans.append((y, start, prev))
+                    start = x
+                prev = x
+        self.spans, self.span_of = spans, span_of
+        self.links = [[] for _ in spans]
+        self.incoming = [[] for _ in spans]
+        for span_id in range(len(spans)):
+            self.link_drops(span_id)
+        for x, y0, y1 in self.ladder_columns():
+            self.link_climbs(x, y0, y1)
+
+    def update(self, keys):
+        # Redo the spans in the given chunks, and every link they change. The chunks next to a chunk whose
+        # cells changed are among them (see Tilemap.touch_chunk), so spans one row above it are redone too
+        tilemap = self.tilemap
+        spans, span_of = self.spans, self.span_of
+        size = tilemap.grid.chunk_size
+        self.fields.clear()
+        self.targets.clear()
+
+        # Row runs of the changed chunks, horizontally neighbouring chunks merged
+        chunk_rows = {}
+        for cx, cy in keys:
+            chunk_rows.setdefault(cy, []).append(cx)
+        ranges = []  # (first row, last row, first column, last column)
+        for cy, cxs in chunk_rows.items():
+            cxs.sort()
+            start = prev = cxs[0]
+            for cx in cxs[1:] + [None]:
+                if cx != prev + 1:
+                    ranges.append((cy * size, cy * size + size - 1, start * size, prev * size + size - 1))
+                    start = cx
+                prev = cx
+
+        # Every span in or next to the runs goes, the cells it covered are redone with the runs
+        removed = set()
+        redo = {}  # Row -> [(first column, last column)]
+        for y0, y1, x0, x1 in ranges:
+            for y in range(y0, y1 + 1):
+                lo, hi = x0, x1
+                x = x0 - 1
+                while x <= x1 + 1:
+                    span_id = span_of.get((x, y))
+                    if span_id is None:
+                        x += 1
+                        continue
+                    removed.add(span_id)
+                    sy, sx0, sx1 = spans[span_id]
+                    lo, hi = min(lo, sx0), max(hi, sx1)
+                    x = sx1 + 1
+                redo.setdefault(y, []).append((lo, hi))
+        relink = set()  # Spans whose drops may land elsewhere now
+        climb_cells = set()  # Cells whose ladder column needs its climbs redone
+        for span_id in removed:
+            self.remove_span(span_id, relink, climb_cells)
+
+        # New spans over the merged cells of every row
+        solid, one_way = tilemap.solid_rects, tilemap.one_way_cells
+        columns = {}  # Column -> [(first row, last row)] of cells whose solidity or span changed
+        for y0, y1, x0, x1 in ranges:
+            for x in range(x0, x1 + 1):
+                columns.setdefault(x, []).append((y0, y1))
+        added = []
+        for y, extents in redo.items():
+            extents.sort()
+            merged = [list(extents[0])]
+            for lo, hi in extents[1:]:
+                if lo <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], hi)
+                else:
+                    merged.append([lo, hi])
+            for lo, hi in merged:
+                start = None
+                for x in range(lo, hi + 2):
+                    standing = x <= hi and (x, y) not in solid and ((x, y + 1) in solid or (x, y + 1) in one_way)
+                    if standing and start is None:
+                        start = x
+                    elif not standing and start is not None:
+                        added.append(self.add_span(y, start, x - 1))
+                        start = None
+                for x in range(lo, hi + 1):
+                    columns.setdefault(x, []).append((y, y))
+
+        # Drops off spans whose fall crosses a changed cell, and off the new spans
+        for x, rows in columns.items():
+            rows.sort()
+            y0, y1 = rows[0]
+            for r0, r1 in rows[1:] + [(math.inf, math.inf)]:
+                if r0 > y1 + 1:
+                    for y in range(y0 - self.max_drop, y1 + 1):
+                        right, left = span_of.get((x + 1, y)), span_of.get((x - 1, y))
+                        if right is not None and spans[right][1] == x + 1:
+                            relink.add(right)
+                        if left is not None and spans[left][2] == x - 1:
+                            relink.add(left)
+                    y0, y1 = r0, r1
+                else:
+                    y1 = max(y1, r1)
+        relink.update(added)
+        for span_id in sorted(relink):
+            if spans[span_id] is not None:
+                self.link_drops(span_id)
+
+        # Climbs of the ladder columns through the changed chunks or touching a changed span
+        for key in keys:
+            flags = tilemap.flags.get(key)
+            if flags is not None:
+                for i, cell_flags in enumerate(flags):
+                    if cell_flags & LADDER:
+                        climb_cells.add((key[0] * size + i % size, key[1] * size + i // size))
+        for span_id in added:
+            y, x0, x1 = spans[span_id]
+            climb_cells.update((x, y) for x in range(x0, x1 + 1))
+        done = set()
+        flags_at = tilemap.flags_at
+        for x, y in sorted(climb_cells):
+            for ly in (y, y + 1):
+                if (x, ly) not in done and flags_at(x, ly) & LADDER:
+                    top, bottom = ly, ly
+                    while flags_at(x, top - 1) & LADDER:
+                        top -= 1
+                    while flags_at(x, bottom + 1) & LADDER:
+                        bottom += 1
+                    done.update((x, cy) for cy in range(top, bottom + 1))
+                    self.link_climbs(x, top, bottom)
+
+    def add_span(self, y, x0, x1):
+        if self.free:
+            span_id = self.free.pop()
+            self.spans[span_id] = (y, x0, x1)
+        else:
+            span_id = len(self.spans)
+            self.spans.append((y, x0, x1))
+            self.links.append([])
+            self.incoming.append([])
+        for x in range(x0, x1 + 1):
+            self.span_of[(x, y)] = span_id
+        return span_id
+
+    def remove_span(self, span_id, relink, climb_cells):
+        # Unlink a span both ways, noting the spans that linked to it so their links get redone
+        y, x0, x1 = self.spans[span_id]
+        for x in range(x0, x1 + 1):
+            del self.span_of[(x, y)]
+        for dst, kind, exit_x, cost in self.links[span_id]:
+            self.incoming[dst].remove((span_id, kind, exit_x, cost))
+        for src, kind, exit_x, cost in self.incoming[span_id]:
+            self.links[src].remove((span_id, kind, exit_x, cost))
+            if kind == DROP:
+                relink.add(src)
+            else:
+                climb_cells.add((exit_x, self.spans[src][0]))
+        self.links[span_id], self.incoming[span_id] = [], []
+        self.spans[span_id] = None
+        self.free.append(span_id)
+
+    def link(self, src, dst, kind, exit_x, cost):
+        self.links[src].append((dst, kind, exit_x, cost))
+        self.incoming[dst].append((src, kind, exit_x, cost))
+
+    def unlink(self, src, kind, exit_x=None):
+        # Drop the links of one kind leaving a span, only those through exit_x when given
+        kept = []
+        for dst, link_kind, link_x, cost in self.links[src]:
+            if link_kind == kind and exit_x in (None, link_x):
+                self.incoming[dst].remove((src, link_kind, link_x, cost))
+            else:
+                kept.append((dst, link_kind, link_x, cost))
+        self.links[src] = kept
+
+    def link_drops(self, span_id):
+        # Drops: step off either end and fall straight down onto the first span below
+        solid, span_of = self.tilemap.solid_rects, self.span_of
+        self.unlink(span_id, DROP)
+        y, x0, x1 = self.spans[span_id]
+        for ex in (x0 - 1, x1 + 1):
+            if (ex, y) in solid:
+                continue
+            center = (x0 + x1) / 2
+            for fy in range(y + 1, y + self.max_drop + 1):
+                if (ex, fy) in solid:
+                    break
+                landing = span_of.get((ex, fy))
+                if landing is not None:
+                    self.link(span_id, landing, DROP, ex, abs(ex - center) + fy - y)
+                    break
+
+    def link_climbs(self, x, y0, y1):
+        # Climbs: spans touching the same ladder column are linked both ways, nearest pairs only. Climbs
+        # the column linked before go first, from the spans at the other end too in case it got shorter
+        span_of = self.span_of
+        stops = [(y, span_of[(x, y)]) for y in range(y0 - 1, y1 + 1) if (x, y) in span_of]
+        for y, span_id in stops:
+            for dst, kind, exit_x, cost in self.links[span_id]:
+                if kind == CLIMB and exit_x == x:
+                    self.unlink(dst, CLIMB, x)
+            self.unlink(span_id, CLIMB, x)
+        for (ya, a), (yb, b) in zip(stops, stops[1:]):
+            if a != b:
+                for src, dst in ((a, b), (b, a)):
+                    sy, sx0, sx1 = self.spans[src]
+                    self.link(src, dst, CLIMB, x, abs(x - (sx0 + sx1) / 2) + yb - ya)
+
+    def ladder_columns(self):
+        # (x, top row, bottom row) of every vertical run of ladder cells
+        tilemap = self.tilemap
+        grid = tilemap.grid
+        size = grid.chunk_size
+        cells = set()
+        for key, flags in tilemap.flags.items():
+            for i, cell_flags in enumerate(flags):
+                if cell_flags & LADDER:
+                    cells.add((key[0] * size + i % size, key[1] * size + i // size))
+        columns = []
+        for x, y in cells:
+            if (x, y - 1) not in cells:
+                bottom = y
+                while (x, bottom + 1) in cells:
+                    bottom += 1
+                columns.append((x, y, bottom))
+        return columns
+
+    def cell_under(self, pos, size):
+        # Standing cell of an entity: the cell its feet are in, under its center or failing that either
+        # foot. A body overlapping a column by any fraction of a pixel stands on it, like the physics sees it
+        ts = self.tilemap.tile_size
+        y = math.ceil((pos[1] + size[1]) / ts) - 1
+        for cx in (int((pos[0] + size[0] / 2) // ts), int(pos[0] // ts), math.ceil((pos[0] + size[0]) / ts) - 1):
+            if (cx, y) in self.span_of:
+                return (cx, y)
+        return None
+
+    def span_under(self, pos, size):
+        cell = self.cell_under(pos, size)
+        return -1 if cell is None else self.span_of[cell]
+
+    def supported(self, x, feet_y, width):
+        # Whether a body width pixels wide at x with its feet at feet_y has ground under any part of it
+        self.refresh()
+        ts = self.tilemap.tile_size
+        y = math.ceil(feet_y / ts) - 1
+        return any((cx, y) in self.span_of for cx in range(int(x // ts), math.ceil((x + width) / ts)))
+
+    def target_span(self, target):
+        # Span a target stands on, or lands on next when airborne. Airborne with nothing below keeps the last one
+        ts = self.tilemap.tile_size
+        cell = (int((target.pos[0] + target.size[0] / 2) // ts), math.ceil((target.pos[1] + target.size[1]) / ts) - 1)
+        last = self.targets.get(target)
+        if last is not None and last[0] == cell:
+            return last[1]
+        span = -1
+        for y in range(cell[1], cell[1] + self.max_drop + 1):
+            span = self.span_of.get((cell[0], y), -1)
+            if span >= 0 or (cell[0], y + 1) in self.tilemap.solid_rects:
+                break
+        if span < 0 and last is not None:
+            span = last[1]
+        self.targets[target] = (cell, span)
+        return span
+
+    def flow_field(self, target, kinds=WALKER):
+        """
+        Flow field toward the span a target entity is on, shared by everyone chasing it.
+
+        :param kinds: Link kinds the followers can take.
+        :return: FlowField, or None when the target isn't over any span.
+        """
+        self.refresh()
+        span = self.target_span(target)
+        if span < 0:
+            return None
+        key = (span, kinds)
+        field = self.fields.get(key)
+        if field is None:
+            field = self.search(span, kinds)
+            self.fields[key] = field
+            if len(self.fields) > FIELD_CACHE:
+                self.fields.popitem(last=False)
+        else:
+            self.fields.move_to_end(key)
+        return field
+
+    def search(self, target, kinds):
+        # Dijkstra backwards from the target over the links, remembering each span's first link. Spans
+        # farther than max_cost get no route, so a search costs the same however big the level is
+        count = len(self.spans)
+        incoming = self.incoming
+        max_cost = self.max_cost
+        ts = self.tilemap.tile_size
+        cost = np.full(count, np.inf)
+        goal_x = np.full(count, np.nan)
+        drop = np.zeros(count, np.bool_)
+        next_span = np.full(count, -1, np.int32)
+        cost[target] = 0
+        heap = [(0.0, target)]
+        while heap:
+            c, span = heapq.heappop(heap)
+            if c > cost[span]:
+                continue
+            for src, kind, exit_x, link_cost in incoming[span]:
+                total = c + link_cost
+                if kind & kinds and total <= max_cost and total < cost[src]:
+                    cost[src] = total
+                    next_span[src] = span
+                    goal_x[src] = exit_x * ts + ts / 2
+                    drop[src] = kind == DROP
+                    heapq.heappush(heap, (total, src))
+        return FlowField(target, next_span, goal_x, drop, cost)
+
+    def path(self, start, target, kinds=WALKER):
+        # Spans visited from the start span to the span target entity is on, [] without a route
+        field = self.flow_field(target, kinds)
+        if field is None or start < 0 or not np.isfinite(field.cost[start]):
+            return []
+        spans = [start]
+        while spans[-1] != field.target:
+            spans.append(int(field.next_span[spans[-1]]))
+        return spans
+
+    def steer(self, pos, size, target):
+        """
+        Where an entity on the ground should walk to follow the graph toward a target entity.
+
+        :return: (goal x for the entity's pos[0], whether reaching it means walking off the platform).
+        """
+        field = self.flow_field(target)
+        span = self.span_under(pos, size)
+        if field is None or span < 0 or np.isnan(field.goal_x[span]):
+            return target.pos[0], False  # Same platform, unreachable or airborne: head straight for it
+        return float(field.goal_x[span]) - size[0] / 2, bool(field.drop[span])
@@ -1,50 +1,135 @@
-import pygame
+import heapq
+import numpy as np
+from scripts.utils import Animation
 
-class Particle:
-    def __init__(self, game, p_type, pos, velocity=[0, 0], frame=0):
-        self.game = game
-        self.type = p_type
-        self.pos = list(pos)
-        self.velocity = list(velocity)
-        self.animation = self.game.assets['particle/' + p_type].copy()
-        self.animation_frame = frame
+ALPHA_LEVELS = 16  # Number of pre-faded copies kept per frame for fading particles
 
-    def update(self):
-        kill = False
-        if self.animation.done:
-            kill = True
+# Particle kinds that aren't plain 'particle/<kind>' animations. A single image asset needs a lifetime,
+# velocity is the default drift of the kind's particles in pixels per tick
+PARTICLE_KINDS = {
+    'skull': {'asset': 'skull', 'lifetime': 120, 'fade': 180, 'center': False, 'velocity': (0, -0.3)},  # 2 seconds at 60 FPS
+}
 
-        self.pos[0] += self.velocity[0]
-        self.pos[1] += self.velocity[1]
 
-        self.animation.update()
+# All particles live in preallocated arrays and are advanced in one vectorized step per frame.
+# Dead slots go back to a pool and are reused by the next spawn, so nothing is allocated per particle.
+class ParticleSystem:
+    def __init__(self, game, capacity=4096):
+        self.game = game
+        self.capacity = capacity
+        self.pos = np.zeros((capacity, 2), np.float32)
+        self.velocity = np.zeros((capacity, 2), np.float32)
+        self.lifetime = np.zeros(capacity, np.int32)  # Ticks left to live, 0 marks a free slot
+        self.frame = np.zeros(capacity, np.int32)  # Ticks since spawn, drives the animation
+        self.kind = np.zeros(capacity, np.int32)
+        self.free = list(range(capacity))  # Min-heap of free slots so the live range stays packed low
+        self.high = 0  # One past the highest slot in use
 
-        return kill
+        # Per kind tables, filled by register()
+        self.kind_ids = {}
+        self.kind_first = []  # Index of the kind's first surface in self.surfaces
+        self.kind_frames = []  # Number of animation frames
+        self.kind_img_dur = []
+        self.kind_lifetime = []
+        self.kind_fade = []  # Ticks over which alpha goes from 255 to 0, 0 for no fading
+        self.kind_anchor = []  # Offset subtracted from pos when drawing
+        self.kind_velocity = []  # Velocity of particles spawned without one
+        self.surfaces = []  # Flat table of every (kind, frame, alpha level) surface
+        self.tables = {}  # The per kind lists above as arrays, for vectorized lookups
 
-    def render(self, surf, offset=(0, 0)):
-        img = self.animation.img()
-        surf.blit(img, (self.pos[0] - offset[0] - img.get_width() // 2, self.pos[1] - offset[1] - img.get_height() // 2))
+    def register(self, name):
+        settings = PARTICLE_KINDS.get(name, {'asset': 'particle/' + name, 'center': True})
+        asset = self.game.assets[settings['asset']]
+        if isinstance(asset, Animation):
+            frames, img_dur = asset.images, asset.img_duration
+        elif 'lifetime' in settings:
+            frames, img_dur = [asset], settings['lifetime']
+        else:
+            raise ValueError(f"particle kind '{name}' is a single image, give it a lifetime in PARTICLE_KINDS")
+        lifetime = settings.get('lifetime', len(frames) * img_dur)
+        fade = settings.get('fade', 0)
 
+        self.kind_ids[name] = len(self.kind_first)
+        self.kind_first.append(len(self.surfaces))
+        self.kind_frames.append(len(frames))
+        self.kind_img_dur.append(img_dur)
+        self.kind_lifetime.append(lifetime)
+        self.kind_fade.append(fade)
+        width, height = frames[0].get_size()
+        self.kind_anchor.append((width // 2, height // 2) if settings.get('center') else (0, 0))
+        self.kind_velocity.append(settings.get('velocity', (0, 0)))
 
-class SkullParticle:
-    def __init__(self, game, pos):
-        self.game = game
-        self.pos = pygame.Vector2(pos)
-        self.velocity = pygame.Vector2(0, -0.3)
-        self.lifetime = 120  # 3 seconds at 60 FPS
-        self.image = game.assets['skull']
-        self.alpha = 255
+        # Pre-fade every frame once instead of copying and set_alpha-ing every frame
+        for img in frames:
+            if fade:
+                for level in range(ALPHA_LEVELS):
+                    faded = img.copy()
+                    faded.set_alpha(255 * (level + 1) // ALPHA_LEVELS)
+                    self.surfaces.append(faded)
+            else:
+                self.surfaces.append(img)
+
+        self.tables = {
+            'first': np.array(self.kind_first, np.int32),
+            'frames': np.array(self.kind_frames, np.int32),
+            'img_dur': np.array(self.kind_img_dur, np.int32),
+            'fade': np.array(self.kind_fade, np.int32),
+            'anchor': np.array(self.kind_anchor, np.float32),
+        }
+        return self.kind_ids[name]
+
+    def spawn(self, name, pos, velocity=None, frame=0):
+        kind = self.kind_ids.get(name)
+        if kind is None:
+            kind = self.register(name)
+        # A start frame past the end of the kind's lifetime starts on its last tick, so the particle is
+        # alive for at least one tick and its slot goes back to the pool when it dies
+        start = min(frame * self.kind_img_dur[kind], self.kind_lifetime[kind] - 1)
+        if not self.free or start < 0:
+            return None  # Pool exhausted, drop the particle
+        i = heapq.heappop(self.free)
+        self.pos[i] = pos
+        self.velocity[i] = self.kind_velocity[kind] if velocity is None else velocity
+        self.frame[i] = start
+        self.lifetime[i] = self.kind_lifetime[kind] - start
+        self.kind[i] = kind
+        self.high = max(self.high, i + 1)
+        return i
 
     def update(self):
-        self.pos += self.velocity
-        self.lifetime -= 1
-        self.alpha = max(0, int(255 * (self.lifetime / 180)))
-        if self.lifetime <= 0:
-            return True
-        return False
+        n = self.high
+        if not n:
+            return
+        lifetime = self.lifetime[:n]
+        alive = lifetime > 0
+        self.pos[:n] += self.velocity[:n]
+        self.frame[:n] += 1
+        lifetime -= alive  # Free slots stay at 0
+
+        for i in np.flatnonzero(alive & (lifetime == 0)).tolist():
+            heapq.heappush(self.free, i)
+        live = np.flatnonzero(lifetime)
+        self.high = int(live[-1]) + 1 if len(live) else 0
 
     def render(self, surf, offset=(0, 0)):
-        img = self.image.copy()
-        img.set_alpha(self.alpha)
-        surf.blit(img, (self.pos.x - offset[0], self.pos.y - offset[1]))
+        n = self.high
+        if not n:
+            return
+        live = np.flatnonzero(self.lifetime[:n])
+        kind = self.kind[live]
+        tables = self.tables
+
+        # Work out which pre-rendered surface every particle uses, all at once
+        frame = np.minimum(self.frame[live] // tables['img_dur'][kind], tables['frames'][kind] - 1)
+        fade = tables['fade'][kind]
+        fading = fade > 0
+        level = np.zeros(len(live), np.int32)
+        level[fading] = np.clip(self.lifetime[live][fading] * ALPHA_LEVELS // fade[fading], 0, ALPHA_LEVELS - 1)
+        index = tables['first'][kind] + np.where(fading, frame * ALPHA_LEVELS + level, frame)
+
+        draw_pos = (self.pos[live] - tables['anchor'][kind] - np.array(offset, np.float32)).astype(np.int32)
+        surfaces = self.surfaces
+        surf.blits([(surfaces[i], pos) for i, pos in zip(index.tolist(), draw_pos.tolist())], doreturn=False)
 
+    def __len__(self):
+        return int(np.count_nonzero(self.lifetime[:self.high]))
@@ -0,0 +1,77 @@
+import numpy as np
+import pygame
+
+BLOCK = 8  # Display pixels per edge of a dirty tracking block
+FULL_UPDATE_FRACTION = 0.5  # Above this fraction of dirty blocks one full-window update is cheaper
+
+
+# Upscales the low resolution display onto the window. The scaled image is written straight into the
+# window surface, so nothing is allocated per frame. With an integer scale factor only the blocks of
+# the display that changed since the last frame are rescaled and pushed to the window.
+class Presenter:
+    def __init__(self, screen, display):
+        self.screen = screen
+        self.display = display
+        self.screen_size = screen.get_size()
+        width, height = display.get_size()
+        scale_x, scale_y = self.screen_size[0] / width, self.screen_size[1] / height
+        self.scale = (int(scale_x), int(scale_y))
+        # Dirty tracking compares 32 bit pixels block by block, it needs whole blocks and an exact scale
+        self.integer = (scale_x.is_integer() and scale_y.is_integer() and display.get_bytesize() == 4
+                        and width % BLOCK == 0 and height % BLOCK == 0)
+        # Rows first, matching the surface's memory layout so the comparisons run over contiguous memory
+        self.previous = np.zeros((height, width), np.uint32)  # Display pixels as of the last present
+        self.diff = np.zeros((height, width), np.bool_)
+        self.full = True  # Next present pushes the whole window
+
+    def invalidate(self):
+        # Force a full update, e.g. after something drew to the window directly
+        self.full = True
+
+    def scale_display(self):
+        """
+        Scale what changed on the display into the window.
+
+        :return: List of window rects to update, None for the whole window.
+        """
+        if not self.integer:
+            pygame.transform.scale(self.display, self.screen_size, self.screen)
+            return None
+
+        pixels = pygame.surfarray.pixels2d(self.display).T
+        if self.full:
+            self.full = False
+            self.previous[:] = pixels
+            del pixels  # Unlock the display before scaling from it
+            pygame.transform.scale(self.display, self.screen_size, self.screen)
+            return None
+
+        if not np.not_equal(pixels, self.previous, out=self.diff).any():
+            return []
+        height, width = self.diff.shape
+        # One bool per block: collapse the rows of each block row first, then the columns of each block
+        blocks = self.diff.reshape(height // BLOCK, BLOCK, width).any(axis=1).reshape(height // BLOCK, width // BLOCK, BLOCK).any(axis=2)
+        dirty = int(blocks.sum())
+        self.previous[:] = pixels
+        del pixels
+        if dirty > FULL_UPDATE_FRACTION * blocks.size:
+            pygame.transform.scale(self.display, self.screen_size, self.screen)
+            return None
+
+        # Merge the dirty blocks of every block row into horizontal runs and rescale each run
+        scale_x, scale_y = self.scale
+        rects = []
+        for by in np.flatnonzero(blocks.any(axis=1)).tolist():
+            edges = np.flatnonzero(np.diff(np.concatenate(([False], blocks[by], [False])).astype(np.int8)))
+            for start, end in zip(edges[::2].tolist(), edges[1::2].tolist()):
+                area = pygame.Rect(start * BLOCK, by * BLOCK, (end - start) * BLOCK, BLOCK)
+                target = pygame.Rect(area.x * scale_x, area.y * scale_y, area.w * scale_x, area.h * scale_y)
+                pygame.transform.scale(self.display.subsurface(area), target.size, self.screen.subsurface(target))
+                rects.append(target)
+        return rects
+
+    def update(self, rects):
+        if rects is None:
+            pygame.display.flip()
+        elif rects:
+            pygame.display.update(rects)
@@ -0,0 +1,122 @@
+import csv
+import json
+import time
+import numpy as np
+import pygame
+
+# Phases of one frame, in the order Game marks them
+PHASES = ('events', 'idle', 'update', 'tilemap', 'entities', 'particles', 'lighting', 'overlay', 'upscale', 'present')
+FRAME_BUDGET_MS = 1000 / 60
+OVERLAY_REFRESH = 30  # Frames between refreshes of the overlay's percentile text
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+# Frame timings are recorded by calling mark(phase) at the end of every phase: the time since the
+# previous mark is charged to that phase. Frames go into a fixed-size ring buffer, so a long session
+# keeps the last `capacity` frames without ever allocating.
+class FrameProfiler:
+    def __init__(self, capacity=600, phases=PHASES, enabled=False):
+        self.phases = phases
+        self.columns = {name: i for i, name in enumerate(phases)}
+        self.capacity = capacity
+        self.samples = np.zeros((capacity, len(phases)), np.float32)  # Milliseconds per frame and phase
+        self.frames = 0  # Frames recorded so far, the next one goes to row frames % capacity
+        self.empty = [0.0] * len(phases)
+        self.current = [0.0] * len(phases)  # The frame being recorded
+        self.last = time.perf_counter()
+        self.overlay = False
+        self.font = None
+        self.overlay_lines = []  # Rendered text, refreshed every OVERLAY_REFRESH frames
+        self.set_enabled(enabled)
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        # A disabled profiler shadows its hooks with a no-op so the game loop pays one call per mark
+        for hook in ('start_frame', 'mark', 'end_frame'):
+            if enabled:
+                self.__dict__.pop(hook, None)
+            else:
+                setattr(self, hook, _noop)
+        if enabled:
+            # Enabled mid-frame (F3 in the event loop): time the rest of this frame from now, not from
+            # whenever the last mark ran
+            self.last = time.perf_counter()
+            self.current[:] = self.empty
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        if self.overlay and not self.enabled:
+            self.set_enabled(True)
+
+    def start_frame(self):
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.current[self.columns[phase]] += (now - self.last) * 1000
+        self.last = now
+
+    def end_frame(self):
+        self.samples[self.frames % self.capacity] = self.current
+        self.current[:] = self.empty
+        self.frames += 1
+
+    def recorded(self):
+        # Recorded rows, oldest first
+        if self.frames <= self.capacity:
+            return self.samples[:self.frames]
+        start = self.frames % self.capacity
+        return np.concatenate((self.samples[start:], self.samples[:start]))
+
+    def stats(self):
+        rows = self.recorded()
+        if not len(rows):
+            return {}
+        totals = rows.sum(axis=1)
+        stats = {}
+        for name, column in [(name, rows[:, i]) for i, name in enumerate(self.phases)] + [('total', totals)]:
+            p50, p90, p99 = np.percentile(column, (50, 90, 99))
+            stats[name] = {'p50_ms': float(p50), 'p90_ms': float(p90), 'p99_ms': float(p99), 'max_ms': float(column.max())}
+        stats['total']['over_budget'] = int((totals > FRAME_BUDGET_MS).sum())
+        return stats
+
+    def render_overlay(self, surf):
+        rows = self.recorded()
+        width, height = surf.get_size()
+
+        # Frame time graph along the bottom, one column per frame, 2 px per millisecond
+        graph_height = 40
+        totals = rows[-width:].sum(axis=1) if len(rows) else []
+        for x, total in enumerate(totals):
+            bar = min(graph_height, int(total * 2))
+            color = (220, 60, 60) if total > FRAME_BUDGET_MS else (60, 200, 90)
+            pygame.draw.line(surf, color, (x, height - 1), (x, height - 1 - bar))
+        budget_y = height - 1 - int(FRAME_BUDGET_MS * 2)
+        pygame.draw.line(surf, (255, 255, 255), (0, budget_y), (width, budget_y))
+
+        # Per-phase percentiles, re-rendered only every OVERLAY_REFRESH frames
+        if self.frames % OVERLAY_REFRESH == 0 or not self.overlay_lines:
+            if self.font is None:
+                self.font = pygame.font.Font(None, 12)
+            self.overlay_lines = [self.font.render(f'{name:<9} {s["p50_ms"]:5.2f} {s["p99_ms"]:5.2f}', False, (255, 255, 255), (0, 0, 0))
+                                  for name, s in self.stats().items()]
+        for i, line in enumerate(self.overlay_lines):
+            surf.blit(line, (2, 2 + i * 9))
+
+    def dump(self, path):
+        # CSV gets one row per frame, anything else gets a JSON summary plus the raw rows
+        rows = self.recorded()
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(('frame',) + self.phases + ('total',))
+                first = self.frames - len(rows)
+                for i, row in enumerate(rows.tolist()):
+                    writer.writerow([first + i] + [f'{v:.3f}' for v in row] + [f'{sum(row):.3f}'])
+        else:
+            with open(path, 'w') as f:
+                json.dump({'frames': self.frames, 'budget_ms': FRAME_BUDGET_MS, 'phases': list(self.phases),
+                           'stats': self.stats(), 'samples': rows.round(3).tolist()}, f)
@@ -0,0 +1,179 @@
+import heapq
+import math
+import numpy as np
+import pygame
+from scripts.entities import Player
+
+# Who a projectile can hit
+HITS_PLAYERS, HITS_ENEMIES = 1, 2
+
+# Projectile kinds: speed in pixels per tick, lifetime in ticks, size of the square hitbox in pixels.
+# Every kind moves less than a tile per tick, so testing the cell under its center each tick can't tunnel.
+PROJECTILE_KINDS = {
+    'red_shuriken': {'speed': 2.0, 'damage': 10, 'knockback': 2, 'lifetime': 240, 'size': 6, 'color': (220, 40, 40), 'hits': HITS_PLAYERS},
+}
+SPIN_FRAMES = 4  # Pre-rotated frames per kind
+SPIN_TICKS = 3  # Ticks per frame
+
+
+# Projectiles live in preallocated arrays like particles: a shot takes a free slot from the pool, all
+# of them move in one vectorized step, and a dead one hands its slot back. Walls are found in the
+# tilemap's solid cells. The two players are tested against every hostile projectile at once; enemies
+# are found through the game's spatial hash, and only for projectiles in a hash cell near some entity.
+class ProjectileSystem:
+    def __init__(self, game, capacity=1024):
+        self.game = game
+        self.capacity = capacity
+        self.pos = np.zeros((capacity, 2), np.float64)  # Hitbox centers
+        self.velocity = np.zeros((capacity, 2), np.float64)
+        self.lifetime = np.zeros(capacity, np.int32)  # Ticks left to live, 0 marks a free slot
+        self.kind = np.zeros(capacity, np.int32)
+        self.free = list(range(capacity))  # Min-heap of free slots so the live range stays packed low
+        self.high = 0  # One past the highest slot in use
+
+        # Per kind tables, filled by register()
+        self.kind_ids = {}
+        self.kind_settings = []
+        self.kind_frames = []  # Pre-rotated surfaces of every kind
+        self.half_size = np.zeros(0, np.float64)
+        self.hits = np.zeros(0, np.int32)
+
+    def register(self, name):
+        settings = PROJECTILE_KINDS[name]
+        self.kind_ids[name] = len(self.kind_settings)
+        self.kind_settings.append(settings)
+        self.half_size = np.append(self.half_size, settings['size'] / 2)
+        self.hits = np.append(self.hits, settings['hits'])
+
+        # A four pointed star, drawn once and rotated into the spin frames
+        size = settings['size'] + 2
+        c = size / 2
+        star = pygame.Surface((size, size), pygame.SRCALPHA)
+        points = [(c + math.cos(a * math.pi / 4) * (c if a % 2 == 0 else c / 3), c + math.sin(a * math.pi / 4) * (c if a % 2 == 0 else c / 3)) for a in range(8)]
+        pygame.draw.polygon(star, settings['color'], points)
+        self.kind_frames.append([pygame.transform.rotate(star, 90 / SPIN_FRAMES * i) for i in range(SPIN_FRAMES)])
+        return self.kind_ids[name]
+
+    def spawn(self, name, pos, direction):
+        """
+        Fire a projectile.
+
+        :param pos: Center of the projectile in pixels.
+        :param direction: Direction of travel, any length but zero.
+        :return: Slot of the projectile, None when the pool is exhausted and the shot is dropped.
+        """
+        kind = self.kind_ids.get(name)
+        if kind is None:
+            kind = self.register(name)
+        length = math.hypot(direction[0], direction[1])
+        if not self.free or not length:
+            return None
+        settings = self.kind_settings[kind]
+        i = heapq.heappop(self.free)
+        self.pos[i] = pos
+        self.velocity[i, 0] = direction[0] / length * settings['speed']
+        self.velocity[i, 1] = direction[1] / length * settings['speed']
+        self.lifetime[i] = settings['lifetime']
+        self.kind[i] = kind
+        self.high = max(self.high, i + 1)
+        return i
+
+    def kill(self, i):
+        self.lifetime[i] = 0
+        heapq.heappush(self.free, i)
+
+    def update(self):
+        n = self.high
+        if not n:
+            return
+        lifetime = self.lifetime[:n]
+        alive = lifetime > 0
+        self.pos[:n] += self.velocity[:n]
+        lifetime -= alive  # Free slots stay at 0
+        for i in np.flatnonzero(alive & (lifetime == 0)).tolist():
+            heapq.heappush(self.free, i)
+
+        live = np.flatnonzero(lifetime)
+        if len(live):
+            # Projectiles whose center entered a solid cell break on it
+            for i in self.solid(live):
+                self.kill(i)
+            self.hit_entities(np.flatnonzero(lifetime))
+
+        live = np.flatnonzero(lifetime)
+        self.high = int(live[-1]) + 1 if len(live) else 0
+
+    def solid(self, live):
+        # Slots of the projectiles whose center is in a solid cell
+        tilemap = self.game.tilemap
+        solid = tilemap.solid_rects
+        cells = np.floor(self.pos[live] / tilemap.tile_size).astype(np.int64).tolist()
+        return [i for i, (x, y) in zip(live.tolist(), cells) if (x, y) in solid]
+
+    def hit_entities(self, live):
+        game = self.game
+        kind = self.kind[live]
+        hits = self.hits[kind]
+        half = self.half_size[kind]
+        x, y = self.pos[live, 0] - half, self.pos[live, 1] - half
+
+        hostile = (hits & HITS_PLAYERS) != 0
+        for player in (game.player1, game.player2):
+            if player.dead or not hostile.any():
+                continue
+            px, py, pw, ph = player.pos[0], player.pos[1], player.size[0], player.size[1]
+            touching = hostile & (x < px + pw) & (px < x + half * 2) & (y < py + ph) & (py < y + half * 2)
+            for i in live[touching].tolist():
+                if self.lifetime[i] and not player.dead:
+                    settings = self.kind_settings[self.kind[i]]
+                    push = settings['knockback'] if self.velocity[i, 0] >= 0 else -settings['knockback']
+                    player.take_damage(settings['damage'], [push, -1])
+                    self.kill(i)
+            hostile &= self.lifetime[live] > 0
+
+        friendly = live[(hits & HITS_ENEMIES != 0) & (self.lifetime[live] > 0)]
+        if len(friendly) and game.enemies:
+            self.hit_enemies(friendly)
+
+    def hit_enemies(self, live):
+        game = self.game
+        entity_hash = game.entity_hash
+        # Broad phase: only projectiles whose hash cell is next to an occupied one query the hash
+        size = entity_hash.cell_size
+        reach_x = int(entity_hash.max_size[0] // size) + 1
+        reach_y = int(entity_hash.max_size[1] // size) + 1
+        occupied = np.array(list(entity_hash.cells), np.int64)
+        offsets = np.array([(dx << 32) + dy for dx in range(-1, reach_x + 1) for dy in range(-1, reach_y + 1)], np.int64)
+        near = ((occupied[:, 0] << 32) + occupied[:, 1])[:, None] + offsets[None, :]
+        cells = np.floor(self.pos[live] / size).astype(np.int64)
+        candidates = live[np.isin((cells[:, 0] << 32) + cells[:, 1], near)].tolist()
+
+        for i in candidates:
+            settings = self.kind_settings[self.kind[i]]
+            half = self.half_size[self.kind[i]]
+            x, y = self.pos[i, 0] - half, self.pos[i, 1] - half
+            for other in entity_hash.query(x, y, half * 2, half * 2):
+                if isinstance(other, Player) or other in game.removed_enemies:
+                    continue
+                if (x < other.pos[0] + other.size[0] and other.pos[0] < x + half * 2
+                        and y < other.pos[1] + other.size[1] and other.pos[1] < y + half * 2):
+                    other.take_damage(settings['damage'])
+                    self.kill(i)
+                    break
+
+    def render(self, surf, offset=(0, 0)):
+        n = self.high
+        if not n:
+            return
+        live = np.flatnonzero(self.lifetime[:n])
+        frame = (self.lifetime[live] // SPIN_TICKS % SPIN_FRAMES).tolist()
+        draw_pos = (self.pos[live] - np.array(offset, np.float64)).astype(np.int32).tolist()
+        kind_frames = self.kind_frames
+        blits = []
+        for kind, f, (x, y) in zip(self.kind[live].tolist(), frame, draw_pos):
+            img = kind_frames[kind][f]
+            blits.append((img, (x - img.get_width() // 2, y - img.get_height() // 2)))
+        surf.blits(blits, doreturn=False)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.lifetime[:self.high]))
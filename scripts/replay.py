@@ -0,0 +1,114 @@
+import hashlib
+import struct
+
+MAGIC = b'PPRP'
+VERSION = 2
+HEADER = struct.Struct('<4sHQHBH')  # magic, version, seed, checksum interval, modes, level name length
+CHECKSUM_EVERY = 60  # Ticks between state checksums
+# Bits of the header's modes: Game options that change the simulation, a replay runs with the same ones
+MODE_STREAM, MODE_BATCHED_ENEMIES, MODE_SHARED_ARRAYS = 1, 2, 4
+
+# After the header and level name the log is a sequence of tagged records:
+#   b'I' run: <H4bB>  ticks the inputs held for, both players' movement, key events on the first tick
+#             then <BI> per key event: 0 key down / 1 key up, key code
+#   b'C' checksum: <IQ>  tick, checksum of the simulation state after that tick
+# Input is stored run length encoded, so a held key or an idle player costs one record, not one per tick.
+RUN = struct.Struct('<H4bB')
+EVENT = struct.Struct('<BI')
+CHECKSUM = struct.Struct('<IQ')
+MAX_RUN = 0xFFFF
+
+
+def pack_inputs(inputs):
+    return tuple(int(v) for movement in inputs for v in movement)
+
+
+def unpack_inputs(values):
+    return ((values[0], values[1]), (values[2], values[3]))
+
+
+class InputRecorder:
+    def __init__(self, path, level, seed, modes=0, checksum_every=CHECKSUM_EVERY):
+        self.file = open(path, 'wb')
+        self.checksum_every = checksum_every
+        name = level.encode()
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed, checksum_every, modes, len(name)) + name)
+        self.run_inputs = None
+        self.run_length = 0
+
+    def record(self, inputs, events=()):
+        # Called once per tick with the movement tuples and (down, key) events fed to that tick
+        values = pack_inputs(inputs)
+        if events or values != self.run_inputs or self.run_length == MAX_RUN:
+            self.flush()
+            self.run_inputs = values
+            self.file.write(b'I' + RUN.pack(1, *values, len(events)))
+            self.file.write(b''.join(EVENT.pack(0 if down else 1, key) for down, key in events))
+            self.run_start = self.file.tell() - RUN.size - 1 - EVENT.size * len(events)
+            self.run_length = 1
+        else:
+            self.run_length += 1
+
+    def flush(self):
+        # Patch the tick count of the current run in place
+        if self.run_length > 1:
+            end = self.file.tell()
+            self.file.seek(self.run_start + 1)
+            self.file.write(struct.pack('<H', self.run_length))
+            self.file.seek(end)
+
+    def checksum(self, tick, value):
+        self.flush()
+        self.run_inputs = None  # Next tick starts a new run after the checksum record
+        self.run_length = 0
+        self.file.write(b'C' + CHECKSUM.pack(tick, value))
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class Replay:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, self.seed, self.checksum_every, self.modes, name_len = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a replay of version {VERSION}')
+        offset = HEADER.size
+        self.level = data[offset:offset + name_len].decode()
+        offset += name_len
+
+        self.ticks = []  # Tick -> (inputs, events)
+        self.checksums = {}  # Tick -> checksum recorded after it
+        while offset < len(data):
+            tag = data[offset:offset + 1]
+            offset += 1
+            if tag == b'I':
+                length, *values, event_count = RUN.unpack_from(data, offset)
+                offset += RUN.size
+                events = []
+                for _ in range(event_count):
+                    kind, key = EVENT.unpack_from(data, offset)
+                    offset += EVENT.size
+                    events.append((kind == 0, key))
+                inputs = unpack_inputs(values)
+                self.ticks.append((inputs, tuple(events)))
+                self.ticks.extend([(inputs, ())] * (length - 1))
+            elif tag == b'C':
+                tick, value = CHECKSUM.unpack_from(data, offset)
+                offset += CHECKSUM.size
+                self.checksums[tick] = value
+            else:
+                raise ValueError(f'corrupt replay record at byte {offset - 1} of {path}')
+
+
+def state_checksum(game):
+    # 64 bit hash of the simulation state: exact float bits of every entity's position, velocity and health, and the projectiles
+    digest = hashlib.blake2b(struct.pack('<I', game.tick), digest_size=8)
+    for entity in [game.player1, game.player2] + game.enemies:
+        digest.update(struct.pack('<5d', entity.pos[0], entity.pos[1], entity.velocity[0], entity.velocity[1], entity.health))
+    projectiles = game.projectiles
+    digest.update(projectiles.pos[:projectiles.high].tobytes())
+    digest.update(projectiles.lifetime[:projectiles.high].tobytes())
+    return int.from_bytes(digest.digest(), 'little')
@@ -0,0 +1,36 @@
+# Uniform grid broad phase for entity vs entity checks. Every entity is bucketed by the cell holding
+# its top-left corner, so it lives in exactly one bucket and queries never return duplicates; a query
+# widens its range by the largest entity size so entities reaching in from neighbouring cells are found.
+class SpatialHash:
+    def __init__(self, cell_size=32):
+        self.cell_size = cell_size
+        self.cells = {}  # (cell_x, cell_y) -> list of entities
+        self.max_size = (0, 0)  # Largest entity width and height seen by the last rebuild
+
+    def rebuild(self, *groups):
+        # Called once per tick with every group of entities that takes part in contact checks
+        cells = self.cells
+        cells.clear()
+        size = self.cell_size
+        max_w = max_h = 0
+        for group in groups:
+            for entity in group:
+                key = (int(entity.pos[0] // size), int(entity.pos[1] // size))
+                bucket = cells.get(key)
+                if bucket is None:
+                    cells[key] = [entity]
+                else:
+                    bucket.append(entity)
+                max_w = max(max_w, entity.size[0])
+                max_h = max(max_h, entity.size[1])
+        self.max_size = (max_w, max_h)
+
+    def query(self, x, y, w, h):
+        # Yield every entity that may overlap the box, callers do the exact test
+        size = self.cell_size
+        cells = self.cells
+        for cx in range(int((x - self.max_size[0]) // size), int((x + w) // size) + 1):
+            for cy in range(int((y - self.max_size[1]) // size), int((y + h) // size) + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    yield from bucket
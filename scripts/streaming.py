@@ -0,0 +1,285 @@
+import base64
+import math
+import mmap
+import queue
+import re
+import sys
+import threading
+import zlib
+from array import array
+
+STREAM_RADIUS = 4  # Chunks kept resident around each player, in every direction
+STREAM_MEMORY_CAP = 64 * 1024 * 1024  # Bytes of tile data and baked chunk surfaces kept resident
+INSTALLS_PER_UPDATE = 4  # Chunks handed from the worker to the tilemap per update, spreads the cost over frames
+
+GID_MASK = 0x0FFFFFFF  # Tiled stores flip/rotation flags in the top bits of a gid
+
+TOKENS = re.compile(rb'<layer\b([^>]*)>|<data\b([^>]*)>|<chunk\b([^>]*)>')
+ATTRIBUTE = re.compile(rb'(\w+)="([^"]*)"')
+
+
+def attributes(raw):
+    return {key.decode(): value.decode() for key, value in ATTRIBUTE.findall(raw)}
+
+
+def is_infinite(tmx_path):
+    # The map element sits in the first few hundred bytes, no need to read the rest
+    with open(tmx_path, 'rb') as f:
+        head = f.read(4096)
+    match = re.search(rb'<map\b([^>]*)>', head)
+    return bool(match) and attributes(match.group(1)).get('infinite') == '1'
+
+
+# Pages chunks of a finite level out of its memory-mapped compiled form (see levelcache)
+class CompiledChunkSource:
+    def __init__(self, compiled, layers, chunk_size):
+        self.compiled = compiled
+        self.layers = layers
+        self.chunk_size = chunk_size
+        self.width, self.height = compiled.meta['width'], compiled.meta['height']
+        self.chunk_index = {tuple(key): i for i, key in enumerate(compiled.meta['chunks'])}  # Position in the tiles section
+        self.chunk_length = layers * chunk_size * chunk_size
+
+    def keys(self):
+        return {(cx, cy) for cx in range(math.ceil(self.width / self.chunk_size))
+                for cy in range(math.ceil(self.height / self.chunk_size))}
+
+    def read(self, key):
+        i = self.chunk_index.get(key)
+        if i is None:
+            return array('H', bytes(2 * self.chunk_length))
+        return self.compiled.array('tiles', 'H', i * self.chunk_length, self.chunk_length)
+
+    def close(self):
+        self.compiled.close()
+
+
+# Pages chunks of a Tiled infinite map straight out of the TMX. Opening the source only records where
+# every <chunk> element sits in the file, the tile data of a chunk is decoded when it's read.
+class TmxChunkSource:
+    def __init__(self, tmx_path, chunk_size, tile_ids, hidden_ids=()):
+        self.chunk_size = chunk_size
+        # Tiled gid -> grid tile id, mapped by the tilemap up front so the worker only reads it
+        self.tile_ids = tile_ids
+        self.hidden_ids = set(hidden_ids)  # Grid tile ids read as empty, spawn markers are never rendered
+        with open(tmx_path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.layers = []  # Layer index -> name
+        self.chunks = {}  # Grid chunk key -> [(layer, x, y, width, height, start, end, encoding, compression)]
+        layer = None
+        encoding = compression = None
+        for match in TOKENS.finditer(self.mm):
+            layer_attrs, data_attrs, chunk_attrs = match.groups()
+            if layer_attrs is not None:
+                attrs = attributes(layer_attrs)
+                layer = None
+                if attrs.get('visible') != '0':
+                    layer = len(self.layers)
+                    self.layers.append(attrs.get('name', ''))
+            elif data_attrs is not None:
+                attrs = attributes(data_attrs)
+                encoding, compression = attrs.get('encoding', 'csv'), attrs.get('compression')
+            elif layer is not None:
+                attrs = attributes(chunk_attrs)
+                x, y, w, h = (int(attrs[name]) for name in ('x', 'y', 'width', 'height'))
+                end = self.mm.find(b'</chunk>', match.end())
+                entry = (layer, x, y, w, h, match.end(), end, encoding, compression)
+                # A Tiled chunk may overlap several grid chunks when their sizes differ
+                for cx in range(x // chunk_size, (x + w - 1) // chunk_size + 1):
+                    for cy in range(y // chunk_size, (y + h - 1) // chunk_size + 1):
+                        self.chunks.setdefault((cx, cy), []).append(entry)
+
+    def keys(self):
+        return set(self.chunks)
+
+    def bounds(self):
+        # (min_x, min_y, max_x, max_y) in tiles over every chunk in the map
+        entries = [entry for entries in self.chunks.values() for entry in entries]
+        if not entries:
+            return 0, 0, 0, 0
+        return (min(e[1] for e in entries), min(e[2] for e in entries),
+                max(e[1] + e[3] for e in entries), max(e[2] + e[4] for e in entries))
+
+    def tile_id(self, gid):
+        return self.tile_ids.get(gid & GID_MASK, 0)
+
+    def decode(self, entry):
+        start, end, encoding, compression = entry[5:]
+        body = self.mm[start:end].strip()
+        if encoding == 'csv':
+            return [int(value) for value in body.split(b',') if value.strip()]
+        data = base64.b64decode(body)
+        if compression in ('zlib', 'gzip'):
+            data = zlib.decompress(data, 47)  # 32 + 15 auto-detects the zlib or gzip header
+        elif compression:
+            raise ValueError(f'unsupported layer compression {compression}')
+        gids = array('I', data)
+        if sys.byteorder == 'big':
+            gids.byteswap()
+        return gids
+
+    def read(self, key):
+        size = self.chunk_size
+        tiles = array('H', bytes(2 * len(self.layers) * size * size))
+        left, top = key[0] * size, key[1] * size
+        for entry in self.chunks.get(key, ()):
+            layer, x, y, w, h = entry[:5]
+            gids = self.decode(entry)
+            for ty in range(max(y, top), min(y + h, top + size)):
+                row = (layer * size + ty - top) * size - left
+                for tx in range(max(x, left), min(x + w, left + size)):
+                    gid = gids[(ty - y) * w + tx - x]
+                    if gid:
+                        tile_id = self.tile_id(gid)
+                        if tile_id not in self.hidden_ids:
+                            tiles[row + tx] = tile_id
+        return tiles
+
+    def find(self, tile_ids, layer_name):
+        # Tile positions holding any of tile_ids in the named layer, decoding every chunk of that layer
+        found = []
+        seen = set()
+        for entries in self.chunks.values():
+            for entry in entries:
+                layer, x, y, w, h = entry[:5]
+                if self.layers[layer] != layer_name or entry[5] in seen:
+                    continue
+                seen.add(entry[5])
+                for i, gid in enumerate(self.decode(entry)):
+                    if gid and self.tile_id(gid) in tile_ids:
+                        found.append((x + i % w, y + i // w))
+        return found
+
+    def close(self):
+        self.mm.close()
+
+
+# Keeps the chunks around the players resident in a Tilemap. A background thread reads and decodes
+# chunks from the source; the main thread installs them (collision, baking) a few per update and
+# evicts the ones that fell out of range, farthest first when the memory cap is hit. A synchronous
+# streamer has no worker and reads every wanted chunk as soon as it's wanted, so what is resident on
+# a tick never depends on thread timing (recording and replaying need that).
+class ChunkStreamer:
+    def __init__(self, tilemap, source, radius=STREAM_RADIUS, memory_cap=STREAM_MEMORY_CAP, synchronous=False):
+        self.tilemap = tilemap
+        self.source = source
+        self.radius = radius
+        self.keys = source.keys()  # Chunks that exist in the level
+        grid = tilemap.grid
+        chunk_px = grid.chunk_size * tilemap.tile_size
+        self.chunk_px = chunk_px
+        # Tile ids plus the baked 32 bit surface of a chunk
+        self.max_chunks = max(9, memory_cap // (2 * grid.layers * grid.chunk_area + chunk_px * chunk_px * 4))
+        self.centers = None  # Chunk of each player at the last update
+        self.resident = set()  # Installed chunks, including empty ones
+        self.pending = set()  # Chunks requested from the worker and still wanted
+        self.edited = set()  # Resident chunks changed in game, kept in overrides when evicted
+        self.overrides = {}  # Chunk key -> tiles of an edited chunk that was evicted
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.synchronous = synchronous
+        self.worker = None
+        if not synchronous:
+            self.worker = threading.Thread(target=self.work, daemon=True)
+            self.worker.start()
+
+    def work(self):
+        while True:
+            key = self.requests.get()
+            if key is None:
+                return
+            if key in self.pending:  # Skip requests that went out of range while queued
+                self.results.put((key, self.source.read(key)))
+
+    def wanted(self, positions):
+        # Chunks in range of any position, nearest first, trimmed to the memory cap
+        distances = {}
+        r = self.radius
+        for x, y in positions:
+            px, py = int(x // self.chunk_px), int(y // self.chunk_px)
+            for cx in range(px - r, px + r + 1):
+                for cy in range(py - r, py + r + 1):
+                    if (cx, cy) in self.keys:
+                        d = max(abs(cx - px), abs(cy - py))
+                        if d < distances.get((cx, cy), r + 1):
+                            distances[(cx, cy)] = d
+        return sorted(distances, key=distances.get)[:self.max_chunks]
+
+    def update(self, positions, block=False):
+        """
+        Page chunks in and out around the given pixel positions.
+
+        :param positions: The players' positions.
+        :param block: Read every wanted chunk on the calling thread before returning, used at load.
+        """
+        # The wanted set only changes when a player crosses into another chunk
+        centers = [(int(x // self.chunk_px), int(y // self.chunk_px)) for x, y in positions]
+        if centers == self.centers and not block:
+            self.install_results()
+            return
+        self.centers = centers
+        block = block or self.synchronous
+        wanted = self.wanted(positions)
+        wanted_set = set(wanted)
+        self.pending &= wanted_set
+
+        # Chunks under and right next to a player can't wait for the worker
+        urgent = {(px + dx, py + dy) for px, py in centers for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
+        for key in wanted:
+            if key not in self.resident and (block or key in urgent):
+                self.pending.discard(key)
+                self.install(key, self.read(key))
+
+        self.install_results()
+        for key in wanted:
+            if key not in self.resident and key not in self.pending:
+                self.pending.add(key)
+                self.requests.put(key)
+
+        # Chunks out of range are dropped one chunk past the radius, so walking along a chunk border doesn't thrash.
+        # Over the cap everything not wanted goes, farthest first.
+        def distance(key):
+            return min(max(abs(key[0] - px), abs(key[1] - py)) for px, py in centers)
+        for key in sorted(self.resident - wanted_set, key=distance, reverse=True):
+            if len(self.resident) > self.max_chunks or distance(key) > self.radius + 1:
+                self.evict(key)
+
+    def install_results(self):
+        installed = 0
+        while installed < INSTALLS_PER_UPDATE:
+            try:
+                key, tiles = self.results.get_nowait()
+            except queue.Empty:
+                return
+            if key in self.pending:
+                self.pending.discard(key)
+                self.install(key, tiles)
+                installed += 1
+
+    def read(self, key):
+        tiles = self.overrides.pop(key, None)
+        return tiles if tiles is not None else self.source.read(key)
+
+    def install(self, key, tiles):
+        if key in self.overrides:  # An edited copy wins over the source
+            tiles = self.overrides.pop(key)
+        self.resident.add(key)
+        self.tilemap.install_chunk(key, tiles)
+
+    def evict(self, key):
+        self.resident.discard(key)
+        tiles = self.tilemap.evict_chunk(key)
+        if key in self.edited:
+            self.edited.discard(key)
+            self.overrides[key] = tiles if tiles is not None else array('H', bytes(2 * self.tilemap.grid.layers * self.tilemap.grid.chunk_area))
+
+    def is_resident(self, pos):
+        return (int(pos[0] // self.chunk_px), int(pos[1] // self.chunk_px)) in self.resident
+
+    def close(self):
+        self.pending.clear()
+        if self.worker is not None:
+            self.requests.put(None)
+            self.worker.join()
+        self.source.close()
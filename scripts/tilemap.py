@@ -1,72 +1,565 @@
+import math
+import mmap
+import os
+import re
+import xml.etree.ElementTree as ET
+from array import array
 import pygame
 import pytmx
+from collections.abc import Mapping
+from scripts.grid import ChunkedGrid
+from scripts import levelcache, streaming
 
 NEIGHBORS_OFFSETS = [(-1, 0), (-1, -1), (0, -1), (1, -1), (1, 0), (0, 0), (-1, 1), (0, 1), (1, 1)]
+
+# Tile flags, one byte per cell in Tilemap.flags. Set per tile in the tileset (TSX) as bool properties
+# named after the flag, so new tile types need no code changes
+SOLID, LADDER, DOOR, ONE_WAY, HAZARD = 1, 2, 4, 8, 16
+TILE_PROPERTY_FLAGS = {'solid': SOLID, 'ladder': LADDER, 'door': DOOR, 'one_way': ONE_WAY, 'one-way': ONE_WAY, 'hazard': HAZARD}
+# Flags tile types get even without properties in the tileset
 PHYSICS_TILE_TYPES = {'grass'}
 INTRERACTABLE_TILE_TYPES = {'ladder'}
+# Tileset local id -> (type, variant), in the order helper_functions/tilesheetmaker.py packs the sprites
+TILESET_TYPES = [('light', 0), ('shadow', 0), ('door', 0), ('walls', 0)]
+# Tiles marking spawn points: pulled out of the grid at load and kept in Tilemap.markers
+MARKER_TILE_TYPES = ('light', 'shadow', 'enemy', 'boss')
+# Sparse tiles looked up by kind, Tilemap.tile_index keeps their positions so extract never scans the map.
+# Bulk terrain like walls isn't indexed, extracting it falls back to a scan.
+INDEXED_TILE_TYPES = {'light', 'shadow', 'door', 'enemy', 'boss'}
+
+def default_flags(tile_type):
+    return (SOLID if tile_type in PHYSICS_TILE_TYPES else 0) | (LADDER if tile_type in INTRERACTABLE_TILE_TYPES else 0)
+
+
+def property_flags(properties):
+    # Flags of a tile from its properties, name -> value as pytmx parses it or as the raw XML string
+    flags = 0
+    for name, value in properties.items():
+        flag = TILE_PROPERTY_FLAGS.get(name)
+        if flag and value in (True, 'true'):
+            flags |= flag
+    return flags
+
+
+def tileset_flags(tmx_path):
+    """
+    Read the flag properties of every tile in the tilesets a map uses, straight from the XML.
+    Used for infinite maps, which pytmx doesn't load; other maps read the properties pytmx parsed.
+
+    :return: Sorted firstgids of the tilesets, and a dict of Tiled gid (firstgid + local id) -> flags.
+    """
+    with open(tmx_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        end = mm.find(b'<layer')  # Tilesets come before the layers, however long they are
+        head = mm[:end if end >= 0 else len(mm)]
+    firstgids, flags = [], {}
+    for match in re.finditer(rb'<tileset\b([^>]*?)(/?)>', head):
+        attrs = dict(re.findall(rb'(\w+)="([^"]*)"', match.group(1)))
+        if match.group(2):
+            tileset = ET.parse(os.path.join(os.path.dirname(tmx_path), attrs[b'source'].decode())).getroot()
+        else:
+            close = head.index(b'</tileset>', match.end()) + len(b'</tileset>')
+            tileset = ET.fromstring(head[match.start():close])
+        firstgid = int(attrs[b'firstgid'])
+        firstgids.append(firstgid)
+        for tile in tileset.iter('tile'):
+            tile_flags = property_flags({prop.get('name'): prop.get('value', 'false') for prop in tile.iter('property')})
+            if tile_flags:
+                flags[firstgid + int(tile.get('id'))] = tile_flags
+    return sorted(firstgids), flags
+
+
+# First solid tile hit by Tilemap.sweep: fraction of the move completed, surface normal, [x, y] tile.
+# Every tilemap owns one and sweep() overwrites it, so collisions allocate nothing per tick
+class SweepHit:
+    __slots__ = ('time', 'normal', 'tile')
+
+    def __init__(self):
+        self.time = 0.0
+        self.normal = [0, 0]
+        self.tile = [0, 0]
+
+    def set(self, time, normal_x, normal_y, x, y):
+        self.time = time
+        self.normal[0], self.normal[1] = normal_x, normal_y
+        self.tile[0], self.tile[1] = x, y
+        return self
+
+
+# (x, y) -> collision Rect of a solid cell. Cells loaded in bulk get their Rect the first time it's
+# looked up, so a compiled level with tens of thousands of solid cells loads without building them all
+class SolidRects(dict):
+    def __init__(self, tile_size, cells=()):
+        super().__init__(dict.fromkeys(cells))
+        self.tile_size = tile_size
+
+    def __getitem__(self, cell):
+        rect = super().__getitem__(cell)
+        if rect is None:
+            ts = self.tile_size
+            rect = self[cell] = pygame.Rect(cell[0] * ts, cell[1] * ts, ts, ts)
+        return rect
+
+    def get(self, cell, default=None):
+        return self[cell] if cell in self else default
+
+
+# Read-only "x;y" keyed view over the chunked grid for code written against the old dict
+class TilemapView(Mapping):
+    def __init__(self, tilemap):
+        self.tilemap = tilemap
+
+    def __getitem__(self, loc):
+        x, y = (int(v) for v in loc.split(';'))
+        tiles = self.tilemap.tiles_at(x, y)
+        if not tiles:
+            raise KeyError(loc)
+        return tiles
+
+    def __iter__(self):
+        for x, y in self.tilemap.grid.iter_cells():
+            yield str(x) + ';' + str(y)
+
+    def __len__(self):
+        return sum(1 for _ in self.tilemap.grid.iter_cells())
+
 
 class Tilemap:
     def __init__(self, game, tile_size=16):
         self.tile_size = tile_size
         self.game = game
-        self.tilemap = {}
+        self.grid = ChunkedGrid()
+        self.width, self.height = 0, 0  # Map size in tiles
+        self.kind_flags = [0]  # Tile id -> flags of that kind
+        self.flagged_ids = {}  # (kind, flags) -> tile id, while mapping a map's tiles to tile ids
+        self.flags = {}  # (chunk_x, chunk_y) -> bytearray of the flags of every cell, all layers combined
+        self.solid_rects = SolidRects(tile_size)  # (x, y) -> collision Rect of a solid cell
+        self.one_way_cells = set()  # (x, y) of cells only solid when landed on from above
+        self.rects_buffer = []  # Reused by physics_rects_around to avoid a list per call
+        self.sweep_hit = SweepHit()  # Reused by sweep
+        self.collision_versions = {}  # (chunk_x, chunk_y) -> bumped whenever the solid or one-way cells in or next to the chunk change
+        self.collision_epoch = 0  # Bumped whenever any solid or one-way cell changes
+        self.chunk_surfaces = {}  # (chunk_x, chunk_y) -> pre-rendered surface of the chunk's tiles
+        self.dirty_chunks = set()  # Chunks whose tiles changed since they were last baked
         self.offgrid_tiles = []
-        self.player_position = (0, 0)
-        self.enemy_positions = []
-        self.boss_positions = []
+        self.tile_index = {}  # Tile id of an indexed kind -> {(x, y, layer): None}, in load order
+        self.markers = {}  # Marker type -> [(x, y)] tile positions of its spawn points
+        self.streamer = None  # ChunkStreamer paging chunks in around the players, None when the whole level is loaded
+        self.stream_radius = streaming.STREAM_RADIUS
+        self.stream_memory = streaming.STREAM_MEMORY_CAP
+        self.stream_sync = False  # Stream without the worker thread, for deterministic runs
         self.trees = []
         self.boss_counter = 0
 
-    def load(self, level):
+    @property
+    def tilemap(self):
+        return TilemapView(self)
+
+    # Spawn points in tiles, backed by the markers found at load
+    @property
+    def player_position(self):
+        return self.markers.get('light', [(0, 0)])[0]
+
+    @property
+    def shadow_position(self):
+        return self.markers.get('shadow', [(0, 0)])[0]
+
+    @property
+    def enemy_positions(self):
+        return self.markers.get('enemy', [])
+
+    @property
+    def boss_positions(self):
+        return self.markers.get('boss', [])
+
+    def set_kind_flags(self):
+        # Per-type default flags of every interned kind, before the map's tiles are mapped to tile ids
+        self.kind_flags = [0 if kind is None else default_flags(kind[0]) for kind in self.grid.kinds]
+        self.flagged_ids = {}
+
+    def flagged_kind_id(self, kind, flags):
+        # Tile id of a kind whose tiles carry these tileset flags on top of the kind's defaults. Tiles of one
+        # kind with different properties get an id each, drawn alike, so their flags never mix
+        flags |= default_flags(kind[0])
+        tile_id = self.flagged_ids.get((kind, flags))
+        if tile_id is None:
+            tile_id = self.grid.kind_id(*kind)
+            if tile_id in self.flagged_ids.values():
+                tile_id = self.grid.add_kind(*kind)
+            self.kind_flags.extend([0] * (len(self.grid.kinds) - len(self.kind_flags)))
+            self.kind_flags[tile_id] = flags
+            self.flagged_ids[(kind, flags)] = tile_id
+        return tile_id
+
+    def flags_at(self, x, y):
+        chunk = self.flags.get((x >> self.grid.shift, y >> self.grid.shift))
+        if chunk is None:
+            return 0
+        return chunk[((y & self.grid.mask) << self.grid.shift) + (x & self.grid.mask)]
+
+    def rect_flags(self, rect):
+        # Flags of every cell a pixel rect overlaps, OR'd together, e.g. rect_flags(entity.rect()) & HAZARD
+        ts = self.tile_size
+        flags = 0
+        for x in range(rect.left // ts, (rect.right - 1) // ts + 1):
+            for y in range(rect.top // ts, (rect.bottom - 1) // ts + 1):
+                flags |= self.flags_at(x, y)
+        return flags
+
+    def indexed(self, tile_id):
+        return self.grid.kinds[tile_id][0] in INDEXED_TILE_TYPES
+
+    def index_tile(self, x, y, layer, tile_id):
+        self.tile_index.setdefault(tile_id, {})[(x, y, layer)] = None
+
+    def index_chunk(self, key, tiles):
+        # Add the indexed tiles of a chunk's tile array
+        grid = self.grid
+        ids = {tile_id for tile_id in range(1, len(grid.kinds)) if self.indexed(tile_id)}
+        if not ids or ids.isdisjoint(tiles):
+            return
+        size = grid.chunk_size
+        for i, tile_id in enumerate(tiles):
+            if tile_id in ids:
+                layer, local = divmod(i, grid.chunk_area)
+                self.index_tile(key[0] * size + local % size, key[1] * size + local // size, layer, tile_id)
+
+    def extract_markers(self):
+        # Spawn markers are not rendered, pull them out of the grid
+        for tile_type in MARKER_TILE_TYPES:
+            tiles = self.extract([(tile_type, 0)])
+            if tiles:
+                self.markers[tile_type] = [(tile['pos'][0] // self.tile_size, tile['pos'][1] // self.tile_size) for tile in tiles]
+
+    def tile_dict(self, x, y, layer, tile_id):
+        tile_type, variant = self.grid.kinds[tile_id]
+        return {'type': tile_type, 'variant': variant, 'pos': (x, y), 'layer': layer}
+
+    def tiles_at(self, x, y):
+        return [self.tile_dict(x, y, layer, tile_id) for layer, tile_id in self.grid.cell(x, y)]
+
+    def load(self, level, levels_dir='./graphics/levels', stream=False):
+        tmx_path = f'{levels_dir}/{level}/{level}.tmx'
+
+        # Infinite maps have no compiled form, they're always streamed straight from the TMX
+        if streaming.is_infinite(tmx_path):
+            self.load_infinite(tmx_path)
+            return
+
+        # Everything in code the compiled kinds and flags depend on is part of the key too
+        digest = levelcache.source_hash(tmx_path, repr((TILESET_TYPES, sorted(PHYSICS_TILE_TYPES), sorted(INTRERACTABLE_TILE_TYPES), sorted(TILE_PROPERTY_FLAGS.items()))))
+
+        # Reuse the compiled level when the TMX/TSX sources haven't changed, otherwise parse and compile it
+        compiled = levelcache.load(level, digest)
+        if compiled is None:
+            self.load_tmx(tmx_path)
+            self.build_collision_cache()
+            try:
+                levelcache.save(level, digest, self.compiled_meta(), self.compiled_sections())
+            except OSError:
+                pass  # A read-only install just parses the TMX every time, and can't stream
+            else:
+                if stream:
+                    compiled = levelcache.load(level, digest)
+
+        if compiled is not None and stream:
+            # Keep the compiled level mapped and page its chunks in around the players
+            self.load_compiled_meta(compiled, stream=True)
+            self.start_streaming(streaming.CompiledChunkSource(compiled, self.grid.layers, self.grid.chunk_size))
+            return
+        if compiled is not None:
+            self.load_compiled(compiled)
+            compiled.close()
+
+        # Chunks are baked the first time they're on screen
+        self.chunk_surfaces = {}
+        self.dirty_chunks = set(self.grid.chunks)
+
+    def load_infinite(self, tmx_path):
+        # Map every gid of the tilesets to a tile id up front, with its flags, so the streaming worker
+        # never touches the grid or the flags. A later tileset's gids override an earlier one's
+        firstgids, gid_flags = tileset_flags(tmx_path)
+        self.set_kind_flags()
+        tile_ids = {}
+        for firstgid in firstgids:
+            for local_id, kind in enumerate(TILESET_TYPES):
+                tile_ids[firstgid + local_id] = self.flagged_kind_id(kind, gid_flags.get(firstgid + local_id, 0))
+        kinds = self.grid.kinds
+        marker_ids = {tile_type: {tile_id for tile_id in range(1, len(kinds)) if kinds[tile_id][0] == tile_type}
+                      for tile_type in ('light', 'shadow')}
+        source = streaming.TmxChunkSource(tmx_path, self.grid.chunk_size, tile_ids,
+                                          hidden_ids=marker_ids['light'] | marker_ids['shadow'])
+        grid = ChunkedGrid(layers=max(1, len(source.layers)))
+        grid.kinds, grid.kind_ids = kinds, self.grid.kind_ids  # The ids the source maps to
+        self.grid = grid
+        min_x, min_y, self.width, self.height = source.bounds()
+
+        # Spawn markers live in their own layers, the only ones decoded in full at load
+        for tile_type, ids in marker_ids.items():
+            positions = source.find(ids, tile_type)
+            if positions:
+                self.markers[tile_type] = positions
+        self.start_streaming(source)
+
+    def start_streaming(self, source):
+        self.flags = {}
+        self.solid_rects = SolidRects(self.tile_size)
+        self.one_way_cells = set()
+        self.chunk_surfaces = {}
+        self.dirty_chunks = set()
+        self.streamer = streaming.ChunkStreamer(self, source, self.stream_radius, self.stream_memory, self.stream_sync)
+        # Everything around the spawns is resident before the first frame
+        spawns = [self.get_player_spawn('light'), self.get_player_spawn('shadow')]
+        self.streamer.update(spawns, block=True)
+
+    def stream_around(self, positions):
+        if self.streamer is not None:
+            self.streamer.update(positions)
+
+    def is_resident(self, pos):
+        # Whether the chunk under pos is loaded, always true when the whole level is
+        return self.streamer is None or self.streamer.is_resident(pos)
+
+    def install_chunk(self, key, tiles):
+        grid = self.grid
+        count = grid.chunk_area * grid.layers - tiles.count(0)
+        if count:
+            grid.chunks[key] = tiles
+            grid.counts[key] = count
+            self.index_chunk(key, tiles)
+            self.update_collision_chunk(key)
+            self.dirty_chunks.add(key)
+
+    def evict_chunk(self, key):
+        # Drop a chunk with its collision rects and baked surface, returns its tiles
+        grid = self.grid
+        tiles = grid.chunks.pop(key, None)
+        grid.counts.pop(key, None)
+        self.chunk_surfaces.pop(key, None)
+        self.dirty_chunks.discard(key)
+        if tiles is not None:
+            size = grid.chunk_size
+            self.flags.pop(key, None)
+            for i in range(grid.chunk_area):
+                cell = (key[0] * size + i % size, key[1] * size + i // size)
+                self.solid_rects.pop(cell, None)
+                self.one_way_cells.discard(cell)
+            self.touch_chunk(key)
+            for positions in self.tile_index.values():
+                for pos in [pos for pos in positions if pos[0] >> grid.shift == key[0] and pos[1] >> grid.shift == key[1]]:
+                    del positions[pos]
+        return tiles
+
+    def close(self):
+        if self.streamer is not None:
+            self.streamer.close()
+            self.streamer = None
+
+    def load_tmx(self, tmx_path):
         # Load the map tilemap
-        self.tmx_data = pytmx.load_pygame(f'./graphics/levels/{level}/{level}.tmx')
-
-        # Iterate through the layers and create the tilemap
-        for layer_index, layer in enumerate(self.tmx_data.visible_layers):
-            for x, y, surf in layer.tiles():
-                key = str(x) + ';' + str(y)
-                if key not in self.tilemap:
-                    self.tilemap[key] = []
-                # handle layers from tiled
-                if layer.name == 'Ground':
-                    pass
-                        
+        self.tmx_data = pytmx.load_pygame(tmx_path)
+        self.width, self.height = self.tmx_data.width, self.tmx_data.height
+        layers = [layer for layer in self.tmx_data.visible_layers if isinstance(layer, pytmx.TiledTileLayer)]
+        self.grid = ChunkedGrid(layers=max(1, len(layers)))
+
+        # Map every gid pytmx loaded to a compact tile id once, instead of per cell, with the flags of the
+        # properties pytmx parsed for it
+        self.set_kind_flags()
+        tile_ids = {}
+        for gid, tiled_gid in self.tmx_data.tiledgidmap.items():
+            local_id = tiled_gid - max(ts.firstgid for ts in self.tmx_data.tilesets if ts.firstgid <= tiled_gid)
+            if local_id < len(TILESET_TYPES):
+                flags = property_flags(self.tmx_data.get_tile_properties_by_gid(gid) or {})
+                tile_ids[gid] = self.flagged_kind_id(TILESET_TYPES[local_id], flags)
+
+        # Iterate through the layers and fill the grid, indexing the sparse kinds on the way
+        indexed_ids = {tile_id for tile_id in tile_ids.values() if self.indexed(tile_id)}
+        for layer_index, layer in enumerate(layers):
+            for x, y, gid in layer.iter_data():
+                if gid in tile_ids:
+                    tile_id = tile_ids[gid]
+                    self.grid.set(x, y, layer_index, tile_id)
+                    if tile_id in indexed_ids:
+                        self.index_tile(x, y, layer_index, tile_id)
+
+        self.extract_markers()
+
+    def compiled_meta(self):
+        return {
+            'width': self.width,
+            'height': self.height,
+            'layers': self.grid.layers,
+            'kinds': self.grid.kinds[1:],
+            'kind_flags': self.kind_flags,
+            'markers': self.markers,
+            'index': [[tile_id, list(positions)] for tile_id, positions in self.tile_index.items()],
+            'offgrid_tiles': self.offgrid_tiles,
+            'chunks': sorted(self.grid.chunks),  # Order of the chunks in the tiles and flags sections
+            'counts': [self.grid.counts[key] for key in sorted(self.grid.chunks)],
+        }
+
+    def compiled_sections(self):
+        # Chunk tile ids and the collision cache, so loading the compiled level recomputes neither
+        keys = sorted(self.grid.chunks)
+        solid = array('i', [v for cell in self.solid_rects for v in cell])
+        one_way = array('i', [v for cell in self.one_way_cells for v in cell])
+        return {
+            'tiles': b''.join(self.grid.chunks[key].tobytes() for key in keys),
+            'flags': b''.join(self.flags[key] for key in keys),
+            'solid': solid,
+            'one_way': one_way,
+        }
+
+    def load_compiled(self, compiled):
+        # Install every chunk with its flags straight from the compiled sections
+        self.load_compiled_meta(compiled)
+        grid = self.grid
+        ts, area = self.tile_size, grid.chunk_area
+        length = grid.layers * area
+        tiles = compiled.array('tiles', 'H')
+        flags = compiled.section('flags')
+        for i, (key, count) in enumerate(zip(compiled.meta['chunks'], compiled.meta['counts'])):
+            key = tuple(key)
+            grid.chunks[key] = tiles[i * length:(i + 1) * length]
+            grid.counts[key] = count
+            self.flags[key] = bytearray(flags[i * area:(i + 1) * area])
+            self.touch_chunk(key)
+        solid = compiled.array('solid', 'i')
+        self.solid_rects = SolidRects(ts, zip(solid[0::2], solid[1::2]))
+        one_way = compiled.array('one_way', 'i')
+        self.one_way_cells = set(zip(one_way[0::2], one_way[1::2]))
+
+    def load_compiled_meta(self, compiled, stream=False):
+        meta = compiled.meta
+        self.width, self.height = meta['width'], meta['height']
+        self.grid = ChunkedGrid(layers=meta['layers'])
+        for tile_type, variant in meta['kinds']:
+            self.grid.add_kind(tile_type, variant)
+        self.kind_flags = meta['kind_flags']
+        self.markers = {tile_type: [tuple(pos) for pos in positions] for tile_type, positions in meta['markers'].items()}
+        # A streamed level indexes its chunks as they come in
+        if not stream:
+            self.tile_index = {tile_id: {tuple(pos): None for pos in positions} for tile_id, positions in meta['index']}
+        self.offgrid_tiles = meta['offgrid_tiles']
+
+    def build_collision_cache(self):
+        # Build the flag grid, and one Rect per solid cell up front so collision queries never allocate
+        self.flags = {}
+        self.solid_rects = SolidRects(self.tile_size)
+        self.one_way_cells = set()
+        for key in self.grid.chunks:
+            self.update_collision_chunk(key)
+
+    def touch_chunk(self, key):
+        # A chunk's solid cells changed, its neighbours' border cells see different neighbours too
+        self.collision_epoch += 1
+        versions = self.collision_versions
+        for dx, dy in ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)):
+            neighbor = (key[0] + dx, key[1] + dy)
+            versions[neighbor] = versions.get(neighbor, 0) + 1
+
+    def update_collision_chunk(self, key):
+        # Combine the flags of every layer of a chunk into its flag array, then add the solid cells' rects
+        grid = self.grid
+        self.touch_chunk(key)
+        kind_flags = self.kind_flags
+        chunk = grid.chunks[key]
+        size, area, ts = grid.chunk_size, grid.chunk_area, self.tile_size
+        flags = bytearray(area)
+        if any(kind_flags):
+            for layer in range(grid.layers):
+                base = layer * area
+                for i in range(area):
+                    tile_id = chunk[base + i]
+                    if tile_id:
+                        flags[i] |= kind_flags[tile_id]
+        self.flags[key] = flags
+        for i in range(area):
+            if flags[i] & (SOLID | ONE_WAY):
+                x, y = key[0] * size + i % size, key[1] * size + i // size
+                if flags[i] & SOLID:
+                    if (x, y) not in self.solid_rects:
+                        self.solid_rects[(x, y)] = pygame.Rect(x * ts, y * ts, ts, ts)
+                else:
+                    self.one_way_cells.add((x, y))
+
+    def update_collision_cell(self, x, y):
+        grid = self.grid
+        key = (x >> grid.shift, y >> grid.shift)
+        cell_flags = 0
+        for layer, tile_id in grid.cell(x, y):
+            cell_flags |= self.kind_flags[tile_id]
+        if key not in self.flags:
+            self.flags[key] = bytearray(grid.chunk_area)
+        index = ((y & grid.mask) << grid.shift) + (x & grid.mask)
+        if (self.flags[key][index] ^ cell_flags) & LADDER:
+            self.touch_chunk(key)  # The nav graph links climbs along ladders
+        self.flags[key][index] = cell_flags
+
+        one_way = (x, y) in self.one_way_cells
+        if cell_flags & ONE_WAY and not cell_flags & SOLID:
+            self.one_way_cells.add((x, y))
+        else:
+            self.one_way_cells.discard((x, y))
+        if one_way != ((x, y) in self.one_way_cells):
+            self.touch_chunk(key)  # The nav graph stands on one-way cells too
+        if cell_flags & SOLID:
+            if (x, y) not in self.solid_rects:
+                self.solid_rects[(x, y)] = pygame.Rect(x * self.tile_size, y * self.tile_size, self.tile_size, self.tile_size)
+                self.touch_chunk(key)
+        elif (x, y) in self.solid_rects:
+            del self.solid_rects[(x, y)]
+            self.touch_chunk(key)
 
     def extract(self, id_pairs, keep=False):
         matches = []
-        for tile in self.offgrid_tiles.copy():
-            if (tile['type'], tile['variant']) in id_pairs:
-                matches.append(tile.copy())
-                if not keep:
-                    self.offgrid_tiles.remove(tile)
-
-        for loc in list(self.tilemap.keys()):
-            for tile in self.tilemap[loc]:
+        if self.offgrid_tiles:
+            kept = []
+            for tile in self.offgrid_tiles:
                 if (tile['type'], tile['variant']) in id_pairs:
-                    match = tile.copy()
-                    match['pos'] = list(match['pos'])
-                    match['pos'][0] *= self.tile_size
-                    match['pos'][1] *= self.tile_size
-                    matches.append(match)
-                    if not keep:
-                        self.tilemap[loc].remove(tile)
-                        if not self.tilemap[loc]:  # Remove the key if the list is empty
-                            del self.tilemap[loc]
+                    matches.append(tile.copy())
+                    if keep:
+                        kept.append(tile)
+                else:
+                    kept.append(tile)
+            self.offgrid_tiles = kept
+
+        # Indexed kinds come straight from the index, anything else needs a scan of the grid
+        kinds = self.grid.kinds
+        wanted = {tile_id for tile_id in range(1, len(kinds)) if kinds[tile_id] in id_pairs}
+        found = []
+        for tile_id in wanted:
+            if self.indexed(tile_id):
+                found.extend((x, y, layer, tile_id) for x, y, layer in self.tile_index.get(tile_id, ()))
+        scanned = {tile_id for tile_id in wanted if not self.indexed(tile_id)}
+        if scanned:
+            found.extend(tile for tile in self.grid.iter_tiles() if tile[3] in scanned)
+
+        for x, y, layer, tile_id in found:
+            match = self.tile_dict(x, y, layer, tile_id)
+            match['pos'] = [x * self.tile_size, y * self.tile_size]
+            matches.append(match)
+            if not keep:
+                self.grid.set(x, y, layer, 0)
+                self.tile_index.get(tile_id, {}).pop((x, y, layer), None)
+                self.update_collision_cell(x, y)
+                self.dirty_chunks.add((x >> self.grid.shift, y >> self.grid.shift))
+                if self.streamer is not None:
+                    self.streamer.edited.add((x >> self.grid.shift, y >> self.grid.shift))
 
         return matches
-    
-    def get_player_spawn(self):
-        return self.player_pos
+
+    def get_player_spawn(self, e_type='light'):
+        # Pixel position a player of the given type spawns at
+        x, y = self.markers.get(e_type, [(0, 0)])[0]
+        return (x * self.tile_size, y * self.tile_size)
 
     def tiles_arounds(self, pos):
         tiles = []
-        tile_loc = (int(pos[0] // self.tile_size), int(pos[1] // self.tile_size))
+        tile_x, tile_y = int(pos[0] // self.tile_size), int(pos[1] // self.tile_size)
         for offset in NEIGHBORS_OFFSETS:
-            check_loc = str(tile_loc[0] + offset[0]) + ';' + str(tile_loc[1] + offset[1])
-            if check_loc in self.tilemap:
-                tiles.extend(self.tilemap[check_loc])
+            tiles.extend(self.tiles_at(tile_x + offset[0], tile_y + offset[1]))
         return tiles
-    
+
     def physics_rects_around(self, pos, entity_size):
         """
         Find all physics-related rectangles around the given position
@@ -75,8 +568,12 @@ class Tilemap:
         :param pos: Position of the entity (x, y).
         :param entity_size: Size of the entity (width, height).
         :return: List of pygame.Rect representing the physics collision boxes.
+                 The list and the rects are shared cache objects: iterate them
+                 before the next call and never modify them.
         """
-        rects = []
+        rects = self.rects_buffer
+        rects.clear()
+        solid_rects = self.solid_rects
         # Calculate the number of tiles the entity covers
         start_tile_x = int(pos[0] // self.tile_size)
         end_tile_x = int((pos[0] + entity_size[0]) // self.tile_size) + 1
@@ -85,41 +582,117 @@ class Tilemap:
 
         for x in range(start_tile_x, end_tile_x):
             for y in range(start_tile_y, end_tile_y):
-                check_loc = f"{x};{y}"
-                if check_loc in self.tilemap:
-                    for tile in self.tilemap[check_loc]:
-                        if tile['type'] in PHYSICS_TILE_TYPES:
-                            rect = pygame.Rect(
-                                tile['pos'][0] * self.tile_size,
-                                tile['pos'][1] * self.tile_size,
-                                tile.get('width', self.tile_size),
-                                tile.get('height', self.tile_size)
-                            )
-                            rects.append(rect)
+                rect = solid_rects.get((x, y))
+                if rect is not None:
+                    rects.append(rect)
         return rects
-    
-    def ladders_around(self, pos):
-        ladders = []
-        for tile in self.tiles_arounds(pos):
-            if tile['type'] in INTRERACTABLE_TILE_TYPES:
-                ladders.append(pygame.Rect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size, self.tile_size))
-        return ladders
-    
-    def interaction_rects_around(self, pos):
+
+    def sweep(self, x, y, w, h, dx, dy):
+        """
+        Sweep a box along (dx, dy) through the solid tiles, DDA style: only the columns
+        and rows the box's leading edges cross are visited, in the order they are crossed,
+        so no move is ever long enough to tunnel through a tile.
+
+        :param x, y, w, h: The box at the start of the move, in pixels.
+        :param dx, dy: The move, in pixels.
+        :return: SweepHit for the first solid tile the box runs into, or None. The hit is the
+                 tilemap's shared sweep_hit, read it before the next call.
+        """
+        ts = self.tile_size
+        solid_rects = self.solid_rects
+        one_way_cells = self.one_way_cells
+        inf = float('inf')
+
+        # Time of the next column / row boundary crossed by the leading edge, and the cell entered there
+        if dx > 0:
+            boundary = math.ceil((x + w) / ts) * ts
+            tx, col, step_x, dtx = (boundary - x - w) / dx, boundary // ts, 1, ts / dx
+        elif dx < 0:
+            boundary = math.floor(x / ts) * ts
+            tx, col, step_x, dtx = (boundary - x) / dx, boundary // ts - 1, -1, -ts / dx
+        else:
+            tx = inf
+        if dy > 0:
+            boundary = math.ceil((y + h) / ts) * ts
+            ty, row, step_y, dty = (boundary - y - h) / dy, boundary // ts, 1, ts / dy
+        elif dy < 0:
+            boundary = math.floor(y / ts) * ts
+            ty, row, step_y, dty = (boundary - y) / dy, boundary // ts - 1, -1, -ts / dy
+        else:
+            ty = inf
+
+        while True:
+            if tx <= ty:
+                if tx > 1:
+                    return None
+                # Entering a new column: check the rows the box spans at that moment
+                top = y + dy * tx
+                for r in range(math.floor(top / ts), math.ceil((top + h) / ts)):
+                    if (col, r) in solid_rects:
+                        return self.sweep_hit.set(tx, -step_x, 0, col, r)
+                col += step_x
+                tx += dtx
+            else:
+                if ty > 1:
+                    return None
+                left = x + dx * ty
+                for c in range(math.floor(left / ts), math.ceil((left + w) / ts)):
+                    # One-way platforms only stop boxes landing on them from above
+                    if (c, row) in solid_rects or (step_y > 0 and (c, row) in one_way_cells):
+                        return self.sweep_hit.set(ty, 0, -step_y, c, row)
+                row += step_y
+                ty += dty
+
+    def interactables_around(self, pos, mask=LADDER | DOOR):
+        # Rects of the cells around pos with any of the flags in mask
         rects = []
-        for tile in self.tiles_arounds(pos):
-            if tile['type'] in INTRERACTABLE_TILE_TYPES:
-                rects.append(pygame.Rect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size, self.tile_size))
+        tile_x, tile_y = int(pos[0] // self.tile_size), int(pos[1] // self.tile_size)
+        for offset in NEIGHBORS_OFFSETS:
+            x, y = tile_x + offset[0], tile_y + offset[1]
+            if self.flags_at(x, y) & mask:
+                rects.append(pygame.Rect(x * self.tile_size, y * self.tile_size, self.tile_size, self.tile_size))
         return rects
 
+    def ladders_around(self, pos):
+        return self.interactables_around(pos, LADDER)
+
+    def interaction_rects_around(self, pos):
+        return self.interactables_around(pos, DOOR)
+
+    def bake_chunk(self, key):
+        # Composite every tile of a chunk, layer by layer, into a single surface
+        grid = self.grid
+        chunk = grid.chunks.get(key)
+        if chunk is None:
+            self.chunk_surfaces.pop(key, None)
+            return
+        size = grid.chunk_size
+        surf = pygame.Surface((size * self.tile_size, size * self.tile_size))
+        for layer in range(grid.layers):
+            base = layer * grid.chunk_area
+            for i in range(grid.chunk_area):
+                tile_id = chunk[base + i]
+                if tile_id:
+                    tile_type, variant = grid.kinds[tile_id]
+                    surf.blit(self.game.assets[tile_type][variant], (i % size * self.tile_size, i // size * self.tile_size))
+        # Black is transparent, same as load_image
+        surf.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+        self.chunk_surfaces[key] = surf
+
     def render(self, surf, offset=(0, 0)):
         # Offgrid tiles will need to be optimized for larger games
         for tile in self.offgrid_tiles:
             surf.blit(self.game.assets[tile['type']][tile['variant']], (tile['pos'][0] - offset[0], tile['pos'][1] - offset[1]))
 
-        for x in range(offset[0] // self.tile_size, (offset[0] + surf.get_width()) // self.tile_size + 1):
-            for y in range(offset[1] // self.tile_size, (offset[1] + surf.get_height()) // self.tile_size + 1):
-                loc = str(x) + ';' + str(y)
-                if loc in self.tilemap:
-                    for tile in sorted(self.tilemap[loc], key=lambda t: t['layer']):
-                        surf.blit(self.game.assets[tile['type']][tile['variant']], (x * self.tile_size - offset[0], y * self.tile_size - offset[1]))
\ No newline at end of file
+        chunk_px = self.grid.chunk_size * self.tile_size
+        offset_x, offset_y = int(offset[0]), int(offset[1])
+        dirty_chunks = self.dirty_chunks
+        for cx in range(offset_x // chunk_px, (offset_x + surf.get_width()) // chunk_px + 1):
+            for cy in range(offset_y // chunk_px, (offset_y + surf.get_height()) // chunk_px + 1):
+                # Chunks are baked when first seen, and re-baked only if their tiles changed since
+                if (cx, cy) in dirty_chunks:
+                    self.bake_chunk((cx, cy))
+                    dirty_chunks.discard((cx, cy))
+                chunk_surf = self.chunk_surfaces.get((cx, cy))
+                if chunk_surf is not None:
+                    surf.blit(chunk_surf, (cx * chunk_px - offset_x, cy * chunk_px - offset_y))
@@ -1,51 +1,265 @@
 import pygame
 import re
 import os
+import json
+import asyncio
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 
 BASE_IMG_PATH = "graphics/"
+ATLAS_PATH = BASE_IMG_PATH + "atlas/"
+
+
+# Sprites packed by helper_functions/atlas_builder.py. Images listed in the manifest are handed out
+# as subsurfaces of a shared atlas page, anything else falls back to loading its own PNG.
+class Atlas:
+    def __init__(self, path=ATLAS_PATH):
+        self.path = path
+        self.sprites = {}
+        self.page_names = []
+        self.pages = {}  # Page index -> converted atlas surface, loaded on first use
+        manifest_path = path + 'manifest.json'
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            self.sprites = manifest['sprites']
+            self.page_names = manifest['atlases']
+
+    def page(self, index):
+        if index not in self.pages:
+            page = decoded_image(self.path + self.page_names[index]).convert()
+            page.set_colorkey((0, 0, 0))
+            self.pages[index] = page
+        return self.pages[index]
+
+    def get(self, path):
+        sprite = self.sprites.get(path)
+        if sprite is None:
+            return None
+        img = self.page(sprite['atlas']).subsurface(sprite['rect'])
+        img.set_colorkey((0, 0, 0))
+        return img
+
+    def source_file(self, path):
+        # File holding the pixels of a sprite: its atlas page when packed, otherwise its own PNG
+        sprite = self.sprites.get(path)
+        if sprite is None:
+            return BASE_IMG_PATH + path
+        return self.path + self.page_names[sprite['atlas']]
+
+    def listdir(self, path):
+        # File names of the packed sprites directly inside a directory
+        prefix = path.rstrip('/') + '/'
+        return [name[len(prefix):] for name in self.sprites if name.startswith(prefix) and '/' not in name[len(prefix):]]
+
+
+_atlas = None
+_decoder = None
+_decoded = {}  # File path -> surface decoded by the thread pool, not converted yet
+_taken = set()  # Files already handed to a loader, a late decode of one of them is dropped
+_decode_lock = threading.Lock()  # Guards _decoded and _taken between the decoder threads and the main thread
+
+
+def get_atlas():
+    global _atlas
+    if _atlas is None:
+        _atlas = Atlas()
+    return _atlas
+
+
+def get_decoder():
+    # Thread pool decoding PNGs, pygame releases the GIL while it decodes
+    global _decoder
+    if _decoder is None:
+        _decoder = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix='decode')
+    return _decoder
+
+
+def decode_image(file):
+    # Runs on a decoder thread: decode only, convert() needs the display and stays on the main thread
+    with _decode_lock:
+        if file in _decoded or file in _taken:
+            return
+    img = pygame.image.load(file)
+    # The main thread may have taken the file and decoded it itself meanwhile, then nobody would pop this
+    with _decode_lock:
+        if file not in _taken:
+            _decoded[file] = img
+
+
+def decoded_image(file):
+    # Unconverted surface of a file, taken from the decoder threads' results when they got there first
+    with _decode_lock:
+        _taken.add(file)
+        img = _decoded.pop(file, None)
+    return img if img is not None else pygame.image.load(file)
+
+
+def source_files(paths):
+    # Files that have to be decoded to load the given image paths or directories of images
+    atlas = get_atlas()
+    files = set()
+    for path in paths:
+        if path.endswith('.png'):
+            files.add(atlas.source_file(path))
+        else:
+            files.update(atlas.source_file(path + '/' + name) for name in image_names(path))
+    return files
+
+
+def image_names(path):
+    def extract_number(f):
+        return int(re.search(r'(\d+)', f).group(0))
+
+    # The manifest already knows the directory contents, only hit the disk for unpacked sprites
+    names = get_atlas().listdir(path) or os.listdir(BASE_IMG_PATH + path)
+    return sorted([f for f in names if f.endswith('.png')], key=extract_number)
 
 
 def load_image(path):
-    img = pygame.image.load(BASE_IMG_PATH + path).convert()
+    img = get_atlas().get(path)
+    if img is not None:
+        return img
+    img = decoded_image(BASE_IMG_PATH + path).convert()
     img.set_colorkey((0, 0, 0))
     return img
 
 def load_images(path):
-    images = []
+    return [load_image(path + '/' + img_name) for img_name in image_names(path)]
 
-    def extract_number(f):
-        return int(re.search(r'(\d+)', f).group(0))
-    
-    img_names = sorted([f for f in os.listdir(BASE_IMG_PATH + path) if f.endswith('.png')],
-                       key=extract_number)
-    for img_name in img_names:
-        if img_name.endswith('.png'):
-            images.append(load_image(path + '/' + img_name).convert())
-    return images
+
+# Loaders for LazyAssets that also tell the asset pipeline which files they read, so those can be
+# decoded ahead of time on the thread pool
+def image_asset(path):
+    loader = lambda: load_image(path)
+    loader.sources = [path]
+    return loader
+
+def images_asset(path):
+    loader = lambda: load_images(path)
+    loader.sources = [path]
+    return loader
+
+def animation_asset(path, **kwargs):
+    loader = lambda: Animation(load_images(path), **kwargs)
+    loader.sources = [path]
+    return loader
+
+
+# Asset table that only loads an entry the first time it is looked up
+class LazyAssets(Mapping):
+    def __init__(self, loaders):
+        self.loaders = dict(loaders)  # Key -> zero-argument callable producing the asset
+        self.loaded = {}
+
+    def __getitem__(self, key):
+        if key not in self.loaded:
+            self.loaded[key] = self.loaders[key]()
+        return self.loaded[key]
+
+    def __setitem__(self, key, value):
+        self.loaded[key] = value
+
+    def __iter__(self):
+        return iter(self.loaders.keys() | self.loaded.keys())
+
+    def __len__(self):
+        return len(self.loaders.keys() | self.loaded.keys())
+
+    def preload(self, keys=None):
+        for key in keys if keys is not None else list(self.loaders):
+            self[key]
+
+    def sources(self, keys):
+        # Image paths read by the loaders of keys that aren't loaded yet
+        return [path for key in keys if key not in self.loaded for path in getattr(self.loaders[key], 'sources', ())]
+
+    async def load_async(self, keys, on_progress=None):
+        """
+        Load keys with every file they need decoded in parallel on the decoder pool,
+        then converted and built on the calling (main) thread one asset at a time.
+
+        :param on_progress: Called with (done, total) after every decoded file and built asset.
+        """
+        loop = asyncio.get_running_loop()
+        keys = [key for key in keys if key not in self.loaded]
+        jobs = [loop.run_in_executor(get_decoder(), decode_image, file) for file in source_files(self.sources(keys))]
+        total, done = len(jobs) + len(keys), 0
+        for job in asyncio.as_completed(jobs):
+            await job
+            done += 1
+            if on_progress:
+                on_progress(done, total)
+        for key in keys:
+            self[key]
+            done += 1
+            if on_progress:
+                on_progress(done, total)
+            await asyncio.sleep(0)  # Let the loading screen draw between assets
+
+    def prefetch(self, keys=None):
+        # Start decoding the files of keys in the background without waiting, lookups pick them up later
+        decoder = get_decoder()
+        for file in source_files(self.sources(keys if keys is not None else list(self.loaders))):
+            if file not in _decoded and file not in _taken:
+                decoder.submit(decode_image, file)
+
+def flip_frame(img):
+    return pygame.transform.flip(img, True, False)
+
+def fade_frame(alpha):
+    # Transform for Animation.add_variant producing frames drawn at a fixed alpha
+    def fade(img):
+        faded = img.copy()
+        faded.set_alpha(alpha)
+        return faded
+    return fade
+
+def tint_frame(color):
+    # Transform for Animation.add_variant multiplying the frames by a color
+    def tint(img):
+        tinted = img.copy()
+        tinted.fill(color, special_flags=pygame.BLEND_RGB_MULT)
+        return tinted
+    return tint
 
 class Animation:
-    def __init__ (self, images, img_dur=5, loop=True):
+    def __init__ (self, images, img_dur=5, loop=True, variants=None):
         self.images = images
         self.img_duration = img_dur
         self.loop = loop
         self.done = False
         self.frame = 0
+        # Variant key -> (frames, horizontally flipped frames). Built once and shared by every copy
+        # so rendering never has to transform a surface per frame
+        if variants is None:
+            variants = {None: (images, [flip_frame(img) for img in images])}
+        self.variants = variants
 
     def copy(self):
-        return Animation(self.images, self.img_duration, self.loop)
-    
+        return Animation(self.images, self.img_duration, self.loop, self.variants)
+
+    def add_variant(self, key, transform):
+        # Precompute a derived set of frames, e.g. add_variant(('alpha', 128), fade_frame(128))
+        if key not in self.variants:
+            frames = [transform(img) for img in self.images]
+            self.variants[key] = (frames, [flip_frame(img) for img in frames])
+
     def update(self):
-        if self.loop:
-            self.frame = (self.frame + 1) % (len(self.images) * self.img_duration)
-        else:
-            if not self.done:
-                self.frame += 1
-                if self.frame >= len(self.images) * self.img_duration - 1:
-                    self.done = True
-                    self.frame = len(self.images) * self.img_duration - 1
+        if not self.done:
+            self.frame = self.next_frame(self.frame)
+            self.done = not self.loop and self.frame == len(self.images) * self.img_duration - 1
 
-    def img(self):
-        return self.images[int(self.frame) // self.img_duration]
-    
+    def img(self, flip=False, variant=None):
+        return self.frame_img(self.frame, flip, variant)
 
+    # Stateless versions of update() and img() for callers keeping their own frame counter, so one
+    # Animation can be shared instead of copied per entity
+    def next_frame(self, frame):
+        if self.loop:
+            return (frame + 1) % (len(self.images) * self.img_duration)
+        return min(frame + 1, len(self.images) * self.img_duration - 1)
 
+    def frame_img(self, frame, flip=False, variant=None):
+        return self.variants[variant][bool(flip)][int(frame) // self.img_duration]
@@ -0,0 +1,218 @@
+import argparse
+import multiprocessing as mp
+import os
+import time
+import traceback
+import numpy as np
+import pygame
+from main import DISPLAY_SIZE
+
+# Runs many headless Games side by side for automated playtesting. Games are spread over a pool of
+# worker processes and stepped in lockstep: actions go in and observations come out through numpy
+# arrays in shared memory, so a step only sends a short command down each worker's pipe.
+#
+#   env = VectorEnv(16)
+#   obs = env.reset()
+#   actions = np.zeros((16, 2, 2), np.float32)  # Movement tuple of both players, per env
+#   obs = env.step(actions)
+#   obs['players'][:, 0, :2]  # Light player positions
+#   env.reset(np.flatnonzero(obs['done']))  # Envs keep stepping after their player dies unless reset
+#   env.close()
+
+MAX_ENEMIES = 64  # Enemies past this many are left out of the observation
+ENTITY_FIELDS = 5  # x, y, x velocity, y velocity, health
+
+
+def observation_dtype(frame_scale):
+    # One record per env. The frame is the display downsampled by frame_scale, rows first, RGB
+    fields = [('tick', np.int64), ('done', np.bool_),
+              ('players', np.float32, (2, ENTITY_FIELDS)),
+              ('enemy_count', np.int32), ('enemies', np.float32, (MAX_ENEMIES, ENTITY_FIELDS))]
+    if frame_scale:
+        fields.append(('frame', np.uint8, (DISPLAY_SIZE[1] // frame_scale, DISPLAY_SIZE[0] // frame_scale, 3)))
+    return np.dtype(fields)
+
+
+def write_observation(obs, i, game, frame_scale):
+    obs['tick'][i] = game.tick
+    obs['done'][i] = game.player1.dead
+    for row, entity in zip(obs['players'][i], (game.player1, game.player2)):
+        row[:] = (entity.pos[0], entity.pos[1], entity.velocity[0], entity.velocity[1], entity.health)
+    enemies = game.enemies[:MAX_ENEMIES]
+    obs['enemy_count'][i] = len(enemies)
+    rows = obs['enemies'][i]
+    for row, entity in zip(rows, enemies):
+        row[:] = (entity.pos[0], entity.pos[1], entity.velocity[0], entity.velocity[1], entity.health)
+    rows[len(enemies):] = 0
+    if frame_scale:
+        # Nearest neighbour downsample straight from the display's pixels, no intermediate surface
+        pixels = pygame.surfarray.pixels3d(game.display)
+        obs['frame'][i] = pixels[::frame_scale, ::frame_scale][:DISPLAY_SIZE[0] // frame_scale, :DISPLAY_SIZE[1] // frame_scale].transpose(1, 0, 2)
+        del pixels  # Unlock the display
+
+
+def worker(conn, obs_buffer, action_buffer, num_envs, first, count, config):
+    # Hosts envs first .. first + count - 1 and steps them whenever the parent says so. Every command
+    # is answered with None, or ('error', traceback) if it raised, which the parent re-raises
+    obs = np.frombuffer(obs_buffer, observation_dtype(config['frame_scale']), num_envs)
+    actions = np.frombuffer(action_buffer, np.float32).reshape(num_envs, 2, 2)
+    frame_scale = config['frame_scale']
+    games = []
+    error = None
+    try:
+        from main import Game
+        for i in range(first, first + count):
+            games.append(Game(headless=True, render_every=0, batched_enemies=config['batched_enemies'], seed=config['seed'] + i))
+    except Exception:
+        error = traceback.format_exc()  # Reported in reply to every command until closed
+
+    def reset(i, game):
+        game.load_level(config['level'])
+        if frame_scale:
+            game.render()
+        write_observation(obs, i, game, frame_scale)
+
+    def step(i, game, ticks):
+        movement = actions[i].tolist()
+        inputs = (tuple(movement[0]), tuple(movement[1]))
+        for _ in range(ticks):
+            game.step(inputs)
+        if config['auto_reset'] and game.player1.dead:
+            reset(i, game)
+            obs['done'][i] = True  # The observation is already the new episode's first
+            return
+        if frame_scale and game.tick % config['render_every'] < ticks:
+            game.render()
+        write_observation(obs, i, game, frame_scale)
+
+    while True:
+        command, arg = conn.recv()
+        if command == 'close':
+            conn.close()
+            return
+        if error is not None:
+            conn.send(('error', error))
+            continue
+        try:
+            if command == 'reset':
+                for i, game in enumerate(games, first):
+                    if arg is None or i in arg:
+                        reset(i, game)
+            elif command == 'step':
+                for i, game in enumerate(games, first):
+                    step(i, game, arg)
+            conn.send(None)
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+
+
+class VectorEnv:
+    def __init__(self, num_envs, workers=None, level='level_1', frame_scale=4, render_every=1, seed=0, batched_enemies=False, auto_reset=False):
+        """
+        Start num_envs headless Games on a pool of worker processes.
+
+        :param workers: Worker processes, defaults to the CPU count. Envs are split evenly between them.
+        :param frame_scale: Display downsampling of the observed frame, 0 leaves frames out (and never renders).
+        :param render_every: Render the frame every N ticks, the observation keeps the last one in between.
+        :param seed: Env i runs with seed + i.
+        :param auto_reset: Reload the level of an env as soon as its player dies. Its done flag is set for that
+            one step and the observation is the new episode's first. Without it, callers reset done envs themselves.
+        """
+        self.num_envs = num_envs
+        self.dtype = observation_dtype(frame_scale)
+        self.obs_buffer = mp.RawArray('b', self.dtype.itemsize * num_envs)
+        self.action_buffer = mp.RawArray('f', num_envs * 4)
+        self.observations = np.frombuffer(self.obs_buffer, self.dtype, num_envs)  # Shared, overwritten by every step
+        self.actions = np.frombuffer(self.action_buffer, np.float32).reshape(num_envs, 2, 2)
+        config = {'level': level, 'frame_scale': frame_scale, 'render_every': max(1, render_every),
+                  'seed': seed, 'batched_enemies': batched_enemies, 'auto_reset': auto_reset}
+
+        workers = max(1, min(workers or os.cpu_count() or 1, num_envs))
+        self.connections = []
+        self.processes = []
+        first = 0
+        for w in range(workers):
+            count = num_envs // workers + (w < num_envs % workers)
+            parent, child = mp.Pipe()
+            process = mp.Process(target=worker, args=(child, self.obs_buffer, self.action_buffer, num_envs, first, count, config), daemon=True)
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+            first += count
+
+        self.steps = 0  # Env ticks simulated by step(), summed over every env
+        self.step_time = 0.0  # Wall time spent in step()
+
+    def broadcast(self, command, arg=None):
+        for conn in self.connections:
+            conn.send((command, arg))
+        errors = []
+        for w, (conn, process) in enumerate(zip(self.connections, self.processes)):
+            # Poll so a worker that died without replying raises instead of blocking forever
+            while not conn.poll(1.0):
+                if not process.is_alive():
+                    raise RuntimeError(f'VectorEnv worker {w} exited with code {process.exitcode} during {command}')
+            reply = conn.recv()
+            if reply is not None:
+                errors.append(f'VectorEnv worker {w} failed during {command}:\n{reply[1]}')
+        if errors:  # Raised once every worker has replied, so the pipes stay in sync
+            raise RuntimeError('\n'.join(errors))
+
+    def reset(self, indices=None):
+        # Reload the level of the given envs, or all of them. Returns the shared observation array
+        self.broadcast('reset', None if indices is None else set(indices))
+        return self.observations
+
+    def step(self, actions, ticks=1):
+        """
+        Advance every env by the same number of ticks.
+
+        :param actions: (num_envs, 2, 2) movement tuples of both players, held for all the ticks.
+        :return: The shared observation array, valid until the next step or reset. Envs whose done flag
+            is set keep stepping a dead player until reset, unless the VectorEnv auto-resets.
+        """
+        start = time.perf_counter()
+        self.actions[:] = actions
+        self.broadcast('step', ticks)
+        self.step_time += time.perf_counter() - start
+        self.steps += self.num_envs * ticks
+        return self.observations
+
+    def steps_per_second(self):
+        return self.steps / self.step_time if self.step_time else 0.0
+
+    def close(self):
+        for conn in self.connections:
+            try:
+                conn.send(('close', None))
+            except OSError:
+                pass  # Worker already gone
+        for process in self.processes:
+            process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Step many headless games in lockstep with random inputs and report throughput')
+    parser.add_argument('--envs', type=int, default=8)
+    parser.add_argument('--workers', type=int, help='worker processes, defaults to the CPU count')
+    parser.add_argument('--steps', type=int, default=600, help='lockstep steps to run')
+    parser.add_argument('--level', default='level_1')
+    parser.add_argument('--frame-scale', type=int, default=4, help='observed frame downsampling, 0 for no frames')
+    parser.add_argument('--render-every', type=int, default=1, help='render the observed frame every N ticks')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    with VectorEnv(args.envs, args.workers, args.level, args.frame_scale, args.render_every, args.seed) as env:
+        env.reset()
+        for _ in range(args.steps):
+            actions = np.zeros((args.envs, 2, 2), np.float32)
+            actions[:, :, 0] = rng.integers(-1, 2, (args.envs, 2))
+            env.step(actions)
+        print(f'{args.envs} envs on {len(env.processes)} workers: {env.steps} steps at {env.steps_per_second():.0f} steps/s')